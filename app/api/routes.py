@@ -1,55 +1,189 @@
 import os
-import time
-import hashlib
+import json
+import signal
 import asyncio
+import contextlib
+import hmac
+import hashlib
+import time
 import logging
 import traceback
 from functools import lru_cache
 
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
-from app.core.workflow import create_workflow
-from app.models.graph_state import GraphState
-from app.core.logger import DebugLogger
-from app.core.request_context import new_request_id
-from app.core.guardrails import check_input
-from app.core.config import LLM_PROVIDER, GEMINI_MODEL, QWEN_MODEL
+from app.core.batch import BatchRun
+from app.models.graph_state import initial_state
+from app.core.log_pipeline import log_pipeline
+from app.core.llm_utils import preload_provider
+from app.core.memory import memory_report, master_pid, is_prefork_worker
+from app.core.snapshot import load_snapshot, save_snapshot, save_worker_part
+from app.core.profiling import maybe_profile, summarize_profiles
+from app.core.logger import DebugLogger, debug_logger_var, span, note_cache, stage_histograms
+from app.core.request_context import new_request_id, set_deadline
+from app.core.refresh import RefreshAhead
+from app.core.answer_sources import public, is_fresh, with_sources, seed_state
+from app.core.guardrails import validate_query
+from app.core.config import (
+    LLM_PROVIDER, GEMINI_MODEL, QWEN_MODEL, REQUEST_DEADLINE_SECONDS, MAX_REQUEST_DEADLINE_SECONDS,
+    BATCH_MAX_QUERIES, BATCH_CONCURRENCY, PROFILE_HEADER, CACHE_SNAPSHOT_PATH, CACHE_SNAPSHOT_ON_SHUTDOWN, ADMIN_TOKEN,
+    REFRESH_AHEAD, REFRESH_LEAD_SECONDS,
+)
+from app.core.product_store import product_store
+from app.core.response_cache import response_cache, analysis_cache
+from app.core.llm_cache import llm_cache
+from app.core.admission import admission, Overloaded
+from app.core.coalesce import coalescer
+from app.core.jobs import JobManager, QueueFull
+from app.core.semantic_cache import near_duplicates, plan_key, semantic_stats
+from app.core.product_index import product_index
+from nodes.supervisor_agent import planner_stats, draft_plan
 
 logger = logging.getLogger(__name__)
 
 limiter = Limiter(key_func=get_remote_address)
 router = APIRouter()
-workflow = create_workflow()
+_workflow = None
+
+
+def get_workflow():
+    """The compiled graph. Built by warm_up() at startup; LangGraph is not imported before that."""
+    global _workflow
+    if _workflow is None:
+        from app.core.workflow import create_workflow
+        _workflow = create_workflow()
+    return _workflow
+
+
+_snapshot_loaded = False
+
+
+def warm_up() -> dict:
+    """
+    Startup hook: compiles the workflow, loads the selected LLM provider's SDK and restores
+    the cache snapshot (once per process tree — prefork workers inherit it). Returns timings (ms).
+    """
+    global _snapshot_loaded
+    timings = {}
+    t0 = time.perf_counter()
+    get_workflow()
+    timings["workflow_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    t0 = time.perf_counter()
+    preload_provider()
+    timings["provider_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    if not _snapshot_loaded:
+        _snapshot_loaded = True
+        t0 = time.perf_counter()
+        load_snapshot()
+        timings["snapshot_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    logger.info("Warm-up done: %s", timings)
+    return timings
+
+
+def shut_down() -> None:
+    """
+    Shutdown hook: saves the cache snapshot for the next deploy. A prefork worker saves
+    only its own part; the master merges the parts once every worker has exited.
+    """
+    if CACHE_SNAPSHOT_ON_SHUTDOWN:
+        try:
+            if is_prefork_worker():
+                save_worker_part()
+            else:
+                save_snapshot()
+        except Exception as e:
+            logger.warning("Cache snapshot on shutdown failed: %s", e)
 
-MAX_QUERY_LENGTH = 500
-CACHE_TTL = 3600  # cache results for 1 hour
 
-# In-memory response cache: query_hash → {result, timestamp}
-_cache: dict = {}
+def _require_admin(request: Request) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN not set).")
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
 
 
 def _cache_key(query: str) -> str:
     return hashlib.md5(query.lower().strip().encode()).hexdigest()
 
 
-def _get_cached(query: str):
+def _cached_entry(query: str, record: bool = True) -> tuple[str, dict | None]:
+    """
+    Exact-text lookup: (key the answer is stored under, answer or None).
+    Text entries written with a plan key point at the shared answer.
+    """
     key = _cache_key(query)
-    entry = _cache.get(key)
-    if entry and (time.time() - entry["ts"]) < CACHE_TTL:
-        return entry["result"]
-    return None
+    cached = response_cache.get(key, record)
+    if cached and "plan_key" in cached:
+        key = cached["plan_key"]
+        cached = response_cache.get(key, record)
+    return key, cached
 
 
-def _set_cache(query: str, result: dict):
-    key = _cache_key(query)
-    _cache[key] = {"result": result, "ts": time.time()}
-    # Evict oldest entries if cache grows too large
-    if len(_cache) > 500:
-        oldest = sorted(_cache.items(), key=lambda x: x[1]["ts"])[:100]
-        for k, _ in oldest:
-            del _cache[k]
+def _fresh(cached: dict | None) -> dict | None:
+    """The client-facing answer if cached is still fresh, else None."""
+    return public(cached) if cached and is_fresh(cached) else None
+
+
+def _get_cached(query: str, record: bool = True):
+    return _fresh(_cached_entry(query, record)[1])
+
+
+def _deadline_seconds(payload: dict) -> float:
+    """Client-requested budget from the payload, clamped to the server maximum."""
+    requested = payload.get("deadline_seconds")
+    if requested is None:
+        return REQUEST_DEADLINE_SECONDS
+    try:
+        seconds = float(requested)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="deadline_seconds must be a number.")
+    if seconds <= 0:
+        raise HTTPException(status_code=400, detail="deadline_seconds must be positive.")
+    return min(seconds, MAX_REQUEST_DEADLINE_SECONDS)
+
+
+def _reject_invalid(request_id: str, user_input: str) -> None:
+    error = validate_query(user_input)
+    if error:
+        if error.startswith("Query blocked"):
+            logger.warning("[%s] Guardrail blocked query: %s", request_id, error)
+        raise HTTPException(status_code=400, detail=error)
+
+
+def _build_response(result: dict) -> dict:
+    data_cut = result.get("data_cut", [])
+    return {
+        "success": True,
+        "recommendation": result.get("final_recommendation", "No recommendation generated."),
+        "agents_executed": result.get("agents_executed", []),
+        "confidence_score": result.get("confidence_score", 0),
+        "analysis_reused": bool(result.get("analysis_reused")),
+        "partial": bool(data_cut),
+        "data_cut": data_cut,
+        "cached": False,
+    }
+
+
+def _set_cache(query: str, result: dict, plan_cache_key: str | None = None):
+    """
+    Stores the answer under its plan key (shared by every phrasing of the same plan)
+    with the query text as a pointer to it; without a plan key, under the text alone.
+    result may carry its sources (see answer_sources.with_sources).
+    """
+    if plan_cache_key is None:
+        response_cache.set(_cache_key(query), result)
+        return
+    response_cache.set(plan_cache_key, result)
+    _link_query(query, plan_cache_key)
+
+
+def _link_query(query: str, plan_cache_key: str) -> None:
+    """Points the query text (and its near-duplicates) at the answer stored under plan_cache_key."""
+    response_cache.set(_cache_key(query), {"plan_key": plan_cache_key})
+    near_duplicates.add(query, plan_cache_key)
 
 
 @router.get("/health")
@@ -64,11 +198,23 @@ def health():
     if issues:
         raise HTTPException(status_code=503, detail={"status": "degraded", "issues": issues})
 
+    cache_stats = response_cache.stats()
     return {
         "status": "ok",
-        "cache_size": len(_cache),
+        "cache_size": cache_stats["entries"],
+        "route_cache": {**cache_stats, **semantic_stats.snapshot()},
+        "analysis_cache": analysis_cache.stats(),
+        "llm_cache": llm_cache.stats(),
+        "coalescing": coalescer.stats(),
+        "admission": admission.stats(),
+        "jobs": jobs.stats(),
+        "logging": log_pipeline.stats(),
+        "refresh_ahead": refresher.stats(),
         "provider": LLM_PROVIDER,
         "model": GEMINI_MODEL if LLM_PROVIDER == "gemini" else QWEN_MODEL,
+        "planner": planner_stats(),
+        "product_store": product_store.stats(),
+        "product_index": product_index.stats(),
     }
 
 
@@ -79,66 +225,307 @@ async def process_query(request: Request, payload: dict):
 
     user_input = payload.get("query", "").strip()
 
-    if not user_input:
-        raise HTTPException(status_code=400, detail="Query cannot be empty.")
-    if len(user_input) > MAX_QUERY_LENGTH:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Query exceeds {MAX_QUERY_LENGTH} character limit."
-        )
-
-    is_safe, reason = check_input(user_input)
-    if not is_safe:
-        logger.warning("[%s] Guardrail blocked query: %s", request_id, reason)
-        raise HTTPException(status_code=400, detail=f"Query blocked: {reason}")
-
-    # ── Cache hit ──
-    cached = _get_cached(user_input)
-    if cached:
-        logger.info("Cache hit for query: %s", user_input[:60])
-        return {**cached, "cached": True}
+    _reject_invalid(request_id, user_input)
+    deadline_seconds = _deadline_seconds(payload)
 
+    # Collects this request's stage spans; returned when the client asks for debug output
     debug_logger = DebugLogger()
+    debug_logger_var.set(debug_logger)
+    debug = _debug_requested(request, payload)
 
     try:
-        logger.info("[%s] Query received: %s", request_id, user_input[:100])
-
-        initial_state = GraphState(
-            input=user_input,
-            intent="",
-            products=[],
-            price_data=[],
-            review_data=[],
-            product_info=[],
-            platform_rating_data=[],
-            final_recommendation="",
-            current_step="",
-            missing_data=[],
-            collection_complete=False,
-            search_hints={},
-            confidence_score=0,
-            analysis_context="",
-            agent_plan=[],
-            agents_executed=[]
+        with span("request"):
+            cached = await asyncio.to_thread(_cached_response, user_input)
+            if cached:
+                return _with_timeline(cached, debug_logger, debug)
+
+            logger.info("[%s] Query received: %s", request_id, user_input[:100])
+            set_deadline(deadline_seconds)
+            with maybe_profile(request_id, requested=request.headers.get(PROFILE_HEADER) == "1"):
+                response = await _compute(request_id, user_input)
+        return _with_timeline(response, debug_logger, debug)
+
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=f"Server busy ({e}), retry later.",
+                            headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        logger.error("[%s] Query failed: %s", request_id, str(e), exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _debug_requested(request: Request, payload: dict) -> bool:
+    return bool(payload.get("debug")) or request.query_params.get("debug", "").lower() in ("1", "true")
+
+
+def _with_timeline(response: dict, debug_logger: DebugLogger, debug: bool) -> dict:
+    if not debug:
+        return response
+    return {**response, "timeline": debug_logger.timeline()}
+
+
+def _cached_response(user_input: str) -> dict | None:
+    """Cache hit: same text, then a near-duplicate rephrasing. No planning, no LLM calls. Blocking (SQLite)."""
+    with span("route_cache"):
+        key, cached = _cached_entry(user_input)
+        cached = _fresh(cached)
+        note_cache("route", bool(cached))
+        if cached:
+            semantic_stats.record("exact_hits")
+            _record_hit(key, user_input)
+            logger.info("Cache hit for query: %s", user_input[:60])
+            return {**cached, "cached": True}
+
+        similar_key, similarity = near_duplicates.match(user_input)
+        cached = _fresh(response_cache.get(similar_key)) if similar_key else None
+        if similar_key:
+            note_cache("near_duplicate", bool(cached))
+        if cached:
+            semantic_stats.record("near_duplicate_hits")
+            _record_hit(similar_key, user_input)
+            logger.info("Near-duplicate cache hit (similarity %.2f) for query: %s", similarity, user_input[:60])
+            return {**cached, "cached": True}
+        return None
+
+
+async def _compute(request_id: str, user_input: str, on_stage=None, can_shed: bool = True) -> dict:
+    """
+    Plans and runs the query, sharing the run with identical queries already in flight.
+    New runs need an admission slot (raises Overloaded when shed); joining one does not.
+    """
+    key = _cache_key(user_input)
+    gate = contextlib.nullcontext() if coalescer.in_flight(key) else admission.slot(can_shed)
+    async with gate:
+        response, how = await coalescer.run(
+            key,
+            lambda: _answer(request_id, user_input, on_stage),
+            lookup=lambda: _get_cached(user_input, record=False),
         )
+    if how != "leader":
+        logger.info("[%s] Coalesced (%s) with an in-flight identical query", request_id, how)
+    return response
 
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, workflow.invoke, initial_state)
 
-        recommendation = result.get("final_recommendation", "No recommendation generated.")
-        logger.info("[%s] Query complete. Confidence: %s/10", request_id, result.get("confidence_score"))
+async def _run_workflow(state: dict, on_stage=None) -> dict:
+    """Runs the graph; on_stage(node, update) is called as each node finishes."""
+    if on_stage is None:
+        return await get_workflow().ainvoke(state)
+    result = state
+    async for mode, chunk in get_workflow().astream(state, stream_mode=["updates", "values"]):
+        if mode == "values":
+            result = chunk
+            continue
+        for node, update in chunk.items():
+            on_stage(node, update)
+    return result
 
-        response = {
-            "success": True,
-            "recommendation": recommendation,
-            "agents_executed": result.get("agents_executed", []),
-            "confidence_score": result.get("confidence_score", 0),
-            "cached": False,
-        }
 
-        _set_cache(user_input, response)
+async def _answer(request_id: str, user_input: str, on_stage=None, refresh: bool = False) -> dict:
+    """refresh=True (refresh-ahead) recomputes even when the plan's answer is still cached."""
+    plan = await asyncio.to_thread(draft_plan, {"input": user_input})
+    plan_cache_key = plan_key(plan, user_input)
+    cached = await asyncio.to_thread(response_cache.get, plan_cache_key)
+
+    # ── Cache hit: a different phrasing of the same plan ──
+    if not refresh:
+        note_cache("plan", bool(cached) and is_fresh(cached))
+        if cached and is_fresh(cached):
+            semantic_stats.record("plan_hits")
+            logger.info("[%s] Plan cache hit for query: %s", request_id, user_input[:60])
+            # Only the pointer: rewriting the answer would reset its age under the route TTL
+            await asyncio.to_thread(_link_query, user_input, plan_cache_key)
+            await asyncio.to_thread(_record_hit, plan_cache_key, user_input)
+            return {**public(cached), "cached": True}
+        semantic_stats.record("misses")
+
+    async def run_graph() -> dict:
+        # The graph reuses the plan instead of planning again, and a stale answer's
+        # still-fresh data, so only the agents behind stale data run
+        margin = REFRESH_LEAD_SECONDS if refresh else 0.0
+        state, seeded = seed_state(user_input, plan, cached, margin) if cached else (
+            {**initial_state(user_input), **plan}, {})
+        if seeded:
+            logger.info("[%s] Reusing cached %s; re-running the rest", request_id, sorted(seeded))
+        result = await _run_workflow(state, on_stage)
+        logger.info("[%s] Query complete. Confidence: %s/10", request_id, result.get("confidence_score"))
+        response = _build_response(result)
+
+        # Partial answers are not cached — the next request may have time for all of it.
+        # A refresh overwrites the old answer in one write; a partial refresh leaves it in place.
+        if not response["partial"]:
+            await asyncio.to_thread(_set_cache, user_input, with_sources(response, result, seeded), plan_cache_key)
         return response
 
-    except Exception as e:
-        logger.error("[%s] Query failed: %s", request_id, str(e), exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+    if refresh:
+        return await run_graph()
+    # Different phrasings that planned the same way share one run too
+    response, _ = await coalescer.run(plan_cache_key, run_graph,
+                                      lookup=lambda: _fresh(response_cache.get(plan_cache_key, record=False)))
+    if not response.get("partial"):
+        await asyncio.to_thread(_record_hit, plan_cache_key, user_input)
+    return response
+
+
+# ── Refresh-ahead ──
+
+async def _refresh(query: str) -> None:
+    request_id = new_request_id()
+    logger.info("[%s] Refresh-ahead: %s", request_id, query[:100])
+    set_deadline(MAX_REQUEST_DEADLINE_SECONDS)
+    await _answer(request_id, query, refresh=True)
+
+
+refresher = RefreshAhead(response_cache, _refresh)
+
+
+def _record_hit(key: str, query: str) -> None:
+    if REFRESH_AHEAD:
+        refresher.record_hit(key, query)
+
+
+def _batch_concurrency(payload: dict) -> int:
+    requested = payload.get("concurrency")
+    if requested is None:
+        return BATCH_CONCURRENCY
+    if not isinstance(requested, int) or requested <= 0:
+        raise HTTPException(status_code=400, detail="concurrency must be a positive integer.")
+    return min(requested, BATCH_CONCURRENCY)
+
+
+async def _stream_batch(request_id: str, queries: list[str], concurrency: int):
+    """
+    NDJSON lines: rejected and cached queries first, then each remaining query as it
+    completes, then a summary line. Repeated queries in one batch are run once.
+    """
+    def line(record: dict) -> str:
+        return json.dumps(record) + "\n"
+
+    to_run: dict[str, list[int]] = {}   # cache key → indexes of the queries sharing it
+    first_query: dict[str, str] = {}
+    for index, query in enumerate(queries):
+        error = validate_query(query)
+        cached = None if error else await asyncio.to_thread(_get_cached, query)
+        if error:
+            yield line({"index": index, "query": query, "success": False, "error": error})
+        elif cached:
+            yield line({"index": index, "query": query, **cached, "cached": True})
+        else:
+            key = _cache_key(query)
+            to_run.setdefault(key, []).append(index)
+            first_query.setdefault(key, query)
+
+    keys = list(to_run)
+    batch = BatchRun(get_workflow(), [first_query[k] for k in keys], concurrency)
+    async for i, result in batch.run():
+        key = keys[i]
+        if isinstance(result, Exception):
+            record = {"success": False, "error": str(result)}
+        else:
+            record = _build_response(result)
+            if not record["partial"]:
+                await asyncio.to_thread(_set_cache, first_query[key], with_sources(record, result))
+        for index in to_run[key]:
+            yield line({"index": index, "query": queries[index], **record})
+
+    logger.info("[%s] Batch complete: %s", request_id, batch.stats)
+    yield line({"done": True, "stats": batch.stats})
+
+
+@router.post("/batch")
+@limiter.limit("2/minute")
+async def process_batch(request: Request, payload: dict):
+    """
+    Runs many queries in one call. Products shared between queries are fetched once;
+    results stream back as application/x-ndjson, one line per query as it completes.
+    """
+    request_id = new_request_id()
+    queries = payload.get("queries")
+    if not isinstance(queries, list) or not queries:
+        raise HTTPException(status_code=400, detail="queries must be a non-empty list.")
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {BATCH_MAX_QUERIES} queries.")
+
+    queries = [str(q or "").strip() for q in queries]
+    concurrency = _batch_concurrency(payload)
+    logger.info("[%s] Batch received: %d queries", request_id, len(queries))
+    return StreamingResponse(_stream_batch(request_id, queries, concurrency),
+                             media_type="application/x-ndjson")
+
+
+@router.get("/metrics/stages")
+def stage_metrics():
+    """Per-stage latency histograms for this worker (planner, agents, fetches, reflection, analyzer)."""
+    return stage_histograms.snapshot()
+
+
+@router.post("/admin/cache-snapshot")
+async def cache_snapshot(request: Request):
+    """
+    Writes the live caches to CACHE_SNAPSHOT_PATH now (also done on shutdown). Under the
+    prefork server this asks the master, which collects every worker's part and merges them.
+    """
+    _require_admin(request)
+    if is_prefork_worker():
+        os.kill(master_pid(), signal.SIGUSR1)
+        return JSONResponse({"status": "scheduled", "path": CACHE_SNAPSHOT_PATH}, status_code=202)
+    return await asyncio.to_thread(save_snapshot)
+
+
+@router.get("/metrics/memory")
+def memory_metrics():
+    """RSS / PSS / shared memory of the prefork master and each worker (or of this process alone)."""
+    return memory_report()
+
+
+@router.get("/metrics/profiles")
+def profile_metrics():
+    """Hottest CPU / wall-clock frames and suspect functions across the newest sampled profiles."""
+    return summarize_profiles()
+
+
+# ── Async jobs ──
+
+async def _run_job(job) -> dict:
+    request_id = new_request_id()
+    logger.info("[%s] Job %s started: %s", request_id, job.id, job.query[:100])
+    set_deadline(job.deadline_seconds)
+    # Jobs already waited in their own queue; they wait for a slot rather than being shed
+    return await _compute(request_id, job.query, on_stage=job.on_stage, can_shed=False)
+
+
+jobs = JobManager(_run_job)
+
+
+@router.post("/jobs", status_code=202)
+@limiter.limit("30/minute")
+async def submit_job(request: Request, payload: dict):
+    """
+    Queues a query and returns its job ID at once; poll GET /api/jobs/{job_id}.
+    Jobs are not tied to the connection, so they get the full server deadline by default.
+    """
+    request_id = new_request_id()
+    user_input = payload.get("query", "").strip()
+    _reject_invalid(request_id, user_input)
+    deadline_seconds = (_deadline_seconds(payload) if payload.get("deadline_seconds") is not None
+                        else MAX_REQUEST_DEADLINE_SECONDS)
+
+    cached = await asyncio.to_thread(_cached_response, user_input)
+    if cached:
+        job = await jobs.add_finished(user_input, cached)
+    else:
+        try:
+            job = await jobs.submit(user_input, deadline_seconds)
+        except QueueFull as e:
+            logger.warning("[%s] Job rejected: %s", request_id, e)
+            raise HTTPException(status_code=503, detail="Job queue is full, retry later.",
+                                headers={"Retry-After": "30"})
+    logger.info("[%s] Job %s %s", request_id, job.id, job.status)
+    return {"job_id": job.id, "status": job.status, "status_url": f"/api/jobs/{job.id}"}
+
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Answered from the host-shared job store, whichever worker runs the job."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job.")
+    return job.to_dict()
@@ -0,0 +1,120 @@
+"""
+Admission control for workflow runs.
+At most ADMISSION_MAX_INFLIGHT runs execute per worker; a few more may wait for a
+slot. A request is shed at once (HTTP 503 + Retry-After) when the wait it would face
+exceeds ADMISSION_MAX_QUEUE_WAIT or its own deadline, or when too many already wait.
+Shedding early keeps latency bounded for admitted requests instead of letting every
+request slow down and time out together. Cache hits never reach this point.
+"""
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+from app.core.config import ADMISSION_MAX_INFLIGHT, ADMISSION_MAX_QUEUE_WAIT, ADMISSION_MAX_QUEUED
+from app.core.request_context import time_remaining
+
+logger = logging.getLogger(__name__)
+
+_RATE_WINDOW_SECONDS = 60
+_EWMA_ALPHA = 0.2
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_inflight: int = ADMISSION_MAX_INFLIGHT,
+                 max_queue_wait: float = ADMISSION_MAX_QUEUE_WAIT, max_queued: int = ADMISSION_MAX_QUEUED):
+        self._max_inflight = max_inflight
+        self._max_queue_wait = max_queue_wait
+        self._max_queued = max_queued
+        self._slots = asyncio.Semaphore(max_inflight)
+        self._in_flight = 0
+        self._queued = 0
+        self._service_seconds = 20.0       # EWMA of run time; seeded with a typical run
+        self._decisions: deque[tuple[float, bool]] = deque()   # (time, shed) within the rate window
+        self._totals = {"admitted": 0, "shed": 0}
+
+    def estimated_wait(self) -> float:
+        """Seconds a new request would wait for a slot, from queue depth and average run time."""
+        occupied = self._in_flight + self._queued
+        if occupied < self._max_inflight:
+            return 0.0
+        return (occupied - self._max_inflight + 1) * self._service_seconds / self._max_inflight
+
+    def _record(self, shed: bool) -> None:
+        now = time.monotonic()
+        self._decisions.append((now, shed))
+        while self._decisions and now - self._decisions[0][0] > _RATE_WINDOW_SECONDS:
+            self._decisions.popleft()
+        self._totals["shed" if shed else "admitted"] += 1
+
+    def _shed(self, wait: float, reason: str) -> Overloaded:
+        self._record(shed=True)
+        logger.warning("Shedding request: %s (in_flight=%d queued=%d est_wait=%.1fs)",
+                       reason, self._in_flight, self._queued, wait)
+        return Overloaded(max(1, math.ceil(wait)), reason)
+
+    @asynccontextmanager
+    async def slot(self, can_shed: bool = True):
+        """
+        Holds one run slot for the body. With can_shed=False (background jobs) the caller
+        waits as long as it takes instead of being rejected.
+        """
+        wait = self.estimated_wait()
+        if can_shed and wait > 0:
+            remaining = time_remaining()
+            if self._queued >= self._max_queued:
+                raise self._shed(wait, "queue full")
+            if wait > self._max_queue_wait:
+                raise self._shed(wait, "queue wait too long")
+            if remaining is not None and wait > remaining:
+                raise self._shed(wait, "would miss its deadline")
+
+        self._queued += 1
+        try:
+            if can_shed:
+                remaining = time_remaining()
+                timeout = self._max_queue_wait if remaining is None else max(0.0, min(self._max_queue_wait, remaining))
+                try:
+                    async with asyncio.timeout(timeout):
+                        await self._slots.acquire()
+                except TimeoutError:
+                    raise self._shed(self.estimated_wait(), "no slot within the queue wait limit")
+            else:
+                await self._slots.acquire()
+        finally:
+            self._queued -= 1
+
+        self._record(shed=False)
+        self._in_flight += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+            elapsed = time.monotonic() - started
+            self._service_seconds += _EWMA_ALPHA * (elapsed - self._service_seconds)
+
+    def stats(self) -> dict:
+        recent = list(self._decisions)
+        shed_recent = sum(1 for _, shed in recent if shed)
+        return {
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "max_inflight": self._max_inflight,
+            "avg_run_seconds": round(self._service_seconds, 2),
+            "estimated_wait_seconds": round(self.estimated_wait(), 2),
+            **self._totals,
+            "shed_rate_1m": round(shed_recent / len(recent), 3) if recent else 0.0,
+        }
+
+
+admission = AdmissionController()
@@ -0,0 +1,80 @@
+"""
+Per-data-type freshness for cached answers.
+A cached answer keeps the agent data it was written from ("sources": the product
+list and, per output key, the entries and when they were fetched). The answer is
+fresh until its first data type reaches its PRODUCT_STORE_TTLS age: prices after an
+hour, specs after a week. A stale answer is not thrown away: seed_state() turns it
+into a graph input that carries the still-fresh data as already executed, so only
+the agents behind stale data run again before the analyzer rewrites the answer.
+"""
+import time
+
+from app.core.config import PRODUCT_STORE_TTLS, ROUTE_ANSWER_TTL
+from app.core.product_store import product_store
+from app.models.graph_state import initial_state
+from nodes.supervisor_agent import AGENT_OUTPUT_KEYS
+
+# Cache-only fields of a stored answer; never sent to clients
+INTERNAL_KEYS = ("sources", "fresh_until")
+
+
+def public(answer: dict) -> dict:
+    return {k: v for k, v in answer.items() if k not in INTERNAL_KEYS}
+
+
+def is_fresh(answer: dict, margin: float = 0.0) -> bool:
+    """Answers written before per-type freshness have no fresh_until and live for the cache TTL."""
+    return answer.get("fresh_until", float("inf")) > time.time() + margin
+
+
+def _fetched_at(products: list[str], output_key: str, seeded: dict, now: float) -> float:
+    if output_key in seeded:
+        return seeded[output_key]
+    # Entries served by the product store are as old as when they were stored there
+    stored = [product_store.stored_at(p, output_key) for p in products]
+    return min([t for t in stored if t is not None], default=now)
+
+
+def with_sources(response: dict, result: dict, seeded: dict | None = None) -> dict:
+    """
+    The cache entry for response: the graph result's per-agent data with fetch times.
+    seeded maps output keys carried over from a stale answer to their original fetch time.
+    """
+    now = time.time()
+    seeded = seeded or {}
+    products = result.get("products") or []
+    data = {}
+    for agent_name in result.get("agent_plan") or []:
+        output_key = AGENT_OUTPUT_KEYS.get(agent_name)
+        if output_key is None or agent_name not in (result.get("agents_executed") or []):
+            continue
+        data[output_key] = {"fetched_at": _fetched_at(products, output_key, seeded, now),
+                            "entries": result.get(output_key) or []}
+    expiries = [d["fetched_at"] + PRODUCT_STORE_TTLS.get(key, 0) for key, d in data.items()]
+    fresh_until = min(expiries) if expiries else now + ROUTE_ANSWER_TTL
+    return {**response, "sources": {"products": products, "data": data}, "fresh_until": fresh_until}
+
+
+def seed_state(user_input: str, plan: dict, answer: dict, margin: float = 0.0) -> tuple[dict, dict]:
+    """
+    Graph input reusing a stale answer's data that stays fresh for at least margin seconds.
+    Returns (state, seeded fetch times by output key); an empty seed means a full run.
+    """
+    state = {**initial_state(user_input), **plan}
+    sources = answer.get("sources") or {}
+    if not sources.get("products"):
+        return state, {}
+    now = time.time()
+    seeded, done = {}, []
+    for agent_name in plan.get("agent_plan") or []:
+        output_key = AGENT_OUTPUT_KEYS[agent_name]
+        stored = sources["data"].get(output_key)
+        if stored and now + margin - stored["fetched_at"] < PRODUCT_STORE_TTLS.get(output_key, 0):
+            state[output_key] = stored["entries"]
+            seeded[output_key] = stored["fetched_at"]
+            done.append(agent_name)
+    if seeded:
+        # The supervisor keeps the stored products and schedules only agents not in agents_executed
+        state["products"] = sources["products"]
+        state["agents_executed"] = done
+    return state, seeded
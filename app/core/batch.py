@@ -0,0 +1,112 @@
+"""
+Batch query runner.
+Plans every query up front, fetches each distinct (agent, product) pair once for the
+whole batch, then runs the graph per query with its data pre-supplied — so only the
+analysis (and a rating fallback, if reflection asks for one) runs per query.
+Results are yielded as each query completes, not in submission order.
+"""
+import asyncio
+import logging
+from typing import AsyncIterator
+
+from app.core.config import BATCH_CONCURRENCY
+from app.core.product_index import canonical_product_id, search_name
+from app.core.product_store import product_store
+from app.models.graph_state import initial_state
+from nodes.supervisor_agent import AGENT_OUTPUT_KEYS, plan_query, run_agent_with_reflection
+
+logger = logging.getLogger(__name__)
+
+
+def _fetch_one(agent_name: str, product: str, query: str) -> dict | None:
+    """One agent run for one product; the entry lands in the product store as a side effect."""
+    update = run_agent_with_reflection(
+        {"input": query, "products": [product], "search_hints": {}}, agent_name
+    )
+    entries = update.get(AGENT_OUTPUT_KEYS[agent_name]) or []
+    return entries[0] if entries else None
+
+
+class BatchRun:
+    """
+    One batch. Planning, fetching and analysis share a single concurrency bound;
+    stats report how much fetch work cross-query deduplication saved.
+    """
+
+    def __init__(self, workflow, queries: list[str], concurrency: int | None = None):
+        self.workflow = workflow
+        self.queries = list(queries)
+        self._limit = asyncio.Semaphore(max(1, concurrency or BATCH_CONCURRENCY))
+        self._fetches: dict[tuple[str, str], asyncio.Task] = {}
+        self.stats = {"queries": len(self.queries), "requested_fetches": 0,
+                      "store_hits": 0, "unique_fetches": 0, "failed": 0}
+
+    async def _bounded(self, func, *args):
+        async with self._limit:
+            return await asyncio.to_thread(func, *args)
+
+    def _fetch(self, agent_name: str, product: str, query: str) -> asyncio.Task:
+        key = (agent_name, canonical_product_id(product))
+        if key not in self._fetches:
+            self._fetches[key] = asyncio.create_task(
+                self._bounded(_fetch_one, agent_name, search_name(product), query)
+            )
+        return self._fetches[key]
+
+    def _schedule(self, query: str, plan: dict) -> dict:
+        """
+        Serves what the product store has and starts (or joins) fetches for the rest.
+        Returns agent → (stored entries, {product: fetch task}).
+        """
+        needed = {}
+        for agent_name in plan["agent_plan"]:
+            found, missing = product_store.lookup(plan["products"], AGENT_OUTPUT_KEYS[agent_name])
+            self.stats["requested_fetches"] += len(plan["products"])
+            self.stats["store_hits"] += len(found)
+            needed[agent_name] = (found, {p: self._fetch(agent_name, p, query) for p in missing})
+        return needed
+
+    async def _analyze(self, index: int, query: str, plan: dict, needed: dict) -> tuple[int, dict | Exception]:
+        try:
+            state = {**initial_state(query), **plan}
+            for agent_name, (found, tasks) in needed.items():
+                results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+                state[AGENT_OUTPUT_KEYS[agent_name]] = found + [
+                    {**entry, "product": product}
+                    for product, entry in zip(tasks, results) if isinstance(entry, dict)
+                ]
+                # Pre-supplied: the supervisor will not schedule this agent again
+                state["agents_executed"].append(agent_name)
+
+            async with self._limit:
+                return index, await self.workflow.ainvoke(state)
+        except Exception as e:
+            logger.error("BATCH: query %d failed: %s", index, e)
+            return index, e
+
+    async def run(self) -> AsyncIterator[tuple[int, dict | Exception]]:
+        """Yields (query index, final graph state or the exception that query raised)."""
+        plans = await asyncio.gather(
+            *(self._bounded(plan_query, {"input": q}, False) for q in self.queries),
+            return_exceptions=True,
+        )
+
+        analyses = []
+        for index, (query, plan) in enumerate(zip(self.queries, plans)):
+            if isinstance(plan, Exception):
+                self.stats["failed"] += 1
+                yield index, plan
+                continue
+            needed = self._schedule(query, plan)
+            analyses.append(asyncio.create_task(self._analyze(index, query, plan, needed)))
+
+        self.stats["unique_fetches"] = len(self._fetches)
+        logger.info("BATCH: %d queries, %d product x agent fetches needed, %d from store, %d unique fetched",
+                    self.stats["queries"], self.stats["requested_fetches"],
+                    self.stats["store_hits"], self.stats["unique_fetches"])
+
+        for next_done in asyncio.as_completed(analyses):
+            index, result = await next_done
+            if isinstance(result, Exception):
+                self.stats["failed"] += 1
+            yield index, result
@@ -0,0 +1,110 @@
+"""
+In-flight request coalescing for /api/query.
+Identical queries arriving while the first is still running share its result
+instead of each running the workflow:
+
+- in this worker: followers await the leader's task (shielded, so the leader's
+  client disconnecting does not cancel it for everyone else);
+- across workers: the leader holds a lease on the key in the shared route cache;
+  other workers poll the cache for the answer until the lease is released or expires,
+  then compute it themselves (partial answers are never cached, so a follower of a
+  cut-short leader still gets its own attempt).
+"""
+import os
+import uuid
+import asyncio
+import logging
+from collections import Counter
+from threading import Lock
+from typing import Awaitable, Callable
+
+from app.core.config import COALESCE_LEASE_SECONDS, COALESCE_POLL_SECONDS
+from app.core.request_context import time_remaining
+from app.core.response_cache import SQLiteResponseCache, response_cache
+
+logger = logging.getLogger(__name__)
+
+
+class RequestCoalescer:
+    def __init__(self, cache: SQLiteResponseCache, lease_seconds: float = COALESCE_LEASE_SECONDS,
+                 poll_seconds: float = COALESCE_POLL_SECONDS):
+        self._cache = cache
+        self._lease_seconds = lease_seconds
+        self._poll_seconds = poll_seconds
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._counts = Counter()
+        self._lock = Lock()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def in_flight(self, key: str) -> bool:
+        """True when a request for key is already running in this worker (a new one would join it)."""
+        return key in self._inflight
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[dict]],
+                  lookup: Callable[[], dict | None]) -> tuple[dict, str]:
+        """
+        Returns (result, how): how is "leader", "local" (joined a request in this worker)
+        or "remote" (answer published by another worker). lookup peeks the shared cache.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self._count("local_joins")
+            logger.info("Joining in-flight query in this worker: %s", key)
+            result, _ = await asyncio.shield(task)
+            return result, "local"
+
+        task = asyncio.ensure_future(self._lead(key, compute, lookup))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._inflight.get(key) is done and self._inflight.pop(key))
+        return await asyncio.shield(task)
+
+    async def _lead(self, key, compute, lookup) -> tuple[dict, str]:
+        owner = f"{self._owner}-{uuid.uuid4().hex[:6]}"
+        leased = await asyncio.to_thread(self._cache.acquire_lease, key, owner, self._lease_seconds)
+        while not leased:
+            result, lease_ended = await self._wait_remote(key, lookup)
+            if result is not None:
+                self._count("remote_joins")
+                return result, "remote"
+            if not lease_ended:
+                break   # out of time waiting — compute without the lease
+            # Lease released without a cached answer (failed or partial) — take over
+            leased = await asyncio.to_thread(self._cache.acquire_lease, key, owner, self._lease_seconds)
+
+        self._count("leaders")
+        try:
+            return await compute(), "leader"
+        finally:
+            if leased:
+                await asyncio.to_thread(self._cache.release_lease, key, owner)
+
+    async def _wait_remote(self, key, lookup) -> tuple[dict | None, bool]:
+        """
+        Polls for another worker's answer while it holds the lease.
+        Returns (answer, False), (None, True) when the lease ended, (None, False) when out of time.
+        """
+        logger.info("Waiting for another worker computing: %s", key)
+        while True:
+            result = await asyncio.to_thread(lookup)
+            if result is not None:
+                return result, False
+            if not await asyncio.to_thread(self._cache.lease_held, key):
+                return None, True
+            remaining = time_remaining()
+            if remaining is not None and remaining <= self._poll_seconds:
+                self._count("remote_timeouts")
+                return None, False
+            await asyncio.sleep(self._poll_seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        return {"in_flight": len(self._inflight),
+                **{name: counts.get(name, 0) for name in ("leaders", "local_joins", "remote_joins", "remote_timeouts")}}
+
+
+coalescer = RequestCoalescer(response_cache)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 GEMINI_MODEL = "gemini-2.5-flash"
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
@@ -8,3 +9,138 @@ SERPAPI_KEY = os.getenv("SERPAPI_KEY") or os.getenv("SERP_API_KEY") or ""
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")  # "gemini" | "qwen"
 QWEN_MODEL = os.getenv("QWEN_MODEL", "qwen3:1.7b")
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+# Speculatively fetch SerpAPI data for products guessed from "X vs Y" queries
+# while the planner LLM call runs. Set SPECULATIVE_PREFETCH=0 to disable.
+SPECULATIVE_PREFETCH = os.getenv("SPECULATIVE_PREFETCH", "1") == "1"
+
+# Resolve simple comparison/recommendation queries without the planner LLM call.
+# Set FAST_PLANNER=0 to always use the LLM planner.
+FAST_PLANNER = os.getenv("FAST_PLANNER", "1") == "1"
+
+# Per-request time budget. Clients may ask for less (or more, up to the max) via
+# "deadline_seconds" in the /api/query payload. Near the deadline, agents skip
+# reformulation retries, reflection and the rating fallback are skipped, and the
+# analyzer works with whatever data has arrived.
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "45"))
+MAX_REQUEST_DEADLINE_SECONDS = float(os.getenv("MAX_REQUEST_DEADLINE_SECONDS", "120"))
+ANALYZER_RESERVE_SECONDS = float(os.getenv("ANALYZER_RESERVE_SECONDS", "12"))   # kept back for the final LLM call
+REFLECT_RESERVE_SECONDS = float(os.getenv("REFLECT_RESERVE_SECONDS", "6"))      # reflection LLM call
+RETRY_RESERVE_SECONDS = float(os.getenv("RETRY_RESERVE_SECONDS", "10"))         # one reformulation + agent re-run
+
+# Per-product knowledge store: assembled agent outputs reused across different queries.
+# Prices move hourly; specs and reviews are stable for days.
+PRODUCT_STORE_TTLS = {
+    "price_data": int(os.getenv("PRODUCT_TTL_PRICE", str(60 * 60))),
+    "platform_rating_data": int(os.getenv("PRODUCT_TTL_RATING", str(6 * 60 * 60))),
+    "review_data": int(os.getenv("PRODUCT_TTL_REVIEW", str(3 * 24 * 60 * 60))),
+    "product_info": int(os.getenv("PRODUCT_TTL_INFO", str(7 * 24 * 60 * 60))),
+}
+PRODUCT_STORE_MAXSIZE = int(os.getenv("PRODUCT_STORE_MAXSIZE", "5000"))
+
+# Product fan-out. MAX_PRODUCTS bounds a single query ("compare these 8 laptops");
+# PRODUCT_CONCURRENCY bounds parallel per-product fetches inside each agent.
+MAX_PRODUCTS = int(os.getenv("MAX_PRODUCTS", "10"))
+PRODUCT_CONCURRENCY = int(os.getenv("PRODUCT_CONCURRENCY", "4"))
+RECOMMENDATION_COUNT = int(os.getenv("RECOMMENDATION_COUNT", "3"))
+SERP_RESULTS_PER_PRODUCT = int(os.getenv("SERP_RESULTS_PER_PRODUCT", "3"))
+
+# /api/query response cache, one SQLite file shared by all workers on the host.
+# Rows are kept ROUTE_CACHE_TTL; an answer is served only while all its data is within
+# PRODUCT_STORE_TTLS (answers with no product data: ROUTE_ANSWER_TTL), and after that its
+# still-fresh data is reused so only the stale agents run again
+ROUTE_CACHE_PATH = os.getenv("ROUTE_CACHE_PATH", os.path.join(tempfile.gettempdir(), "product_pilot_cache.sqlite3"))
+ROUTE_CACHE_TTL = int(os.getenv("ROUTE_CACHE_TTL", str(24 * 60 * 60)))
+ROUTE_ANSWER_TTL = int(os.getenv("ROUTE_ANSWER_TTL", "3600"))
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "5000"))
+ROUTE_CACHE_MAX_BYTES = int(os.getenv("ROUTE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Identical in-flight queries share one run; across workers the runner holds a lease
+# (expires if it dies) and others poll the shared cache every COALESCE_POLL_SECONDS
+COALESCE_LEASE_SECONDS = float(os.getenv("COALESCE_LEASE_SECONDS", "130"))
+COALESCE_POLL_SECONDS = float(os.getenv("COALESCE_POLL_SECONDS", "0.25"))
+
+# Rephrased queries share cached answers: trigram cosine similarity needed for a near-duplicate hit
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "5000"))
+
+# Admission control per worker: concurrent workflow runs, and how long / how many requests may wait for one
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "8"))
+ADMISSION_MAX_QUEUE_WAIT = float(os.getenv("ADMISSION_MAX_QUEUE_WAIT", "5"))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "16"))
+
+# Async job API: worker tasks per process, queued jobs accepted, and how long finished jobs stay readable
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+JOB_MAX_RETAINED = int(os.getenv("JOB_MAX_RETAINED", "1000"))
+# Job status lives in this SQLite file, shared by every worker on the host, so any worker answers a poll
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", os.path.join(tempfile.gettempdir(), "product_pilot_jobs.sqlite3"))
+
+# Batch endpoint: queries per request, and planning/fetch/analysis tasks in flight at once
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# Above this many products (or characters of raw JSON) the analyzer gets per-product summaries
+ANALYZER_FULL_CONTEXT_PRODUCTS = int(os.getenv("ANALYZER_FULL_CONTEXT_PRODUCTS", "3"))
+ANALYZER_MAX_CONTEXT_CHARS = int(os.getenv("ANALYZER_MAX_CONTEXT_CHARS", "12000"))
+
+# Analyzer output memoized by (normalized data, question class); SQLite file shared by all workers.
+# The key already covers the data, so the TTL only bounds how long one wording's answer is reused
+ANALYSIS_CACHE = os.getenv("ANALYSIS_CACHE", "1") == "1"
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH",
+                                os.path.join(tempfile.gettempdir(), "product_pilot_analysis.sqlite3"))
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(24 * 60 * 60)))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "2000"))
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Sampled deep profiling (CPU, wall-clock, allocations) of /api/query runs. A request is profiled with
+# probability PROFILE_SAMPLE_RATE or when it sends PROFILE_HEADER: 1; at most one at a time per worker
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "product_pilot_profiles"))
+PROFILE_MAX_KEPT = int(os.getenv("PROFILE_MAX_KEPT", "50"))
+PROFILE_WALL_INTERVAL_MS = float(os.getenv("PROFILE_WALL_INTERVAL_MS", "5"))
+PROFILE_TOP_FRAMES = int(os.getenv("PROFILE_TOP_FRAMES", "25"))
+
+# Logging: records are queued on the request path and written by a background thread.
+# LOG_SAMPLE_RATES keeps only a share of DEBUG records from noisy loggers ("name=rate,...")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "nodes.supervisor_agent=0.1,nodes.analyzer_agent=0.1")
+
+# Prefork server (python -m app.server): the master warms up once, then forks SERVER_WORKERS workers
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "4"))
+SERVER_MEMORY_REPORT_SECONDS = float(os.getenv("SERVER_MEMORY_REPORT_SECONDS", "300"))
+
+# Cache snapshot for warm deploys: written on shutdown and via POST /api/admin/cache-snapshot,
+# loaded at startup. Point it at a volume that outlives the container. Admin endpoints need ADMIN_TOKEN
+CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), "product_pilot_snapshot.json.gz"))
+CACHE_SNAPSHOT_ON_SHUTDOWN = os.getenv("CACHE_SNAPSHOT_ON_SHUTDOWN", "1") == "1"
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Refresh-ahead: popular cached answers are recomputed shortly before they expire. Popularity is a
+# hit score halving every REFRESH_HALF_LIFE_SECONDS; spend (SerpAPI requests + LLM calls) is capped per hour
+REFRESH_AHEAD = os.getenv("REFRESH_AHEAD", "1") == "1"
+REFRESH_INTERVAL_SECONDS = float(os.getenv("REFRESH_INTERVAL_SECONDS", "60"))
+REFRESH_LEAD_SECONDS = float(os.getenv("REFRESH_LEAD_SECONDS", "300"))
+REFRESH_MIN_SCORE = float(os.getenv("REFRESH_MIN_SCORE", "3"))
+REFRESH_HALF_LIFE_SECONDS = float(os.getenv("REFRESH_HALF_LIFE_SECONDS", "3600"))
+REFRESH_BUDGET_PER_HOUR = float(os.getenv("REFRESH_BUDGET_PER_HOUR", "300"))
+REFRESH_DEFAULT_COST = float(os.getenv("REFRESH_DEFAULT_COST", "12"))
+REFRESH_MAX_PER_CYCLE = int(os.getenv("REFRESH_MAX_PER_CYCLE", "10"))
+
+# Result caches for small structured LLM outputs, one SQLite file per kind in LLM_CACHE_DIR
+# (shared by all workers). Plans depend only on the query wording; reformulated search
+# queries and recommended products drift with the market, so they expire sooner
+LLM_CACHE = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", tempfile.gettempdir())
+LLM_CACHE_TTLS = {
+    "plan": int(os.getenv("LLM_CACHE_TTL_PLAN", str(7 * 24 * 60 * 60))),
+    "reformulation": int(os.getenv("LLM_CACHE_TTL_REFORMULATION", str(24 * 60 * 60))),
+    "recommendation": int(os.getenv("LLM_CACHE_TTL_RECOMMENDATION", str(24 * 60 * 60))),
+}
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
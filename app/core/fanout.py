@@ -0,0 +1,54 @@
+"""
+Bounded per-product fan-out for data agents.
+Products are fetched concurrently (at most PRODUCT_CONCURRENCY at a time) and each
+entry is written to the product store as soon as it completes, so work finished
+before a deadline cut is kept for the next request.
+"""
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+
+from app.core.config import PRODUCT_CONCURRENCY
+from app.core.product_store import product_store, has_data
+from app.core.logger import span
+
+logger = logging.getLogger(__name__)
+
+
+def collect_per_product(products: list[str], fetch_one: Callable[[str], dict],
+                        output_key: str | None = None, limit: int | None = None) -> list[dict]:
+    """
+    Runs fetch_one for every product with bounded concurrency (default PRODUCT_CONCURRENCY).
+    Returns entries in product order; a product whose fetch raised is logged and skipped.
+    """
+    if not products:
+        return []
+
+    limit = limit or PRODUCT_CONCURRENCY
+    stage = f"fetch.{output_key or 'product'}"
+
+    def timed_fetch(product: str) -> dict:
+        with span(stage, product=product):
+            return fetch_one(product)
+
+    results: list[dict | None] = [None] * len(products)
+    with ThreadPoolExecutor(max_workers=max(1, min(limit, len(products))),
+                            thread_name_prefix="product") as pool:
+        # Each task runs in a copy of the caller's context so request_id and deadline follow it
+        futures = {
+            pool.submit(contextvars.copy_context().run, timed_fetch, product): i
+            for i, product in enumerate(products)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                logger.error("Fetch failed for %s: %s", products[i], e)
+                continue
+            results[i] = entry
+            if output_key and has_data([entry]):
+                product_store.put(output_key, [entry])
+
+    return [entry for entry in results if entry is not None]
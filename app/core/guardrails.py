@@ -3,6 +3,8 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+MAX_QUERY_LENGTH = 500
+
 _INJECTION_PATTERNS = [
     r"ignore\s+(previous|all|your)\s+instructions",
     r"disregard\s+(previous|all|your)\s+instructions",
@@ -17,6 +19,8 @@ _INJECTION_PATTERNS = [
     r"pretend\s+you\s+(are|have\s+no)",
     r"override\s+(your\s+)?(previous\s+)?instructions",
 ]
+# Compiled once at import (in the prefork master, shared by every worker)
+_INJECTION_REGEXES = [re.compile(pattern) for pattern in _INJECTION_PATTERNS]
 
 
 def check_input(user_input: str) -> tuple[bool, str]:
@@ -28,9 +32,21 @@ def check_input(user_input: str) -> tuple[bool, str]:
         return False, "Empty query"
 
     lower = user_input.lower()
-    for pattern in _INJECTION_PATTERNS:
-        if re.search(pattern, lower):
-            logger.warning("Prompt injection detected | pattern=%s | input=%s", pattern, user_input[:120])
+    for regex in _INJECTION_REGEXES:
+        if regex.search(lower):
+            logger.warning("Prompt injection detected | pattern=%s | input=%s", regex.pattern, user_input[:120])
             return False, "Query contains disallowed content"
 
     return True, ""
+
+
+def validate_query(user_input: str) -> str | None:
+    """Returns why a query is rejected (empty, too long, unsafe), or None if it can run."""
+    if not user_input:
+        return "Query cannot be empty."
+    if len(user_input) > MAX_QUERY_LENGTH:
+        return f"Query exceeds {MAX_QUERY_LENGTH} character limit."
+    is_safe, reason = check_input(user_input)
+    if not is_safe:
+        return f"Query blocked: {reason}"
+    return None
@@ -2,21 +2,36 @@
 Shared HTTP session with retry logic and TTL cache for SerpAPI calls.
 All agents use cached_get() instead of raw requests.get().
 """
+import os
 import hashlib
 import json
 import logging
 import time
+from concurrent.futures import Future
 from threading import Lock
 
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from app.core.logger import note_cache
+from app.core.request_context import record_spend
+
 logger = logging.getLogger(__name__)
 
 _session: requests.Session | None = None
 
 
+def _drop_session_after_fork() -> None:
+    # Pooled connections must not be shared with the parent process
+    global _session
+    _session = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_drop_session_after_fork)
+
+
 def get_session() -> requests.Session:
     global _session
     if _session is None:
@@ -60,8 +75,32 @@ class TTLCache:
             self._cache[key] = value
             self._timestamps[key] = time.time()
 
+    def export_entries(self) -> list:
+        """Unexpired [key, stored_at, value] rows for a cache snapshot."""
+        now = time.time()
+        with self._lock:
+            return [[key, ts, self._cache[key]] for key, ts in self._timestamps.items() if now - ts < self._ttl]
+
+    def load_entries(self, rows: list) -> int:
+        """Restores snapshot rows keeping their original timestamps; expired rows are skipped."""
+        now = time.time()
+        fresh = sorted((row for row in rows if now - row[1] < self._ttl), key=lambda row: row[1])
+        with self._lock:
+            for key, ts, value in fresh[-self._maxsize:]:
+                if key not in self._cache:
+                    self._cache[key], self._timestamps[key] = value, ts
+            while len(self._cache) > self._maxsize:
+                oldest = min(self._timestamps, key=self._timestamps.get)
+                self._cache.pop(oldest, None)
+                self._timestamps.pop(oldest, None)
+        return len(fresh[-self._maxsize:])
+
+
+http_cache = TTLCache(ttl_seconds=1800, maxsize=100)
 
-_cache = TTLCache(ttl_seconds=1800, maxsize=100)
+# cache_key → Future of the request currently fetching it
+_inflight: dict[str, Future] = {}
+_inflight_lock = Lock()
 
 
 def cached_get(url: str, params: dict, timeout: int = 10) -> dict:
@@ -69,18 +108,43 @@ def cached_get(url: str, params: dict, timeout: int = 10) -> dict:
     GET request with:
     - Automatic retry (3x) on 429/5xx with exponential backoff
     - 30-minute TTL cache keyed on URL + params
+    - In-flight coalescing: concurrent callers for the same key share one request
+      (e.g. an agent arriving while a speculative prefetch is still running)
     """
     cache_key = hashlib.md5(
         json.dumps({"url": url, "params": params}, sort_keys=True).encode()
     ).hexdigest()
 
-    cached = _cache.get(cache_key)
+    cached = http_cache.get(cache_key)
     if cached is not None:
         logger.info("Cache hit for query: %s", params.get("q", ""))
+        note_cache("http", True)
         return cached
 
-    response = get_session().get(url, params=params, timeout=timeout)
-    response.raise_for_status()
-    data = response.json()
-    _cache.set(cache_key, data)
-    return data
+    with _inflight_lock:
+        pending = _inflight.get(cache_key)
+        if pending is None:
+            owner = Future()
+            _inflight[cache_key] = owner
+
+    if pending is not None:
+        logger.info("Joining in-flight request for query: %s", params.get("q", ""))
+        note_cache("http", True)
+        return pending.result(timeout=timeout * 4)
+
+    note_cache("http", False)
+    record_spend("serpapi")
+
+    try:
+        response = get_session().get(url, params=params, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+        http_cache.set(cache_key, data)
+        owner.set_result(data)
+        return data
+    except Exception as e:
+        owner.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(cache_key, None)
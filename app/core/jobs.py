@@ -0,0 +1,264 @@
+"""
+Asynchronous query jobs.
+POST /api/jobs enqueues a query and returns at once; a fixed pool of worker tasks
+drains a bounded queue, so heavy queries no longer depend on how long a client
+(or proxy) keeps a connection open. Each job records the graph stages it has
+finished. Finished jobs are kept for a retention window and then forgotten.
+
+The queue and the run stay in the worker process that accepted the job, but its
+status, stage progress and result are written to a SQLite file shared by every
+worker on the host (JobStore), so a poll routed to any worker finds the job.
+Each write carries a per-job version and never replaces a newer one, so writes
+done off the event loop may land in any order.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+from threading import Lock
+from typing import Awaitable, Callable
+
+from app.core.config import JOB_WORKERS, JOB_QUEUE_SIZE, JOB_RETENTION_SECONDS, JOB_MAX_RETAINED, JOB_STORE_PATH
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id       TEXT PRIMARY KEY,
+    status   TEXT NOT NULL,
+    created  REAL NOT NULL,
+    finished REAL,
+    version  INTEGER NOT NULL,
+    data     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs(created);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs(finished);
+"""
+
+
+class QueueFull(Exception):
+    """The job queue is at capacity; the caller should retry later."""
+
+
+class Job:
+    def __init__(self, query: str, deadline_seconds: float):
+        self.id = uuid.uuid4().hex[:12]
+        self.query = query
+        self.deadline_seconds = deadline_seconds
+        self.status = QUEUED
+        self.created = time.time()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.stages: list[dict] = []
+        self.expected_stages: int | None = None
+        self.result: dict | None = None
+        self.error: str | None = None
+        self.version = 0
+        self.on_change: Callable[["Job"], None] | None = None
+
+    def on_stage(self, stage: str, update: dict | None) -> None:
+        """Graph progress callback: one call per finished node."""
+        self.stages.append({"stage": stage, "seconds": round(time.time() - (self.started or self.created), 2)})
+        if stage == "supervisor" and update is not None:
+            # supervisor + dispatched agents + reflect_and_score + analyzer
+            self.expected_stages = 3 + len(update.get("pending_fetch") or {})
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def finish(self, result: dict | None = None, error: str | None = None) -> None:
+        self.finished = time.time()
+        self.result, self.error = result, error
+        self.status = FAILED if error else DONE
+
+    def to_record(self) -> dict:
+        """Everything needed to rebuild the job in another process."""
+        return {name: getattr(self, name) for name in (
+            "id", "query", "deadline_seconds", "status", "created", "started", "finished",
+            "stages", "expected_stages", "result", "error", "version")}
+
+    @classmethod
+    def from_record(cls, record: dict) -> "Job":
+        job = cls.__new__(cls)
+        job.__dict__.update(record)
+        job.on_change = None
+        return job
+
+    def to_dict(self) -> dict:
+        done = len(self.stages)
+        progress = 1.0 if self.status == DONE else (
+            round(min(done / self.expected_stages, 0.99), 2) if self.expected_stages else 0.0
+        )
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "query": self.query,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "progress": progress,
+            "stages": list(self.stages),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobStore:
+    """
+    Job records in one SQLite file (WAL mode). Finished jobs are readable for the
+    retention window, at most max_retained of them; jobs still unfinished after
+    the window belonged to a worker that exited and are dropped too.
+    """
+
+    def __init__(self, path: str, retention_seconds: float, max_retained: int):
+        self.path = path
+        self._retention = retention_seconds
+        self._max_retained = max_retained
+        self._lock = Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._pid = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections must not cross fork(); reopen in each worker process
+        if self._conn is None or self._pid != os.getpid():
+            try:
+                conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.Error as e:
+                logger.warning("Job store at %s unavailable (%s) — jobs are per process", self.path, e)
+                conn = sqlite3.connect(":memory:", isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def save(self, record: dict) -> None:
+        """Inserts or updates a job unless the stored version is already newer."""
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+                "status = excluded.status, finished = excluded.finished, version = excluded.version, "
+                "data = excluded.data WHERE excluded.version > jobs.version",
+                (record["id"], record["status"], record["created"], record["finished"], record["version"],
+                 json.dumps(record, ensure_ascii=False)))
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT data FROM jobs WHERE id = ? AND COALESCE(finished, created) > ?",
+                (job_id, time.time() - self._retention)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def prune(self) -> None:
+        """Drops jobs past retention, then finished jobs beyond the retained count, oldest first."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM jobs WHERE COALESCE(finished, created) <= ?", (time.time() - self._retention,))
+            conn.execute("DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE finished IS NOT NULL "
+                         "ORDER BY finished DESC LIMIT -1 OFFSET ?)", (self._max_retained,))
+
+    def counts(self) -> dict:
+        """Readable jobs per status, across every worker on the host."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE COALESCE(finished, created) > ? GROUP BY status",
+                (time.time() - self._retention,)).fetchall()
+        return dict(rows)
+
+
+class JobManager:
+    """
+    Bounded queue + worker pool for Jobs. run_job(job) does the work and returns
+    the result; workers start on the first submit, inside the serving event loop.
+    Every state change is written to the shared JobStore off the event loop.
+    """
+
+    def __init__(self, run_job: Callable[[Job], Awaitable[dict]], workers: int = JOB_WORKERS,
+                 queue_size: int = JOB_QUEUE_SIZE, retention_seconds: float = JOB_RETENTION_SECONDS,
+                 max_retained: int = JOB_MAX_RETAINED, path: str = JOB_STORE_PATH):
+        self._run_job = run_job
+        self._workers = workers
+        self._queue_size = queue_size
+        self._store = JobStore(path, retention_seconds, max_retained)
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._inserting = 0      # submits holding a queue slot while their record is written
+
+    def _ensure_workers(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self._queue_size)
+            self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self._workers)]
+
+    def _record(self, job: Job) -> dict:
+        job.version += 1
+        return job.to_record()
+
+    def _insert(self, record: dict) -> None:
+        self._store.save(record)
+        self._store.prune()
+
+    async def _save(self, job: Job) -> None:
+        await asyncio.to_thread(self._store.save, self._record(job))
+
+    def _save_soon(self, job: Job) -> None:
+        # Stage callbacks are synchronous; the write is not awaited, the version keeps it ordered
+        future = asyncio.get_running_loop().run_in_executor(None, self._store.save, self._record(job))
+        future.add_done_callback(_log_failed_save)
+
+    async def submit(self, query: str, deadline_seconds: float) -> Job:
+        self._ensure_workers()
+        if self._queue.qsize() + self._inserting >= self._queue_size:
+            raise QueueFull(f"{self._queue_size} jobs already queued")
+        job = Job(query, deadline_seconds)
+        job.on_change = self._save_soon
+        # Stored before it is queued, so a worker's updates never precede the first record
+        self._inserting += 1
+        try:
+            await asyncio.to_thread(self._insert, self._record(job))
+        finally:
+            self._inserting -= 1
+        self._queue.put_nowait(job)
+        return job
+
+    async def add_finished(self, query: str, result: dict) -> Job:
+        """Registers a job answered without running (e.g. a cache hit)."""
+        job = Job(query, 0)
+        job.started = job.created
+        job.finish(result=result)
+        await asyncio.to_thread(self._insert, self._record(job))
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """Blocking (SQLite): the job as last written by whichever worker runs it."""
+        record = self._store.get(job_id)
+        return None if record is None else Job.from_record(record)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job = await self._queue.get()
+            job.status, job.started = RUNNING, time.time()
+            try:
+                await self._save(job)
+                job.finish(result=await self._run_job(job))
+            except Exception as e:
+                logger.error("Job %s failed: %s", job.id, e, exc_info=True)
+                job.finish(error=str(e))
+            try:
+                await self._save(job)
+            except Exception as e:
+                logger.error("Job %s could not be saved: %s", job.id, e)
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0, **self._store.counts()}
+        return {**counts, "queue_capacity": self._queue_size, "workers": self._workers}
+
+
+def _log_failed_save(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("Job progress not saved: %s", future.exception())
@@ -0,0 +1,74 @@
+"""
+Result caches for the small structured LLM outputs that recur constantly:
+execution plans ("best phone under 30000"), reformulated search queries (poor
+results for the same product) and recommended product lists.
+Each kind is a SQLiteResponseCache in its own file, so it is shared by every worker
+on the host, has its own TTL (LLM_CACHE_TTLS) and host-wide hit/miss counters
+(under llm_cache in /api/health). Lookups are also counted on the active span
+(llm_plan_hits, ...). Callers key entries on normalized inputs and store only
+outputs that parsed cleanly, never their fallbacks.
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+
+from app.core.config import LLM_CACHE, LLM_CACHE_DIR, LLM_CACHE_TTLS, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_MAX_BYTES
+from app.core.logger import note_cache
+from app.core.response_cache import SQLiteResponseCache
+
+logger = logging.getLogger(__name__)
+
+
+def normalized_query(query: str) -> str:
+    """Case, punctuation and spacing removed; word order kept (it can change the meaning)."""
+    return " ".join(re.findall(r"[a-z]+|\d+", (query or "").lower()))
+
+
+class LLMResultCache:
+    def __init__(self, directory: str = LLM_CACHE_DIR, ttls: dict[str, int] = LLM_CACHE_TTLS,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES, max_bytes: int = LLM_CACHE_MAX_BYTES,
+                 enabled: bool = LLM_CACHE):
+        self.enabled = enabled
+        self._caches = {
+            kind: SQLiteResponseCache(os.path.join(directory, f"product_pilot_llm_{kind}.sqlite3"),
+                                      ttl, max_entries, max_bytes)
+            for kind, ttl in ttls.items()
+        }
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.md5(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    def cache(self, kind: str) -> SQLiteResponseCache:
+        return self._caches[kind]
+
+    def get(self, kind: str, key: str):
+        if not self.enabled:
+            return None
+        try:
+            value = self._caches[kind].get(key)
+        except Exception as e:      # a cache failure costs one LLM call, never the request
+            logger.warning("LLM %s cache lookup failed: %s", kind, e)
+            value = None
+        note_cache(f"llm_{kind}", value is not None)
+        return value
+
+    def set(self, kind: str, key: str, value) -> None:
+        if not self.enabled:
+            return
+        try:
+            self._caches[kind].set(key, value)
+        except Exception as e:
+            logger.warning("LLM %s cache write failed: %s", kind, e)
+
+    def stats(self) -> dict:
+        return {kind: cache.stats() for kind, cache in self._caches.items()}
+
+    def clear(self) -> None:
+        for cache in self._caches.values():
+            cache.clear()
+
+
+llm_cache = LLMResultCache()
@@ -1,7 +1,9 @@
 import time
+import asyncio
 import logging
-import json
-from langchain_core.messages import HumanMessage
+import importlib
+from app.core.log_pipeline import JsonArg
+from app.core.request_context import budget_short, record_spend
 from app.core.config import LLM_PROVIDER, GEMINI_MODEL, GOOGLE_API_KEY, QWEN_MODEL, OLLAMA_BASE_URL
 
 logger = logging.getLogger(__name__)
@@ -31,6 +33,23 @@ def get_llm(thinking_budget: int = 0, temperature: float = 0, force_provider: st
         )
     return ChatGoogleGenerativeAI(model=GEMINI_MODEL, temperature=temperature, google_api_key=GOOGLE_API_KEY)
 
+# SDK module each provider needs; imported on first use (or by preload_provider at startup)
+_PROVIDER_MODULES = {"gemini": "langchain_google_genai", "qwen": "langchain_ollama"}
+
+
+def preload_provider(provider: str = None) -> None:
+    """Imports the selected provider's SDK (and LangChain messages) ahead of the first LLM call."""
+    importlib.import_module(_PROVIDER_MODULES.get(provider or LLM_PROVIDER, _PROVIDER_MODULES["gemini"]))
+    importlib.import_module("langchain_core.messages")
+
+
+def _as_messages(messages):
+    if isinstance(messages, str):
+        from langchain_core.messages import HumanMessage
+        return [HumanMessage(content=messages)]
+    return messages
+
+
 _MAX_RETRIES = 2
 _RETRY_DELAY = 2  # seconds between retries
 
@@ -38,12 +57,10 @@ _RETRY_DELAY = 2  # seconds between retries
 def invoke_with_retry(llm, messages, context: str = "LLM") -> str:
     """
     Wraps any LangChain LLM invoke with retry logic.
-    Retries up to _MAX_RETRIES times on transient failures.
+    Retries up to _MAX_RETRIES times on transient failures, unless the request deadline is too close.
     Returns content string or raises on final failure.
     """
-    if isinstance(messages, str):
-        messages = [HumanMessage(content=messages)]
-
+    messages = _as_messages(messages)
     model_name = getattr(llm, "model", type(llm).__name__)
 
     last_error = None
@@ -56,17 +73,48 @@ def invoke_with_retry(llm, messages, context: str = "LLM") -> str:
         except Exception as e:
             last_error = e
             _audit(context, model_name, attempt, round((time.time() - t0) * 1000), False, messages, str(e))
-            if attempt <= _MAX_RETRIES:
+            if attempt <= _MAX_RETRIES and not budget_short(_RETRY_DELAY):
                 logger.warning("%s attempt %d failed: %s — retrying in %ds",
                                context, attempt, e, _RETRY_DELAY)
                 time.sleep(_RETRY_DELAY)
             else:
                 logger.error("%s failed after %d attempts: %s", context, attempt, e)
+                break
+
+    raise last_error
+
+
+async def ainvoke_with_retry(llm, messages, context: str = "LLM") -> str:
+    """
+    Async twin of invoke_with_retry for graph nodes running on the event loop.
+    Same retry policy and audit lines; waits with asyncio.sleep instead of blocking.
+    """
+    messages = _as_messages(messages)
+    model_name = getattr(llm, "model", type(llm).__name__)
+
+    last_error = None
+    for attempt in range(1, _MAX_RETRIES + 2):
+        t0 = time.time()
+        try:
+            response = await llm.ainvoke(messages)
+            _audit(context, model_name, attempt, round((time.time() - t0) * 1000), True, messages)
+            return response.content
+        except Exception as e:
+            last_error = e
+            _audit(context, model_name, attempt, round((time.time() - t0) * 1000), False, messages, str(e))
+            if attempt <= _MAX_RETRIES and not budget_short(_RETRY_DELAY):
+                logger.warning("%s attempt %d failed: %s — retrying in %ds",
+                               context, attempt, e, _RETRY_DELAY)
+                await asyncio.sleep(_RETRY_DELAY)
+            else:
+                logger.error("%s failed after %d attempts: %s", context, attempt, e)
+                break
 
     raise last_error
 
 
 def _audit(context: str, model: str, attempt: int, latency_ms: int, success: bool, messages, error: str = None):
+    record_spend("llm")
     input_chars = sum(len(m.content) for m in messages) if isinstance(messages, list) else len(str(messages))
     entry = {
         "audit": True,
@@ -79,4 +127,4 @@ def _audit(context: str, model: str, attempt: int, latency_ms: int, success: boo
     }
     if error:
         entry["error"] = error
-    logger.info(json.dumps(entry))
+    logger.info("%s", JsonArg(entry))
@@ -0,0 +1,213 @@
+"""
+Non-blocking structured logging.
+The request path only enqueues records: QueueingHandler stamps the request_id (a
+contextvar, so it must be read on the calling thread), drops sampled-out DEBUG
+records from noisy loggers, and puts the record on a bounded queue without
+blocking. A background writer thread drains the queue in batches, formats each
+record as one JSON line (orjson when installed) and writes and flushes once per batch.
+When the queue is full the record is dropped and counted rather than slowing a request.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+
+from app.core.config import LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES
+from app.core.request_context import request_id_var
+
+try:
+    import orjson
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj, default=str).decode()
+except ImportError:     # optional speedup
+    _encoder = json.JSONEncoder(ensure_ascii=False, default=str)
+
+    def _dumps(obj) -> str:
+        return _encoder.encode(obj)
+
+# Argument types that can be formatted later on the writer thread without changing meaning
+_IMMUTABLE_ARGS = (str, int, float, bool, type(None))
+_BATCH_SIZE = 256
+_STOP = object()
+
+
+class JsonArg:
+    """
+    Log argument serialized to JSON only when the record is formatted (on the writer thread).
+    Wrap only values the caller does not mutate after logging.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self) -> str:
+        return _dumps(self.value)
+
+
+class JsonFormatter(logging.Formatter):
+    """Structured JSON logs — parseable by any log aggregator. Used by the writer thread only."""
+
+    def __init__(self):
+        super().__init__()
+        self._second = None
+        self._second_text = ""
+
+    def _time(self, created: float) -> str:
+        # strftime once per second instead of once per record
+        second = int(created)
+        if second != self._second:
+            self._second = second
+            self._second_text = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        return f"{self._second_text},{int((created - second) * 1000):03d}"
+
+    def format(self, record: logging.LogRecord) -> str:
+        return _dumps({
+            "time":       self._time(record.created),
+            "level":      record.levelname,
+            "request_id": getattr(record, "request_id", "-"),
+            "logger":     record.name,
+            "message":    record.getMessage(),
+        })
+
+
+def parse_sample_rates(spec: str) -> dict[str, float]:
+    """"nodes.supervisor_agent=0.1,nodes.analyzer_agent=0.1" → {logger name: share kept}."""
+    rates = {}
+    for part in spec.split(","):
+        name, _, rate = part.strip().partition("=")
+        if name and rate:
+            rates[name] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class QueueingHandler(logging.Handler):
+    """Request-path half of the pipeline: sample, stamp, enqueue."""
+
+    def __init__(self, log_queue: queue.Queue, sample_rates: dict[str, float] | None = None):
+        super().__init__()
+        self._queue = log_queue
+        self._sample_rates = sample_rates or {}
+        self.sampled_out = 0
+        self.dropped = 0
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # No handler lock: the queue is thread-safe and counters are best-effort
+        if not self.filter(record):
+            return False
+        if record.levelno <= logging.DEBUG:
+            rate = self._sample_rates.get(record.name)
+            if rate is not None and random.random() >= rate:
+                self.sampled_out += 1
+                return False
+        self.emit(record)
+        return True
+
+    def emit(self, record: logging.LogRecord) -> None:
+        record.request_id = request_id_var.get("-")
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(a, (*_IMMUTABLE_ARGS, JsonArg)) for a in args)):
+            # Mutable arguments could change before the writer runs — format them now
+            record.msg, record.args = record.getMessage(), None
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """Owns the queue, the QueueingHandler installed on the root logger and the writer thread."""
+
+    def __init__(self, stream=None, queue_size: int = LOG_QUEUE_SIZE, sample_rates: dict[str, float] | None = None):
+        self._stream = stream
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.handler = QueueingHandler(self._queue, sample_rates)
+        self._formatter = JsonFormatter()
+        self._thread: threading.Thread | None = None
+        self.written = 0
+        self.errors = 0
+
+    def start(self) -> "LogPipeline":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write_loop, name="log-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def reset_after_fork(self) -> None:
+        """
+        In a forked child: the writer thread did not survive the fork and the queue's lock
+        may have been held mid-operation. Start over with an empty queue and a new writer.
+        """
+        was_running = self._thread is not None
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self.handler._queue = self._queue
+        self._thread = None
+        if was_running:
+            self.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Writes everything queued so far, then stops the writer."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < _BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in batch:
+                if record is _STOP:
+                    continue
+                try:
+                    lines.append(self._formatter.format(record))
+                except Exception:
+                    self.errors += 1
+            if lines:
+                stream = self._stream or sys.stderr
+                try:
+                    stream.write("\n".join(lines) + "\n")
+                    stream.flush()
+                    self.written += len(lines)
+                except Exception:
+                    self.errors += len(lines)
+            if _STOP in batch:
+                return
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped_queue_full": self.handler.dropped,
+            "sampled_out": self.handler.sampled_out,
+            "errors": self.errors,
+        }
+
+
+log_pipeline = LogPipeline(sample_rates=parse_sample_rates(LOG_SAMPLE_RATES))
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=log_pipeline.reset_after_fork)
+
+
+def setup_logging(level: str = LOG_LEVEL) -> LogPipeline:
+    """Routes all root logging through the pipeline and starts its writer (flushed at exit)."""
+    logging.root.setLevel(level)
+    logging.root.handlers = [log_pipeline.handler]
+    log_pipeline.start()
+    atexit.register(log_pipeline.stop)
+    return log_pipeline
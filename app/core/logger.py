@@ -1,8 +1,32 @@
+"""
+Per-request stage timeline.
+Hot-path code wraps its stages in span("planner"), span("agent.price_agent"), ...;
+spans land in the current request's DebugLogger (returned to the client when it
+asks for debug output) and in process-wide per-stage latency histograms.
+HTTP cache and product store lookups inside a span are counted on it as hits/misses.
+A span entered in a worker thread of a profiled request adds that thread to the profile.
+"""
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
 
+from app.core.profiling import thread_profile
+
+logger = logging.getLogger(__name__)
+
+
 class DebugLogger:
+    """Collects the spans and log events of one request."""
+
     def __init__(self):
         self.logs = []
+        self.spans = []
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
 
     def log(self, step, message, data=None):
         timestamp = datetime.now().strftime("%H:%M:%S")
@@ -12,13 +36,124 @@ class DebugLogger:
             "message": message,
             "data": data
         }
-        self.logs.append(entry)
-        print(f"[{timestamp}] {step}: {message}")
-        if data:
-            print(f"  Data: {data}")
+        with self._lock:
+            self.logs.append(entry)
+        logger.debug("%s: %s", step, message)
+
+    def add_span(self, span: dict) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def elapsed_ms(self, at: float) -> float:
+        return round((at - self._t0) * 1000, 1)
+
+    def timeline(self) -> list[dict]:
+        """Finished spans ordered by start time (an enclosing span before the spans it contains)."""
+        with self._lock:
+            return sorted(self.spans, key=lambda s: (s["start_ms"], s["depth"]))
 
     def clear(self):
-        self.logs = []
+        with self._lock:
+            self.logs = []
+            self.spans = []
 
     def get_logs(self):
         return self.logs
+
+
+debug_logger_var: ContextVar[DebugLogger | None] = ContextVar("debug_logger", default=None)
+_current_span: ContextVar[dict | None] = ContextVar("current_span", default=None)
+
+
+class StageHistograms:
+    """Fixed-bucket latency histograms per stage name (milliseconds)."""
+
+    BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 30000, 60000)
+
+    def __init__(self):
+        self._stages: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, ms: float) -> None:
+        with self._lock:
+            h = self._stages.setdefault(stage, {"counts": [0] * (len(self.BUCKETS_MS) + 1), "count": 0, "sum": 0.0})
+            h["counts"][bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+            h["count"] += 1
+            h["sum"] += ms
+
+    def _quantile(self, counts: list[int], total: int, q: float) -> float | None:
+        """Upper bound of the bucket holding the q-quantile (None = above the last bucket)."""
+        target, seen = q * total, 0
+        for i, count in enumerate(counts):
+            seen += count
+            if seen >= target:
+                return self.BUCKETS_MS[i] if i < len(self.BUCKETS_MS) else None
+        return None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stages = {name: {**h, "counts": list(h["counts"])} for name, h in self._stages.items()}
+        return {
+            name: {
+                "count": h["count"],
+                "avg_ms": round(h["sum"] / h["count"], 1),
+                "p50_le_ms": self._quantile(h["counts"], h["count"], 0.5),
+                "p95_le_ms": self._quantile(h["counts"], h["count"], 0.95),
+                "buckets": dict(zip([f"le_{b}" for b in self.BUCKETS_MS] + ["inf"], h["counts"])),
+            }
+            for name, h in sorted(stages.items())
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stages.clear()
+
+
+stage_histograms = StageHistograms()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Times the body as one stage. Yields the span's attribute dict so the body can
+    add results (e.g. span["path"] = "fast"). Nested spans record their parent's name.
+    """
+    collector = debug_logger_var.get()
+    parent = _current_span.get()
+    record = {"name": name, **attrs, "depth": parent["depth"] + 1 if parent is not None else 0}
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    try:
+        with thread_profile():      # worker threads join a sampled request's CPU profile
+            yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        end = time.perf_counter()
+        _current_span.reset(token)
+        duration_ms = round((end - start) * 1000, 1)
+        stage_histograms.observe(name, duration_ms)
+        if collector is not None:
+            if parent is not None:
+                record["parent"] = parent["name"]
+            record["start_ms"] = collector.elapsed_ms(start)
+            record["duration_ms"] = duration_ms
+            record["thread"] = threading.current_thread().name
+            collector.add_span(record)
+
+
+def annotate_span(**attrs) -> None:
+    """Adds attributes to the innermost active span (no-op outside spans)."""
+    current = _current_span.get()
+    if current is not None:
+        current.update(attrs)
+
+
+def note_cache(cache: str, hit: bool) -> None:
+    """Counts a cache lookup on the innermost active span (no-op outside spans)."""
+    current = _current_span.get()
+    if current is None:
+        return
+    key = f"{cache}_{'hits' if hit else 'misses'}"
+    current[key] = current.get(key, 0) + 1
@@ -0,0 +1,82 @@
+"""
+Per-process memory report for the API workers.
+Reads /proc/<pid>/smaps_rollup (Linux): RSS counts every page a process maps, so
+summing it across prefork workers counts pages shared copy-on-write with the master
+once per worker. PSS divides each shared page among the processes mapping it, so the
+PSS total is the memory the server really uses. The sum of RSS minus the sum of PSS
+is the memory saved by sharing.
+"""
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+_master_pid: int | None = None
+
+
+def mark_master(pid: int | None = None) -> None:
+    """Called by the prefork master before forking; workers inherit it."""
+    global _master_pid
+    _master_pid = pid or os.getpid()
+
+
+def master_pid() -> int | None:
+    return _master_pid
+
+
+def is_prefork_worker() -> bool:
+    return _master_pid is not None and os.getpid() != _master_pid
+
+
+def parse_smaps_rollup(text: str) -> dict:
+    fields = {}
+    for line in text.splitlines():
+        name, _, rest = line.partition(":")
+        parts = rest.split()
+        if len(parts) == 2 and parts[1] == "kB":
+            fields[name] = int(parts[0])
+    return {
+        "rss_kb": fields.get("Rss", 0),
+        "pss_kb": fields.get("Pss", 0),
+        "shared_kb": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private_kb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def process_memory(pid: int) -> dict | None:
+    """RSS / PSS / shared / private kB of one process, or None where /proc is not available."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as f:
+            return {"pid": pid, **parse_smaps_rollup(f.read())}
+    except OSError:
+        return None
+
+
+def _children(pid: int) -> list[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", encoding="ascii") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def memory_report() -> dict:
+    """Master and every worker in prefork mode; just this process otherwise."""
+    if _master_pid is not None:
+        master = process_memory(_master_pid)
+        workers = [m for m in (process_memory(pid) for pid in _children(_master_pid)) if m]
+    else:
+        master = None
+        workers = [m for m in [process_memory(os.getpid())] if m]
+    processes = workers + ([master] if master else [])
+    total_rss = sum(m["rss_kb"] for m in processes)
+    total_pss = sum(m["pss_kb"] for m in processes)
+    return {
+        "mode": "prefork" if _master_pid is not None else "single",
+        "this_pid": os.getpid(),
+        "master": master,
+        "workers": workers,
+        "total_rss_kb": total_rss,
+        "total_pss_kb": total_pss,
+        "shared_savings_kb": total_rss - total_pss,
+    }
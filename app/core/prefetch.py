@@ -0,0 +1,71 @@
+"""
+Speculative SerpAPI prefetch.
+Product names guessed from the raw query are fetched into the HTTP cache
+while the planner LLM call runs. Work for names the plan does not confirm is discarded.
+"""
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from app.core.product_index import canonical_product_id
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=6, thread_name_prefix="prefetch")
+
+
+def _normalize(name: str) -> str:
+    return canonical_product_id(name)
+
+
+class SpeculativePrefetch:
+    """
+    Starts one background fetch per (guessed product, fetcher).
+    fetchers maps a label ("shopping", "organic") to a callable taking a product name;
+    the callables are expected to populate the shared HTTP cache as a side effect.
+    """
+
+    def __init__(self, products: list[str], fetchers: dict[str, Callable[[str], object]]):
+        self.products = list(products)
+        self._fetchers = fetchers
+        self._futures: dict[str, dict[str, Future]] = {}
+
+    def start(self) -> "SpeculativePrefetch":
+        for product in self.products:
+            self._futures[_normalize(product)] = {
+                label: _executor.submit(self._fetch, label, fetch, product)
+                for label, fetch in self._fetchers.items()
+            }
+        if self.products:
+            logger.info("PREFETCH: started %d fetches for %s",
+                        len(self.products) * len(self._fetchers), self.products)
+        return self
+
+    @staticmethod
+    def _fetch(label: str, fetch: Callable[[str], object], product: str) -> None:
+        try:
+            fetch(product)
+        except Exception as e:
+            logger.warning("PREFETCH: %s fetch failed for %s: %s", label, product, e)
+
+    def reconcile(self, planned_products: list[str], planned_labels: set[str] | None = None) -> dict:
+        """
+        Keeps fetches for products (and fetch labels) the plan confirmed and cancels the rest.
+        Fetches already running cannot be stopped; their results only warm the cache.
+        """
+        planned = {_normalize(p) for p in planned_products}
+        kept, discarded, cancelled = [], [], 0
+        for key, futures in self._futures.items():
+            if key not in planned:
+                discarded.append(key)
+                cancelled += sum(1 for f in futures.values() if f.cancel())
+                continue
+            kept.append(key)
+            if planned_labels is not None:
+                cancelled += sum(1 for label, f in futures.items()
+                                 if label not in planned_labels and f.cancel())
+
+        stats = {"kept": kept, "discarded": discarded, "cancelled": cancelled}
+        if self._futures:
+            logger.info("PREFETCH: kept=%s discarded=%s cancelled=%d", kept, discarded, cancelled)
+        return stats
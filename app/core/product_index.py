@@ -0,0 +1,212 @@
+"""
+Product name canonicalization.
+Maps raw product strings from the planner, shopping listing titles and user text
+("Samsung Galaxy S24", "Galaxy S24 5G (Onyx Black, 256GB)", "samsung s24") to one
+canonical product ID, so caches, request coalescing and per-product data are shared
+across spelling variants.
+"""
+import re
+import logging
+from difflib import SequenceMatcher
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+FUZZY_THRESHOLD = 0.85
+_MAX_ALIASES = 50_000
+
+# Listing-title decorations: "(128 GB)", "[Renewed]", " - Black", " | 5G", ", 8GB RAM"
+_DECORATION = re.compile(r"\(.*?\)|\[.*?\]")
+_SUFFIX = re.compile(r"\s+[-|–]\s+.*$|,.*$")
+_STORAGE = re.compile(r"^\d+(?:gb|tb|mb)$")
+_TOKEN = re.compile(r"[a-z0-9+]+")
+_SERIES_WITH_NUMBER = re.compile(r"^([a-z]{4,})(\d+)$")   # "iphone15" → "iphone 15"
+
+_NOISE = {
+    "5g", "4g", "lte", "wifi", "wi", "fi", "dual", "sim", "unlocked", "new", "latest",
+    "renewed", "refurbished", "with", "gb", "tb", "ram", "rom", "storage", "edition",
+    "black", "white", "blue", "green", "red", "silver", "gold", "grey", "gray", "titanium",
+    "natural", "onyx", "graphite", "midnight", "starlight", "purple", "pink", "yellow",
+    "cream", "violet", "marble", "mint", "jade", "cobalt", "amber", "obsidian", "porcelain",
+    "hazel", "phantom", "space", "desert", "lavender", "sapphire", "emerald",
+}
+# Series words that already imply the brand, so the brand word is optional
+_SERIES_BRAND = {
+    "iphone": "apple", "ipad": "apple", "macbook": "apple", "airpods": "apple", "imac": "apple",
+    "pixel": "google", "galaxy": "samsung", "surface": "microsoft", "redmi": "xiaomi",
+    "xps": "dell", "spectre": "hp", "thinkpad": "lenovo", "zenbook": "asus",
+}
+# "galaxy s24" and "samsung s24" are the same product — fold the series into the brand
+_SERIES_ALIASES = {"galaxy": "samsung"}
+# Tokens that distinguish variants of the same model; fuzzy matches must agree on them
+_VARIANTS = {"pro", "max", "ultra", "plus", "mini", "lite", "fe", "air", "se", "neo", "edge",
+             "fold", "flip", "note", "prime", "turbo", "+"}
+
+
+def names_product_line(text: str) -> bool:
+    """True if text names a product series or a brand that has one ("macbook", "pixel", "apple")."""
+    tokens = set(_TOKEN.findall((text or "").lower()))
+    return bool(tokens & (_SERIES_BRAND.keys() | set(_SERIES_BRAND.values())))
+
+
+def _strip_decoration(name: str) -> str:
+    return _SUFFIX.sub("", _DECORATION.sub(" ", name)).strip()
+
+
+def signature(name: str) -> str:
+    """Normalized token form: lowercase, decorations/noise removed, implied brands dropped."""
+    tokens = []
+    for token in _TOKEN.findall(_strip_decoration(name).lower()):
+        match = _SERIES_WITH_NUMBER.match(token)
+        tokens.extend(match.groups() if match else [token])
+    tokens = [t for t in tokens if t not in _NOISE and not _STORAGE.match(t)]
+
+    implied = {_SERIES_BRAND[t] for t in tokens if t in _SERIES_BRAND}
+    folded = []
+    for token in tokens:
+        token = _SERIES_ALIASES.get(token, token)
+        if token in implied and token not in _SERIES_ALIASES.values():
+            continue
+        if token not in folded:
+            folded.append(token)
+    return " ".join(folded)
+
+
+def clean_display_name(name: str) -> str:
+    """Human-readable form of a raw name: decorations and noise words removed, casing kept."""
+    words = [
+        w for w in _strip_decoration(name).split()
+        if w.lower().strip(".,") not in _NOISE and not _STORAGE.match(w.lower())
+    ]
+    return " ".join(words) or name.strip()
+
+
+def _model_tokens(sig: str) -> frozenset:
+    return frozenset(t for t in sig.split() if any(ch.isdigit() for ch in t))
+
+
+def _variant_tokens(sig: str) -> frozenset:
+    return frozenset(t for t in sig.split() if t in _VARIANTS)
+
+
+def model_variant_tokens(text: str) -> tuple[tuple, tuple]:
+    """Model tokens ("12r", "s24", "15") and variant words ("pro", "fe") in a name or query."""
+    sig = signature(text)
+    return tuple(sorted(_model_tokens(sig))), tuple(sorted(_variant_tokens(sig)))
+
+
+class ProductIndex:
+    """
+    Thread-safe entity resolver.
+    - exact: raw alias or signature already known
+    - fuzzy: token-index candidates with identical model/variant tokens and a close signature
+    - alias learning: every resolved raw string is remembered for O(1) lookups next time
+    """
+
+    def __init__(self, threshold: float = FUZZY_THRESHOLD):
+        self._threshold = threshold
+        self._aliases: dict[str, str] = {}       # lowercased raw name → canonical ID
+        self._display: dict[str, str] = {}       # canonical ID → display name
+        self._token_index: dict[str, set] = {}   # signature token → canonical IDs
+        self._lock = Lock()
+        self._counts = {"alias_hits": 0, "exact": 0, "fuzzy": 0, "new": 0}
+
+    def resolve(self, name: str) -> str:
+        """Returns the canonical product ID for a raw name, registering new products."""
+        raw = " ".join((name or "").lower().split())
+        if not raw:
+            return ""
+        with self._lock:
+            canonical = self._aliases.get(raw)
+            if canonical is not None:
+                self._counts["alias_hits"] += 1
+                return canonical
+
+            sig = signature(name) or raw
+            if sig in self._display:
+                canonical, how = sig, "exact"
+            else:
+                canonical = self._fuzzy_match(sig)
+                how = "fuzzy" if canonical else "new"
+                if canonical is None:
+                    canonical = self._register(sig, clean_display_name(name))
+                else:
+                    logger.info("Product alias learned: %r → %r", name, canonical)
+
+            self._counts[how] += 1
+            if len(self._aliases) < _MAX_ALIASES:
+                self._aliases[raw] = canonical
+            return canonical
+
+    def learn_alias(self, alias: str, name: str) -> str:
+        """Explicitly maps alias to the canonical product of name."""
+        canonical = self.resolve(name)
+        with self._lock:
+            self._aliases[" ".join(alias.lower().split())] = canonical
+        return canonical
+
+    def display_name(self, canonical_id: str) -> str:
+        with self._lock:
+            return self._display.get(canonical_id, canonical_id)
+
+    def search_name(self, name: str) -> str:
+        """The spelling used for external searches, shared by every variant of a product."""
+        return self.display_name(self.resolve(name)) or name
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"products": len(self._display), "aliases": len(self._aliases), **self._counts}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._aliases.clear()
+            self._display.clear()
+            self._token_index.clear()
+
+    def export_entries(self) -> dict:
+        with self._lock:
+            return {"display": dict(self._display), "aliases": dict(self._aliases)}
+
+    def load_entries(self, state: dict) -> int:
+        """Restores known products and learned aliases; entries learned since startup win."""
+        with self._lock:
+            for sig, display in state.get("display", {}).items():
+                if sig not in self._display:
+                    self._register(sig, display)
+            for raw, canonical in state.get("aliases", {}).items():
+                if len(self._aliases) >= _MAX_ALIASES:
+                    break
+                self._aliases.setdefault(raw, canonical)
+            return len(self._display)
+
+    def _register(self, sig: str, display: str) -> str:
+        self._display[sig] = display
+        for token in sig.split():
+            self._token_index.setdefault(token, set()).add(sig)
+        return sig
+
+    def _fuzzy_match(self, sig: str) -> str | None:
+        models, variants = _model_tokens(sig), _variant_tokens(sig)
+        # Model numbers are the most selective tokens; fall back to all tokens without them
+        probe = models or frozenset(sig.split())
+        candidates = set().union(*(self._token_index.get(t, set()) for t in probe)) if probe else set()
+
+        best, best_score = None, self._threshold
+        for candidate in candidates:
+            if _model_tokens(candidate) != models or _variant_tokens(candidate) != variants:
+                continue
+            score = SequenceMatcher(None, sig, candidate).ratio()
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+
+product_index = ProductIndex()
+
+
+def canonical_product_id(name: str) -> str:
+    return product_index.resolve(name)
+
+
+def search_name(name: str) -> str:
+    return product_index.search_name(name)
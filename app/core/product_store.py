@@ -0,0 +1,145 @@
+"""
+Per-product knowledge store.
+Keeps each agent's assembled per-product entry (price entry, rating entry,
+classified reviews, info snippets) keyed by canonical product ID and data type,
+so overlapping queries ("iPhone 15 vs S24", "S24 vs Pixel 8") share work.
+"""
+import time
+import logging
+from collections import OrderedDict
+from threading import Lock
+
+from app.core.config import PRODUCT_STORE_TTLS, PRODUCT_STORE_MAXSIZE
+from app.core.product_index import canonical_product_id
+from app.core.logger import note_cache
+
+logger = logging.getLogger(__name__)
+
+
+def canonical_product_key(name: str) -> str:
+    return canonical_product_id(name)
+
+
+def has_data(data):
+    if not data:
+        return False
+    if isinstance(data, list):
+        for item in data:
+            if isinstance(item, dict):
+                if item.get("info"):
+                    return True
+                if item.get("prices"):
+                    return True
+                if item.get("ratings"):
+                    return True
+                reviews = item.get("reviews")
+                if isinstance(reviews, dict):
+                    if reviews.get("positive_reviews") or reviews.get("negative_reviews"):
+                        return True
+    return False
+
+
+class ProductStore:
+    """Thread-safe LRU store with a separate TTL per data type."""
+
+    def __init__(self, ttls: dict[str, int], maxsize: int = 5000):
+        self._entries: OrderedDict[tuple[str, str], tuple[float, dict]] = OrderedDict()
+        self._ttls = ttls
+        self._maxsize = maxsize
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, product: str, data_type: str) -> dict | None:
+        key = (canonical_product_key(product), data_type)
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and time.time() - item[0] < self._ttls.get(data_type, 0):
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return item[1]
+            if item is not None:
+                del self._entries[key]
+            self._misses += 1
+            return None
+
+    def has(self, product: str, data_type: str) -> bool:
+        """Freshness check that does not count towards hit/miss stats."""
+        key = (canonical_product_key(product), data_type)
+        with self._lock:
+            item = self._entries.get(key)
+            return item is not None and time.time() - item[0] < self._ttls.get(data_type, 0)
+
+    def stored_at(self, product: str, data_type: str) -> float | None:
+        """When a still-fresh entry was stored; None when there is none. Not counted in stats."""
+        key = (canonical_product_key(product), data_type)
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and time.time() - item[0] < self._ttls.get(data_type, 0):
+                return item[0]
+            return None
+
+    def put(self, data_type: str, entries: list[dict]) -> None:
+        """Stores per-product entries; each entry must carry its "product" name."""
+        now = time.time()
+        with self._lock:
+            for entry in entries:
+                if not entry.get("product"):
+                    continue
+                key = (canonical_product_key(entry["product"]), data_type)
+                self._entries[key] = (now, entry)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def lookup(self, products: list[str], data_type: str) -> tuple[list[dict], list[str]]:
+        """
+        Splits products into stored entries and names still missing.
+        Stored entries are relabelled with the requested spelling of the product.
+        """
+        found, missing = [], []
+        for product in products:
+            entry = self.get(product, data_type)
+            note_cache("store", entry is not None)
+            if entry is None:
+                missing.append(product)
+            else:
+                found.append({**entry, "product": product})
+        return found, missing
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def export_entries(self) -> list:
+        """Unexpired [data_type, stored_at, entry] rows, least recently used first."""
+        now = time.time()
+        with self._lock:
+            return [[data_type, stored_at, entry] for (_, data_type), (stored_at, entry) in self._entries.items()
+                    if now - stored_at < self._ttls.get(data_type, 0)]
+
+    def load_entries(self, rows: list) -> int:
+        """
+        Restores snapshot rows with their original timestamps, so each keeps only the TTL
+        it had left. Entries already stored (fetched since startup) are not replaced.
+        """
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            for data_type, stored_at, entry in rows:
+                if now - stored_at >= self._ttls.get(data_type, 0) or not entry.get("product"):
+                    continue
+                key = (canonical_product_key(entry["product"]), data_type)
+                if key not in self._entries:
+                    self._entries[key] = (stored_at, entry)
+                    loaded += 1
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+        return loaded
+
+
+product_store = ProductStore(PRODUCT_STORE_TTLS, maxsize=PRODUCT_STORE_MAXSIZE)
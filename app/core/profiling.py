@@ -0,0 +1,358 @@
+"""
+Sampled deep profiling of /api/query runs.
+A small share of requests (PROFILE_SAMPLE_RATE), or any request sending the
+PROFILE_HEADER header, runs under three profilers at once:
+
+- CPU: cProfile with a per-thread CPU clock, in the event loop thread and in every
+  worker thread that enters a stage span for the request (agents, product fetches);
+- wall-clock: a sampler thread reading the stacks of those threads every
+  PROFILE_WALL_INTERVAL_MS, so time spent waiting on HTTP and LLM calls shows up too;
+- allocations: a tracemalloc snapshot at the end of the run (memory still held) and its peak.
+
+Only one request per worker is profiled at a time; the event loop thread profile also
+sees other requests served meanwhile. Each run writes <stamp>-<request_id>.cpu.pstats,
+.alloc.snapshot and .json (summary) to PROFILE_DIR; summarize_profiles() aggregates the
+summaries for the metrics endpoint, including the frames we suspect of costing too much
+(JsonFormatter, json.dumps by caller, LangGraph state copying).
+"""
+import os
+import sys
+import json
+import time
+import random
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.core.config import (PROFILE_SAMPLE_RATE, PROFILE_DIR, PROFILE_MAX_KEPT,
+                             PROFILE_WALL_INTERVAL_MS, PROFILE_TOP_FRAMES)
+
+logger = logging.getLogger(__name__)
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) + os.sep
+
+# Functions whose cumulative CPU time is always reported, with their top callers
+_SUSPECTS = {
+    "JsonFormatter.format": lambda path, func: path.endswith(os.path.join("app", "core", "log_pipeline.py")) and func == "format",
+    "json.dumps": lambda path, func: path.endswith(os.path.join("json", "__init__.py")) and func == "dumps",
+    "copy.deepcopy": lambda path, func: path.endswith("copy.py") and func == "deepcopy",
+    "langgraph state copying": lambda path, func: f"{os.sep}langgraph{os.sep}" in path and "copy" in func,
+}
+
+
+def _short_path(path: str) -> str:
+    if path.startswith(_ROOT):
+        return path[len(_ROOT):]
+    if "site-packages" + os.sep in path:
+        return path.split("site-packages" + os.sep, 1)[1]
+    return os.sep.join(path.split(os.sep)[-2:])
+
+
+def _label(key: tuple) -> str:
+    path, line, func = key
+    if path == "~":
+        return func
+    return f"{func} ({_short_path(path)}:{line})"
+
+
+def _package(path: str) -> str:
+    """Top-level package or module a frame belongs to (builtins count as "builtins")."""
+    if path == "~":
+        return "builtins"
+    if path.startswith("<"):
+        return path.strip("<>")
+    if path.startswith(_ROOT):
+        return path[len(_ROOT):].split(os.sep, 1)[0]
+    if "site-packages" + os.sep in path:
+        return path.split("site-packages" + os.sep, 1)[1].split(os.sep, 1)[0]
+    parts = path.split(os.sep)
+    return parts[-2] if parts[-1] == "__init__.py" and len(parts) > 1 else os.path.splitext(parts[-1])[0]
+
+
+class _WallSampler(threading.Thread):
+    """Samples the current stack of each registered thread at a fixed interval."""
+
+    def __init__(self, threads: set, lock: threading.Lock, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self._threads = threads
+        self._lock = lock
+        self._interval = interval
+        self._stopped = threading.Event()
+        self.self_counts = Counter()
+        self.inclusive_counts = Counter()
+        self.samples = 0
+
+    def run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            frames = sys._current_frames()
+            with self._lock:
+                idents = list(self._threads)
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                self.samples += 1
+                seen = set()
+                leaf = True
+                while frame is not None:
+                    code = frame.f_code
+                    key = (code.co_filename, code.co_firstlineno, code.co_name)
+                    if leaf:
+                        self.self_counts[key] += 1
+                        leaf = False
+                    if key not in seen:
+                        seen.add(key)
+                        self.inclusive_counts[key] += 1
+                    frame = frame.f_back
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+class RequestProfile:
+    """CPU, wall-clock and allocation profile of one request."""
+
+    def __init__(self, request_id: str, top: int = PROFILE_TOP_FRAMES):
+        self.request_id = request_id
+        self.top = top
+        self.running = False
+        self._lock = threading.Lock()
+        self._threads: set[int] = set()          # threads currently profiled (sampled by the wall sampler)
+        self._thread_profiles: list[cProfile.Profile] = []
+        self._main: cProfile.Profile | None = None
+        self._sampler: _WallSampler | None = None
+        self._owns_tracemalloc = False
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._peak = 0
+        self._started = 0.0
+        self._t0 = 0.0
+        self._wall_ms = 0.0
+
+    def start(self) -> None:
+        self._started = time.time()
+        self._t0 = time.perf_counter()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+        tracemalloc.reset_peak()
+        self._threads.add(threading.get_ident())
+        self._sampler = _WallSampler(self._threads, self._lock, PROFILE_WALL_INTERVAL_MS / 1000)
+        self._sampler.start()
+        self._main = cProfile.Profile(time.thread_time)
+        self._main.enable()
+        self.running = True
+
+    def stop(self) -> None:
+        self.running = False
+        self._main.disable()
+        self._sampler.stop()
+        self._wall_ms = (time.perf_counter() - self._t0) * 1000
+        self._snapshot = tracemalloc.take_snapshot()
+        self._peak = tracemalloc.get_traced_memory()[1]
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+
+    def enter_thread(self) -> cProfile.Profile | None:
+        """Starts profiling the calling worker thread; None when it is already profiled."""
+        ident = threading.get_ident()
+        with self._lock:
+            if not self.running or ident in self._threads:
+                return None
+            self._threads.add(ident)
+        profiler = cProfile.Profile(time.thread_time)
+        profiler.enable()
+        return profiler
+
+    def exit_thread(self, profiler: cProfile.Profile) -> None:
+        profiler.disable()
+        with self._lock:
+            self._threads.discard(threading.get_ident())
+            if self.running:
+                self._thread_profiles.append(profiler)
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self._main)
+        for profiler in self._thread_profiles:
+            stats.add(profiler)
+        return stats
+
+    def summary(self, stats: pstats.Stats) -> dict:
+        entries = stats.stats      # (path, line, func) → (primitive calls, calls, self s, cumulative s, callers)
+        by_self = sorted(entries.items(), key=lambda item: item[1][2], reverse=True)[:self.top]
+        packages = Counter()
+        for (path, _, _), (_, _, self_s, _, _) in entries.items():
+            packages[_package(path)] += self_s
+
+        suspects = {}
+        for name, matches in _SUSPECTS.items():
+            calls, self_s, cumulative_s, callers = 0, 0.0, 0.0, Counter()
+            for (path, line, func), (_, nc, tt, ct, caller_map) in entries.items():
+                if not matches(path, func):
+                    continue
+                calls, self_s, cumulative_s = calls + nc, self_s + tt, cumulative_s + ct
+                for caller, caller_stats in caller_map.items():
+                    callers[_label(caller)] += caller_stats[3]
+            suspects[name] = {
+                "calls": calls,
+                "self_ms": round(self_s * 1000, 2),
+                "cumulative_ms": round(cumulative_s * 1000, 2),
+                "top_callers": {caller: round(s * 1000, 2) for caller, s in callers.most_common(5)},
+            }
+
+        samples = self._sampler.samples or 1
+        return {
+            "request_id": self.request_id,
+            "started": self._started,
+            "wall_ms": round(self._wall_ms, 1),
+            "cpu": {
+                "total_ms": round(stats.total_tt * 1000, 2),
+                "threads": 1 + len(self._thread_profiles),
+                "top_self": [
+                    {"frame": _label(key), "calls": nc, "self_ms": round(tt * 1000, 2), "cumulative_ms": round(ct * 1000, 2)}
+                    for key, (_, nc, tt, ct, _) in by_self
+                ],
+                "by_package": {pkg: round(s * 1000, 2) for pkg, s in packages.most_common(self.top)},
+            },
+            "wall": {
+                "samples": self._sampler.samples,
+                "interval_ms": PROFILE_WALL_INTERVAL_MS,
+                "top_self": [{"frame": _label(key), "pct": round(100 * count / samples, 1)}
+                             for key, count in self._sampler.self_counts.most_common(self.top)],
+                "top_inclusive": [{"frame": _label(key), "pct": round(100 * count / samples, 1)}
+                                  for key, count in self._sampler.inclusive_counts.most_common(self.top)],
+            },
+            "alloc": {
+                "peak_kb": round(self._peak / 1024, 1),
+                "top_live": [
+                    {"line": f"{_short_path(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                     "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+                    for stat in self._snapshot.statistics("lineno")[:self.top]
+                ],
+            },
+            "suspects": suspects,
+        }
+
+    def write(self, directory: str = PROFILE_DIR) -> dict:
+        """Writes the profile files and returns the summary."""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(self._started))}-{self.request_id}")
+        stats = self.stats()
+        stats.dump_stats(base + ".cpu.pstats")
+        self._snapshot.dump(base + ".alloc.snapshot")
+        summary = self.summary(stats)
+        summary["files"] = [os.path.basename(base) + ext for ext in (".cpu.pstats", ".alloc.snapshot", ".json")]
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=1)
+        _prune(directory)
+        return summary
+
+
+def _prune(directory: str, keep: int = PROFILE_MAX_KEPT) -> None:
+    """Keeps the newest `keep` profiles (names start with a timestamp)."""
+    summaries = sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+    for name in summaries[:max(0, len(summaries) - keep)]:
+        base = name[:-len(".json")]
+        for ext in (".json", ".cpu.pstats", ".alloc.snapshot"):
+            try:
+                os.remove(os.path.join(directory, base + ext))
+            except FileNotFoundError:
+                pass
+
+
+profile_var: ContextVar[RequestProfile | None] = ContextVar("request_profile", default=None)
+_active = threading.Lock()      # one profiled request per worker
+
+
+@contextmanager
+def maybe_profile(request_id: str, requested: bool = False, directory: str = PROFILE_DIR):
+    """
+    Profiles the body when requested or sampled (and no other profile is running).
+    Yields the RequestProfile, or None when this request is not profiled.
+    """
+    if not (requested or random.random() < PROFILE_SAMPLE_RATE) or not _active.acquire(blocking=False):
+        yield None
+        return
+    profile = RequestProfile(request_id)
+    token = profile_var.set(profile)
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile_var.reset(token)
+        try:
+            profile.stop()
+            summary = profile.write(directory)
+            logger.info("Profile written for request %s (%.0f ms wall, %.0f ms CPU)",
+                        request_id, summary["wall_ms"], summary["cpu"]["total_ms"])
+        except Exception as e:
+            logger.warning("Profiling failed for request %s: %s", request_id, e)
+        finally:
+            _active.release()
+
+
+@contextmanager
+def thread_profile():
+    """Adds the calling worker thread to the current request's profile for the body."""
+    profile = profile_var.get()
+    profiler = profile.enter_thread() if profile is not None else None
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profile.exit_thread(profiler)
+
+
+def summarize_profiles(directory: str = PROFILE_DIR, limit: int = 20, top: int = PROFILE_TOP_FRAMES) -> dict:
+    """Aggregates the newest `limit` profile summaries: hottest frames, packages and suspects."""
+    try:
+        names = sorted((n for n in os.listdir(directory) if n.endswith(".json")), reverse=True)[:limit]
+    except FileNotFoundError:
+        names = []
+    summaries = []
+    for name in names:
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                summaries.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+
+    cpu_self, wall_self, wall_inclusive, packages = Counter(), Counter(), Counter(), Counter()
+    suspects: dict[str, Counter] = {}
+    cpu_total = 0.0
+    for summary in summaries:
+        cpu_total += summary["cpu"]["total_ms"]
+        for frame in summary["cpu"]["top_self"]:
+            cpu_self[frame["frame"]] += frame["self_ms"]
+        packages.update(summary["cpu"]["by_package"])
+        for frame in summary["wall"]["top_self"]:
+            wall_self[frame["frame"]] += frame["pct"] / len(summaries)
+        for frame in summary["wall"]["top_inclusive"]:
+            wall_inclusive[frame["frame"]] += frame["pct"] / len(summaries)
+        for name, values in summary["suspects"].items():
+            suspects.setdefault(name, Counter()).update(
+                {"calls": values["calls"], "self_ms": values["self_ms"], "cumulative_ms": values["cumulative_ms"]})
+
+    def share(ms: float) -> float:
+        return round(100 * ms / cpu_total, 1) if cpu_total else 0.0
+
+    return {
+        "profiles": len(summaries),
+        "cpu_total_ms": round(cpu_total, 2),
+        "cpu_top_self": [{"frame": f, "self_ms": round(ms, 2), "pct": share(ms)} for f, ms in cpu_self.most_common(top)],
+        "cpu_by_package": [{"package": p, "self_ms": round(ms, 2), "pct": share(ms)} for p, ms in packages.most_common(top)],
+        "wall_top_self": [{"frame": f, "pct": round(pct, 1)} for f, pct in wall_self.most_common(top)],
+        "wall_top_inclusive": [{"frame": f, "pct": round(pct, 1)} for f, pct in wall_inclusive.most_common(top)],
+        "suspects": {
+            name: {"calls": int(values["calls"]), "self_ms": round(values["self_ms"], 2),
+                   "cumulative_ms": round(values["cumulative_ms"], 2), "cpu_pct": share(values["cumulative_ms"])}
+            for name, values in suspects.items()
+        },
+        "recent": [{"request_id": s["request_id"], "started": s["started"], "wall_ms": s["wall_ms"],
+                    "cpu_ms": s["cpu"]["total_ms"], "files": s.get("files", [])} for s in summaries],
+    }
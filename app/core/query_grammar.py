@@ -0,0 +1,198 @@
+"""
+Cheap, LLM-free parsing of product queries.
+Guesses product names from comparison phrasing ("X vs Y", "compare X and Y")
+so work can start before the planner LLM call returns.
+"""
+import re
+
+from app.core.product_index import names_product_line
+
+# Strong connectives always separate products
+_STRONG_SPLIT = re.compile(r"\s+(?:vs\.?|versus|v/s)\s+", re.IGNORECASE)
+# Weak connectives separate products only when the query is clearly a comparison
+_WEAK_SPLIT = re.compile(r"\s+(?:and|or|with|against)\s+|\s*,\s*", re.IGNORECASE)
+_COMPARE_CUE = re.compile(r"\b(?:compare|comparison|difference|differences)\b", re.IGNORECASE)
+_OR_SPLIT = re.compile(r"\s+or\s+", re.IGNORECASE)
+# Splits an "or" query into its list items ("iphone 15, pixel 8 or s24")
+_LIST_SPLIT = re.compile(r"\s+(?:or|and)\s+|\s*,\s*", re.IGNORECASE)
+_COMMA = re.compile(r"\s*,\s*")
+_ALNUM = re.compile(r"[^\W_]")
+
+# Words that frame a comparison but are never part of a product name
+_FILLER = {
+    "a", "an", "the", "which", "what", "whats", "is", "are", "one", "should", "i",
+    "me", "my", "buy", "get", "choose", "pick", "better", "best", "cheaper",
+    "more", "less", "most", "affordable", "expensive", "worth", "it", "compare",
+    "comparison", "comparing", "difference", "differences", "between", "of",
+    "and", "or", "to", "for", "in", "india", "vs", "versus", "please", "tell",
+    "about", "how", "does", "do", "with", "against", "good", "value", "money",
+}
+
+# Aspect words the user asks about — these map to agents, not products
+_ASPECTS = {
+    "price", "prices", "pricing", "cost", "costs", "budget", "deal", "deals",
+    "spec", "specs", "specifications", "features", "feature", "display",
+    "camera", "cameras", "battery", "chipset", "processor", "performance",
+    "review", "reviews", "experience", "reliable", "reliability", "problems",
+    "issues", "rating", "ratings", "rated", "popular", "popularity",
+}
+
+_STRIP_WORDS = _FILLER | _ASPECTS
+# Words opening a trailing clause ("for coding", "in India 2024", "which is lighter");
+# a segment is cut at the first one after its first word
+_CLAUSE_WORDS = {
+    "for", "in", "under", "below", "within", "around", "upto", "which", "that", "who",
+    "with", "on", "at", "from", "when", "while", "if", "because", "as",
+}
+_MAX_PRODUCT_TOKENS = 6
+
+
+def _clean_segment(segment: str) -> str:
+    budget = _BUDGET.search(segment)
+    if budget:
+        segment = segment[:budget.start()]
+    # Punctuation-only tokens ("-", "/") are separators, never part of a name
+    tokens = [t for t in re.findall(r"[\w+\-./]+", segment) if _ALNUM.search(t)]
+    while tokens and tokens[0].lower().strip(".") in _STRIP_WORDS:
+        tokens.pop(0)
+    for i, token in enumerate(tokens[1:], start=1):
+        if token.lower() in _CLAUSE_WORDS:
+            tokens = tokens[:i]
+            break
+    while tokens and tokens[-1].lower().strip(".") in _STRIP_WORDS:
+        tokens.pop()
+    return " ".join(tokens)
+
+
+def _is_clean(product: str) -> bool:
+    """No framing, aspect or clause word left inside the name."""
+    return not any(t.lower().strip(".") in _STRIP_WORDS | _CLAUSE_WORDS for t in product.split())
+
+
+def _is_specific(product: str) -> bool:
+    """A usable product name has a model number or at least brand + model words."""
+    tokens = product.split()
+    if not tokens or len(tokens) > _MAX_PRODUCT_TOKENS:
+        return False
+    return any(ch.isdigit() for ch in product) or len(tokens) >= 2
+
+
+def split_comparison(query: str) -> list[str]:
+    """
+    Splits a query on comparison connectives and strips framing/aspect words.
+    Returns raw candidate names (possibly unspecific); [] if no connective found.
+    """
+    text = (query or "").strip().rstrip("?.!")
+    if not text:
+        return []
+
+    if _STRONG_SPLIT.search(text):
+        # A comma still separates list items around "vs" ("iphone 15, pixel 8 vs s24")
+        segments = [part for segment in _STRONG_SPLIT.split(text) for part in _COMMA.split(segment)]
+    elif _COMPARE_CUE.search(text):
+        segments = _WEAK_SPLIT.split(text)
+    elif _OR_SPLIT.search(text):
+        segments = _LIST_SPLIT.split(text)
+    else:
+        return []
+
+    candidates = []
+    for segment in segments:
+        name = _clean_segment(segment)
+        if name and name.lower() not in (c.lower() for c in candidates):
+            candidates.append(name)
+    return candidates
+
+
+def guess_products(query: str) -> list[str]:
+    """
+    Loose guess for speculative work: every specific-looking name in a comparison.
+    Unlike extract_comparison_products, a single unusable segment does not reject the rest.
+    """
+    return [c for c in split_comparison(query) if _is_specific(c) and _is_clean(c)]
+
+
+def extract_comparison_products(query: str) -> list[str]:
+    """
+    Returns product names for clear comparison queries, [] when not confident.
+    Confident = at least two specific names, no unusable segments and no framing or
+    clause words left inside a name (the LLM planner handles those queries).
+    """
+    candidates = split_comparison(query)
+    if len(candidates) < 2 or not all(_is_specific(c) and _is_clean(c) for c in candidates):
+        return []
+    return candidates
+
+
+def content_tokens(query: str) -> list[str]:
+    """
+    Lowercased words and numbers with comparison framing removed; letters and digits
+    are split ("iphone15" → "iphone", "15"). Aspect words are kept — they select agents.
+    """
+    tokens = re.findall(r"[a-z]+|\d+", (query or "").lower())
+    return [t for t in tokens if t not in _FILLER]
+
+
+# ── Fast-path planner ──
+# Mirrors the agent-selection rules in the supervisor's planning prompt.
+
+AGENT_KEYWORDS = {
+    "price_agent": (
+        "affordable", "price", "prices", "pricing", "cheaper", "cheapest", "cost",
+        "costs", "budget", "under", "below", "within", "deal", "deals", "value for money",
+    ),
+    "product_info_agent": (
+        "spec", "specs", "specification", "specifications", "feature", "features",
+        "display", "screen", "camera", "cameras", "battery", "chipset", "processor",
+        "performance",
+    ),
+    "review_agent": (
+        "review", "reviews", "experience", "reliable", "reliability", "worth it",
+        "problems", "issues",
+    ),
+    "rating_agent": ("rated", "popular", "rating", "ratings", "best rated"),
+}
+ALL_AGENTS = list(AGENT_KEYWORDS)
+_AGENT_PATTERNS = {
+    agent: re.compile(r"\b(?:" + "|".join(re.escape(k) for k in keywords) + r")\b", re.IGNORECASE)
+    for agent, keywords in AGENT_KEYWORDS.items()
+}
+
+_RECOMMENDATION_CUE = re.compile(
+    r"\b(?:best|recommend|recommendation|suggest|suggestion|top|good|which\s+\w+\s+should\s+i\s+buy)\b",
+    re.IGNORECASE,
+)
+_BUDGET = re.compile(
+    r"\b(?:under|below|within|less\s+than|up\s*to|upto|around)\s+(?:rs\.?|inr|₹)?\s*[\d,.]+\s*k?\b",
+    re.IGNORECASE,
+)
+
+
+def select_agents(query: str) -> list[str]:
+    """Minimum agent set from keywords; no specific angle → all agents."""
+    agents = [agent for agent, pattern in _AGENT_PATTERNS.items() if pattern.search(query or "")]
+    return agents or list(ALL_AGENTS)
+
+
+def fast_plan(query: str) -> tuple[dict | None, str]:
+    """
+    Deterministic planner for the common cases.
+    Returns (plan, reason). plan is None when the LLM planner should decide;
+    reason says which rule resolved or rejected the query.
+    """
+    if split_comparison(query):
+        products = extract_comparison_products(query)
+        if not products:
+            return None, "unspecific_products"
+        return {"intent": "comparison", "products": products,
+                "agents": select_agents(query)}, "comparison_grammar"
+
+    if _RECOMMENDATION_CUE.search(query or ""):
+        # Any digit left after removing the budget clause is probably a model number; a
+        # series or brand name ("is macbook air good for students") is a question about it
+        if any(ch.isdigit() for ch in _BUDGET.sub("", query)) or names_product_line(query):
+            return None, "possible_product_mention"
+        return {"intent": "recommendation", "products": [],
+                "agents": select_agents(query)}, "recommendation_cue"
+
+    return None, "no_pattern"
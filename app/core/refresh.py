@@ -0,0 +1,144 @@
+"""
+Refresh-ahead for popular route-cache answers.
+Every route-cache hit adds to the answer key's popularity score in the shared cache
+(halving every REFRESH_HALF_LIFE_SECONDS). Every REFRESH_INTERVAL_SECONDS one worker
+per host (the holder of the "refresh-ahead" lease) re-runs the most popular queries
+whose answers expire within REFRESH_LEAD_SECONDS, so hot queries never fall back to a
+full run. The new answer replaces the old one in a single cache write, so readers
+see either the old or the new answer, never a gap.
+
+Spend is capped: each refresh counts the SerpAPI requests and LLM calls it makes
+(SpendMeter), the host-wide total over the last hour is kept in the shared cache, and
+a refresh is skipped when its estimated cost (what the last refresh of that key cost,
+else REFRESH_DEFAULT_COST) would exceed REFRESH_BUDGET_PER_HOUR. Refreshes also wait
+while user requests would queue for an admission slot.
+"""
+import os
+import uuid
+import asyncio
+import logging
+from collections import Counter
+from typing import Awaitable, Callable
+
+from app.core.admission import AdmissionController, admission
+from app.core.config import (
+    REFRESH_INTERVAL_SECONDS, REFRESH_LEAD_SECONDS, REFRESH_MIN_SCORE, REFRESH_HALF_LIFE_SECONDS,
+    REFRESH_BUDGET_PER_HOUR, REFRESH_DEFAULT_COST, REFRESH_MAX_PER_CYCLE,
+)
+from app.core.request_context import SpendMeter, spend_var
+from app.core.response_cache import SQLiteResponseCache
+
+logger = logging.getLogger(__name__)
+
+_CYCLE_LEASE = "refresh-ahead"
+_BUDGET_WINDOW_SECONDS = 3600
+
+
+class RefreshAhead:
+    """refresh(query) recomputes one query and stores the new answer in the route cache."""
+
+    def __init__(self, cache: SQLiteResponseCache, refresh: Callable[[str], Awaitable[object]],
+                 gate: AdmissionController = admission,
+                 interval: float = REFRESH_INTERVAL_SECONDS, lead_seconds: float = REFRESH_LEAD_SECONDS,
+                 min_score: float = REFRESH_MIN_SCORE, half_life: float = REFRESH_HALF_LIFE_SECONDS,
+                 budget_per_hour: float = REFRESH_BUDGET_PER_HOUR, default_cost: float = REFRESH_DEFAULT_COST,
+                 max_per_cycle: int = REFRESH_MAX_PER_CYCLE):
+        self._cache = cache
+        self._refresh = refresh
+        self._gate = gate
+        self._interval = interval
+        self._lead_seconds = lead_seconds
+        self._min_score = min_score
+        self.half_life = half_life
+        self._budget = budget_per_hour
+        self._default_cost = default_cost
+        self._max_per_cycle = max_per_cycle
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._task: asyncio.Task | None = None
+        self._counts = Counter()
+
+    def record_hit(self, key: str, query: str) -> None:
+        try:
+            self._cache.record_hit(key, query, self.half_life)
+        except Exception as e:      # popularity is best-effort; never fail the request over it
+            logger.debug("Popularity update failed for %s: %s", key, e)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="refresh-ahead")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.run_cycle()
+            except Exception as e:
+                logger.warning("Refresh-ahead cycle failed: %s", e)
+
+    async def run_cycle(self) -> dict:
+        """Refreshes due popular answers within the budget; returns what this cycle did."""
+        done = Counter()
+        # Held slightly past the next tick, so the same worker keeps running cycles while it lives
+        if not await asyncio.to_thread(self._cache.acquire_lease, _CYCLE_LEASE, self._owner, self._interval * 1.5):
+            return dict(done)
+        self._counts["cycles"] += 1
+        candidates = await asyncio.to_thread(self._cache.refresh_candidates, self._lead_seconds,
+                                             self._min_score, self.half_life, self._max_per_cycle)
+        for key, query, score, cost in candidates:
+            if self._gate.estimated_wait() > 0:
+                done["deferred_busy"] += len(candidates) - sum(done.values())
+                break
+            estimate = cost if cost is not None else self._default_cost
+            spent = await asyncio.to_thread(self._cache.spent_since, _BUDGET_WINDOW_SECONDS)
+            if spent + estimate > self._budget:
+                done["skipped_budget"] += 1
+                continue
+            done["refreshed" if await self._refresh_one(key, query) else "failed"] += 1
+        self._counts.update(done)
+        if candidates:
+            logger.info("Refresh-ahead: %d due, %s", len(candidates), dict(done))
+        return dict(done)
+
+    async def _refresh_one(self, key: str, query: str) -> bool:
+        meter = SpendMeter()
+
+        async def metered():
+            # Runs in its own task, so the meter only sees this refresh's calls
+            spend_var.set(meter)
+            return await self._refresh(query)
+
+        ok = True
+        try:
+            await asyncio.create_task(metered())
+        except Exception as e:
+            logger.warning("Refresh-ahead failed for %r: %s", query[:60], e)
+            ok = False
+        spent = meter.total
+        self._counts["spend"] += spent
+        await asyncio.to_thread(self._cache.record_spend, spent)
+        await asyncio.to_thread(self._cache.record_refresh, key, spent)
+        return ok
+
+    def stats(self) -> dict:
+        counts = dict(self._counts)
+        try:
+            spent = self._cache.spent_since(_BUDGET_WINDOW_SECONDS)
+        except Exception:
+            spent = None
+        return {
+            "running": self._task is not None,
+            "budget_per_hour": self._budget,
+            "spent_last_hour": spent,
+            **{name: counts.get(name, 0)
+               for name in ("cycles", "refreshed", "failed", "skipped_budget", "deferred_busy", "spend")},
+        }
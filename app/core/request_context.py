@@ -1,14 +1,70 @@
 """
 Per-request context storage using Python contextvars.
-Allows request_id to flow through logs without being passed explicitly.
+Allows request_id and the request deadline to flow through logs and nodes
+without being passed explicitly. Both survive asyncio tasks and asyncio.to_thread.
 """
+import time
 import uuid
+import threading
 from contextvars import ContextVar
 
 request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+# Absolute time.monotonic() deadline for the current request; None = unbounded
+deadline_var: ContextVar[float | None] = ContextVar("deadline", default=None)
 
 
 def new_request_id() -> str:
     rid = str(uuid.uuid4())[:8]
     request_id_var.set(rid)
     return rid
+
+
+def set_deadline(seconds: float) -> float:
+    deadline = time.monotonic() + seconds
+    deadline_var.set(deadline)
+    return deadline
+
+
+def time_remaining() -> float | None:
+    """Seconds left before the request deadline, or None when no deadline is set."""
+    deadline = deadline_var.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def budget_short(reserve: float) -> bool:
+    """True when less than `reserve` seconds remain. Always False without a deadline."""
+    remaining = time_remaining()
+    return remaining is not None and remaining < reserve
+
+
+class SpendMeter:
+    """Counts paid external calls (SerpAPI requests, LLM calls) made on behalf of one run."""
+
+    def __init__(self):
+        self._counts: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[kind] = self._counts.get(kind, 0) + n
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    @property
+    def total(self) -> int:
+        with self._lock:
+            return sum(self._counts.values())
+
+
+# Set by callers that budget their spend (e.g. refresh-ahead); None = not metered
+spend_var: ContextVar[SpendMeter | None] = ContextVar("spend", default=None)
+
+
+def record_spend(kind: str, n: int = 1) -> None:
+    meter = spend_var.get()
+    if meter is not None:
+        meter.add(kind, n)
@@ -0,0 +1,358 @@
+"""
+Route response cache shared by every worker process on the host.
+Backed by one SQLite file (WAL mode), so a query answered by one uvicorn worker
+is a hit in all of them. Bounded by entry count and total bytes; eviction removes
+least-recently-used rows through an index, never by scanning the table.
+Hit/miss/eviction counters live in the same file, so /health shows host-wide numbers.
+Reads take no write lock: a lookup is one SELECT (WAL readers never wait for writers),
+and its hit/miss count, recency update and expired-row delete are queued in memory and
+applied in one transaction with the next write, or every _FLUSH_SECONDS.
+Short-lived leases in the same file let one worker claim a key it is computing.
+A popularity table keeps a decaying hit score per answer key (with a query that
+produced it) and a spend log, both used by refresh-ahead.
+analysis_cache is a second instance in its own file, holding memoized analyzer output.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+from threading import Lock
+from collections import Counter
+
+from app.core.config import (
+    ROUTE_CACHE_PATH, ROUTE_CACHE_TTL, ROUTE_CACHE_MAX_ENTRIES, ROUTE_CACHE_MAX_BYTES,
+    ANALYSIS_CACHE_PATH, ANALYSIS_CACHE_TTL, ANALYSIS_CACHE_MAX_ENTRIES, ANALYSIS_CACHE_MAX_BYTES,
+)
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key      TEXT PRIMARY KEY,
+    value    TEXT NOT NULL,
+    size     INTEGER NOT NULL,
+    created  REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed);
+CREATE INDEX IF NOT EXISTS entries_created ON entries(created);
+CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS popularity (
+    key     TEXT PRIMARY KEY,
+    query   TEXT NOT NULL,
+    score   REAL NOT NULL,
+    updated REAL NOT NULL,
+    cost    REAL,
+    refreshed REAL
+);
+CREATE TABLE IF NOT EXISTS spend (at REAL NOT NULL, units REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS spend_at ON spend(at);
+INSERT OR IGNORE INTO counters VALUES
+    ('entries', 0), ('bytes', 0), ('hits', 0), ('misses', 0), ('evictions', 0), ('expirations', 0);
+"""
+
+
+_FLUSH_SECONDS = 1.0
+_FLUSH_MAX_PENDING = 100
+
+
+class SQLiteResponseCache:
+    """
+    TTL + LRU cache of JSON-serializable responses.
+    Entry count and byte totals are kept in the counters table and updated in the
+    same transaction as each write, so bounds are checked without COUNT(*)/SUM().
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, max_entries: int, max_bytes: int):
+        self.path = path
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._pid = None
+        self._reset_pending()
+
+    def _reset_pending(self) -> None:
+        self._pending_access: dict[str, float] = {}     # key → last read time
+        self._pending_counts = Counter()                # hits / misses
+        self._pending_expired: set[str] = set()
+        self._last_flush = time.monotonic()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections must not cross fork(); reopen in each worker process
+        if self._conn is None or self._pid != os.getpid():
+            try:
+                conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.Error as e:
+                logger.warning("Route cache at %s unavailable (%s) — using a per-process cache", self.path, e)
+                conn = sqlite3.connect(":memory:", isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn, self._pid = conn, os.getpid()
+            self._reset_pending()      # a parent's queued updates are its own
+        return self._conn
+
+    def _bump(self, conn, name: str, delta: int = 1) -> None:
+        conn.execute("UPDATE counters SET value = value + ? WHERE name = ?", (delta, name))
+
+    def _delete(self, conn, key: str, size: int, counter: str) -> None:
+        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._bump(conn, "entries", -1)
+        self._bump(conn, "bytes", -size)
+        self._bump(conn, counter)
+
+    def get(self, key: str, record: bool = True):
+        """record=False is a peek: no hit/miss counted and recency left unchanged (used for polling)."""
+        with self._lock:
+            row = self._connect().execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is not None and now - row[1] >= self._ttl:
+                self._pending_expired.add(key)
+                row = None
+            if record:
+                self._pending_counts["misses" if row is None else "hits"] += 1
+                if row is not None:
+                    self._pending_access[key] = now
+            if self._flush_due():
+                self._flush()
+        return None if row is None else json.loads(row[0])
+
+    def _flush_due(self) -> bool:
+        pending = len(self._pending_access) + len(self._pending_expired) + sum(self._pending_counts.values())
+        return pending >= _FLUSH_MAX_PENDING or (
+            pending > 0 and time.monotonic() - self._last_flush >= _FLUSH_SECONDS)
+
+    def _apply_pending(self, conn) -> None:
+        """Writes queued read bookkeeping; caller holds the lock inside a write transaction."""
+        if self._pending_access:
+            conn.executemany("UPDATE entries SET accessed = ? WHERE key = ? AND accessed < ?",
+                             [(at, key, at) for key, at in self._pending_access.items()])
+        for name, count in self._pending_counts.items():
+            self._bump(conn, name, count)
+        now = time.time()
+        for key in self._pending_expired:
+            row = conn.execute("SELECT size, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] >= self._ttl:
+                self._delete(conn, key, row[0], "expirations")
+
+    def _flush(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:     # busy: keep the updates for the next flush
+            logger.debug("Route cache flush deferred: %s", e)
+            return
+        try:
+            self._apply_pending(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._reset_pending()
+
+    def flush(self) -> None:
+        """Applies queued hit/miss counts, recency updates and expired-row deletes now."""
+        with self._lock:
+            self._flush()
+
+    def set(self, key: str, value) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Queued read bookkeeping rides along, so eviction sees current recency
+                self._apply_pending(conn)
+                old = conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+                now = time.time()
+                conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", (key, payload, size, now, now))
+                self._bump(conn, "entries", 0 if old else 1)
+                self._bump(conn, "bytes", size - (old[0] if old else 0))
+                self._evict(conn, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._reset_pending()
+
+    def _evict(self, conn, now: float) -> None:
+        """Drops expired rows (oldest first), then least-recently-used rows until within bounds."""
+        while True:
+            entries, size = self._totals(conn)
+            over = entries > self._max_entries or size > self._max_bytes
+            oldest = conn.execute("SELECT key, size, created FROM entries ORDER BY created LIMIT 1").fetchone()
+            if oldest is not None and now - oldest[2] >= self._ttl:
+                self._delete(conn, oldest[0], oldest[1], "expirations")
+                continue
+            if not over:
+                return
+            lru = conn.execute("SELECT key, size FROM entries ORDER BY accessed LIMIT 1").fetchone()
+            if lru is None:
+                return
+            self._delete(conn, lru[0], lru[1], "evictions")
+
+    def acquire_lease(self, key: str, owner: str, seconds: float) -> bool:
+        """Claims key for owner unless another owner holds an unexpired lease on it."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT owner, expires FROM leases WHERE key = ?", (key,)).fetchone()
+                now = time.time()
+                if row is not None and row[0] != owner and row[1] > now:
+                    conn.execute("COMMIT")
+                    return False
+                conn.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (key, owner, now + seconds))
+                conn.execute("COMMIT")
+                return True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def lease_held(self, key: str) -> bool:
+        with self._lock:
+            row = self._connect().execute("SELECT expires FROM leases WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] > time.time()
+
+    def release_lease(self, key: str, owner: str) -> None:
+        with self._lock:
+            self._connect().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+    def record_hit(self, key: str, query: str, half_life: float) -> None:
+        """Adds one to key's popularity score, which halves every half_life seconds without hits."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT score, updated FROM popularity WHERE key = ?", (key,)).fetchone()
+                now = time.time()
+                score = 1.0 + (row[0] * 0.5 ** ((now - row[1]) / half_life) if row else 0.0)
+                conn.execute("INSERT INTO popularity (key, query, score, updated) VALUES (?, ?, ?, ?) "
+                             "ON CONFLICT(key) DO UPDATE SET query = excluded.query, score = excluded.score, "
+                             "updated = excluded.updated", (key, query, score, now))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def record_refresh(self, key: str, cost: float) -> None:
+        """Remembers when key was last refreshed and what that cost."""
+        with self._lock:
+            self._connect().execute("UPDATE popularity SET cost = ?, refreshed = ? WHERE key = ?",
+                                    (cost, time.time(), key))
+
+    def refresh_candidates(self, lead_seconds: float, min_score: float, half_life: float,
+                           limit: int) -> list[tuple[str, str, float, float | None]]:
+        """
+        Popular entries that go stale (fresh_until in the answer, else row expiry) within
+        lead_seconds and were not refreshed within it, most popular first:
+        (key, query, decayed score, cost of its last refresh). Also forgets the
+        popularity of keys no longer cached.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM popularity WHERE key NOT IN (SELECT key FROM entries)")
+            rows = conn.execute(
+                "SELECT p.key, p.query, p.score, p.updated, p.cost FROM popularity p JOIN entries e ON e.key = p.key "
+                "WHERE e.created > ? AND COALESCE(json_extract(e.value, '$.fresh_until'), e.created + ?) <= ? "
+                "AND (p.refreshed IS NULL OR p.refreshed < ?)",
+                (now - self._ttl, self._ttl, now + lead_seconds, now - lead_seconds)).fetchall()
+        candidates = [(key, query, score * 0.5 ** ((now - updated) / half_life), cost)
+                      for key, query, score, updated, cost in rows]
+        candidates = [c for c in candidates if c[2] >= min_score]
+        candidates.sort(key=lambda c: c[2], reverse=True)
+        return candidates[:limit]
+
+    def record_spend(self, units: float) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM spend WHERE at < ?", (now - 86400,))
+            conn.execute("INSERT INTO spend VALUES (?, ?)", (now, units))
+
+    def spent_since(self, seconds: float) -> float:
+        """Units spent on this host (all workers) in the last `seconds`."""
+        with self._lock:
+            row = self._connect().execute("SELECT COALESCE(SUM(units), 0) FROM spend WHERE at > ?",
+                                          (time.time() - seconds,)).fetchone()
+        return row[0]
+
+    @staticmethod
+    def _totals(conn) -> tuple[int, int]:
+        rows = dict(conn.execute("SELECT name, value FROM counters WHERE name IN ('entries', 'bytes')"))
+        return rows["entries"], rows["bytes"]
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._flush()
+            counters = dict(self._connect().execute("SELECT name, value FROM counters"))
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "max_entries": self._max_entries,
+            "max_bytes": self._max_bytes,
+            "hit_rate": round(counters["hits"] / lookups, 3) if lookups else 0.0,
+        }
+
+    def export_entries(self) -> list:
+        """Unexpired [key, JSON value, created] rows, least recently used first."""
+        with self._lock:
+            self._flush()
+            rows = self._connect().execute(
+                "SELECT key, value, created FROM entries WHERE created > ? ORDER BY accessed",
+                (time.time() - self._ttl,)).fetchall()
+        return [list(row) for row in rows]
+
+    def load_entries(self, rows: list) -> int:
+        """
+        Restores snapshot rows with their original creation time (so the remaining TTL is
+        kept). Keys already cached on this host are left alone; bounds apply as usual.
+        """
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for key, payload, created in rows:
+                    if now - created >= self._ttl:
+                        continue
+                    size = len(payload.encode("utf-8"))
+                    inserted = conn.execute("INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, ?)",
+                                            (key, payload, size, created, created)).rowcount
+                    if inserted:
+                        self._bump(conn, "entries")
+                        self._bump(conn, "bytes", size)
+                        loaded += 1
+                self._evict(conn, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return loaded
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            self._reset_pending()
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM leases")
+            conn.execute("DELETE FROM popularity")
+            conn.execute("DELETE FROM spend")
+            conn.execute("UPDATE counters SET value = 0")
+
+
+response_cache = SQLiteResponseCache(
+    ROUTE_CACHE_PATH, ROUTE_CACHE_TTL, ROUTE_CACHE_MAX_ENTRIES, ROUTE_CACHE_MAX_BYTES
+)
+analysis_cache = SQLiteResponseCache(
+    ANALYSIS_CACHE_PATH, ANALYSIS_CACHE_TTL, ANALYSIS_CACHE_MAX_ENTRIES, ANALYSIS_CACHE_MAX_BYTES
+)
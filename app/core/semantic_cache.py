@@ -0,0 +1,168 @@
+"""
+Semantic keys for the route cache.
+"iPhone 15 vs S24", "S24 vs iPhone 15" and "compare iphone 15 and s24" should share
+one cached answer. Two layers, both local and LLM-free:
+
+- plan key: intent + sorted canonical products + agent set, from the planner output
+  (free on the fast path). Recommendation plans name no products, so their key uses
+  the query's content words instead.
+- near-duplicate index: character trigram cosine similarity over the order-normalized
+  query text, consulted before planning so rephrasings skip the planner entirely.
+  Candidates must carry exactly the same model and variant tokens, compared as the
+  product index compares fuzzy matches ("iPhone 14" never matches "iPhone 15",
+  "OnePlus 12R" never matches "OnePlus 12", "S24 FE" never matches "S24"), and ask
+  for the same aspects (a "reviews" query never matches a "price" query).
+
+question_class() is the wording-independent part of a question (intent, aspects asked
+about, numbers such as budgets), used with the data to key the analyzer's output.
+"""
+import math
+import hashlib
+import json
+import logging
+from collections import Counter, OrderedDict
+from threading import Lock
+
+from app.core.config import SEMANTIC_CACHE_THRESHOLD, NEAR_DUPLICATE_MAX_ENTRIES
+from app.core.product_index import canonical_product_id, model_variant_tokens
+from app.core.query_grammar import content_tokens, select_agents, AGENT_KEYWORDS
+
+logger = logging.getLogger(__name__)
+
+
+def normalized_text(query: str) -> str:
+    """Content words in sorted order, so word order and framing do not matter."""
+    return " ".join(sorted(content_tokens(query)))
+
+
+_ASPECT_WORDS = {word for keywords in AGENT_KEYWORDS.values() for word in keywords if " " not in word}
+
+
+def question_class(query: str, intent: str) -> dict:
+    tokens = content_tokens(query)
+    return {
+        "intent": intent or "",
+        "aspects": sorted({t.rstrip("s") for t in tokens if t in _ASPECT_WORDS}),
+        "numbers": sorted(t for t in tokens if t.isdigit()),
+    }
+
+
+def plan_key(plan: dict, query: str) -> str:
+    products = sorted({canonical_product_id(p) for p in plan.get("products") or []})
+    key = {
+        "intent": plan.get("intent", ""),
+        "products": products,
+        "agents": sorted(plan.get("agent_plan") or []),
+    }
+    if not products:
+        key["terms"] = normalized_text(query)
+    return "plan:" + hashlib.md5(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _trigrams(text: str) -> Counter:
+    padded = f"  {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    dot = sum(count * b[gram] for gram, count in a.items() if gram in b)
+    if not dot:
+        return 0.0
+    return dot / (math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values())))
+
+
+class NearDuplicateIndex:
+    """
+    Bounded map of recent normalized queries → plan key, bucketed by the model and
+    variant tokens in the query and the agents its keywords select, so each lookup only
+    scores queries naming the same models, variants and aspects.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, maxsize: int = NEAR_DUPLICATE_MAX_ENTRIES):
+        self.threshold = threshold
+        self._maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[str, Counter, tuple]] = OrderedDict()  # text → (key, trigrams, bucket)
+        self._buckets: dict[tuple, set] = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _bucket(query: str) -> tuple:
+        models, variants = model_variant_tokens(query)
+        return models, variants, tuple(select_agents(query))
+
+    def add(self, query: str, key: str) -> None:
+        text = normalized_text(query)
+        if not text:
+            return
+        bucket = self._bucket(query)
+        with self._lock:
+            previous = self._entries.pop(text, None)
+            if previous is not None:
+                self._buckets.get(previous[2], set()).discard(text)
+            self._entries[text] = (key, _trigrams(text), bucket)
+            self._buckets.setdefault(bucket, set()).add(text)
+            while len(self._entries) > self._maxsize:
+                old, (_, _, old_bucket) = self._entries.popitem(last=False)
+                self._buckets.get(old_bucket, set()).discard(old)
+
+    def match(self, query: str) -> tuple[str | None, float]:
+        """Returns (plan key of the most similar known query, similarity), or (None, best score)."""
+        text = normalized_text(query)
+        if not text:
+            return None, 0.0
+        grams = _trigrams(text)
+        best_key, best = None, 0.0
+        bucket = self._bucket(query)
+        with self._lock:
+            for candidate in self._buckets.get(bucket, ()):
+                key, candidate_grams, _ = self._entries[candidate]
+                score = 1.0 if candidate == text else _cosine(grams, candidate_grams)
+                if score > best:
+                    best_key, best = key, score
+        if best >= self.threshold:
+            return best_key, best
+        return None, best
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def export_entries(self) -> list:
+        """[normalized text, plan key, bucket] rows, oldest first (trigrams are recomputed on load)."""
+        with self._lock:
+            return [[text, key, [list(part) for part in bucket]] for text, (key, _, bucket) in self._entries.items()]
+
+    def load_entries(self, rows: list) -> int:
+        with self._lock:
+            for text, key, bucket in rows[-self._maxsize:]:
+                if text in self._entries:
+                    continue
+                bucket = tuple(tuple(part) for part in bucket)
+                self._entries[text] = (key, _trigrams(text), bucket)
+                self._buckets.setdefault(bucket, set()).add(text)
+            while len(self._entries) > self._maxsize:
+                old, (_, _, old_bucket) = self._entries.popitem(last=False)
+                self._buckets.get(old_bucket, set()).discard(old)
+            return len(self._entries)
+
+
+class SemanticCacheStats:
+    """Counts how each route-cache hit was found."""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = Lock()
+
+    def record(self, outcome: str) -> None:
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        return {name: counts.get(name, 0) for name in ("exact_hits", "near_duplicate_hits", "plan_hits", "misses")}
+
+
+near_duplicates = NearDuplicateIndex()
+semantic_stats = SemanticCacheStats()
@@ -0,0 +1,121 @@
+"""
+Cache snapshots for warm deploys.
+save_snapshot() dumps the live caches, each row with its original timestamp, into
+one gzip-compressed JSON file (written to a temp file, then renamed into place).
+load_snapshot() restores them at startup. Rows keep their original timestamps, so
+every entry only lives out the TTL it had left, and expired rows are skipped.
+Sections load in order: the product index first, because product store keys are
+canonical product IDs.
+
+Under the prefork server each worker holds its own HTTP cache, product store,
+near-duplicate keys and product index, so one process cannot save them all. Each worker
+writes those sections to its own part file (save_worker_part); the master, after the
+workers have written them, loads every part into its own caches and saves the single
+merged snapshot (merge_worker_parts).
+"""
+import os
+import glob
+import gzip
+import json
+import time
+import logging
+
+from app.core.config import CACHE_SNAPSHOT_PATH
+from app.core.http_client import http_cache
+from app.core.product_index import product_index
+from app.core.product_store import product_store
+from app.core.response_cache import response_cache, analysis_cache
+from app.core.llm_cache import llm_cache
+from app.core.semantic_cache import near_duplicates
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+# section name → cache with export_entries() / load_entries(rows)
+SECTIONS = {
+    "product_index": product_index,
+    "http": http_cache,
+    "product_store": product_store,
+    "route": response_cache,
+    "near_duplicates": near_duplicates,
+    "analysis": analysis_cache,
+    **{f"llm_{kind}": llm_cache.cache(kind) for kind in ("plan", "reformulation", "recommendation")},
+}
+
+
+# Sections held in process memory (the rest live in SQLite files shared by all workers)
+LOCAL_SECTIONS = ("product_index", "http", "product_store", "near_duplicates")
+
+
+def save_snapshot(path: str = CACHE_SNAPSHOT_PATH, only: tuple[str, ...] | None = None) -> dict:
+    """Writes every section (or only those named) atomically; returns row counts per section plus the file size."""
+    started = time.perf_counter()
+    sections = {name: cache.export_entries() for name, cache in SECTIONS.items()
+                if only is None or name in only}
+    document = {"version": SNAPSHOT_VERSION, "created": time.time(), "sections": sections}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+        json.dump(document, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+    counts = {name: len(rows) if isinstance(rows, list) else len(rows.get("display", {}))
+              for name, rows in sections.items()}
+    summary = {"path": path, "bytes": os.path.getsize(path), "sections": counts,
+               "ms": round((time.perf_counter() - started) * 1000, 1)}
+    logger.info("Cache snapshot saved: %s", summary)
+    return summary
+
+
+def load_snapshot(path: str = CACHE_SNAPSHOT_PATH) -> dict:
+    """Restores a snapshot if one exists; returns entries loaded per section ({} when none)."""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            document = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable cache snapshot %s: %s", path, e)
+        return {}
+    if document.get("version") != SNAPSHOT_VERSION:
+        logger.warning("Ignoring cache snapshot %s with version %s", path, document.get("version"))
+        return {}
+
+    loaded = {}
+    for name, cache in SECTIONS.items():
+        rows = document["sections"].get(name)
+        if rows is None:
+            continue
+        try:
+            loaded[name] = cache.load_entries(rows)
+        except Exception as e:
+            logger.warning("Skipping snapshot section %s: %s", name, e)
+    age = round(time.time() - document.get("created", time.time()))
+    logger.info("Cache snapshot loaded (%ss old): %s", age, loaded)
+    return loaded
+
+
+def worker_part_path(path: str, pid: int) -> str:
+    return f"{path}.worker-{pid}"
+
+
+def save_worker_part(path: str = CACHE_SNAPSHOT_PATH) -> dict:
+    """Prefork worker: saves this process's in-memory sections for the master to merge."""
+    return save_snapshot(worker_part_path(path, os.getpid()), LOCAL_SECTIONS)
+
+
+def merge_worker_parts(path: str = CACHE_SNAPSHOT_PATH) -> dict:
+    """
+    Prefork master: loads every worker part into this process's caches (entries already
+    present are kept), deletes the parts and saves the merged snapshot to path.
+    """
+    parts = sorted(glob.glob(glob.escape(path) + ".worker-*"))
+    for part in parts:
+        load_snapshot(part)
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+    summary = save_snapshot(path)
+    summary["worker_parts"] = len(parts)
+    return summary
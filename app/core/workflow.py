@@ -1,20 +1,36 @@
 from langgraph.graph import StateGraph, END
 from app.models.graph_state import GraphState
-from nodes.supervisor_agent import supervisor_agent_node
-from nodes.reflect_and_score import reflect_and_score_node
+from nodes.supervisor_agent import supervisor_agent_node, make_agent_node, dispatch_agents, AGENT_MAP
+from nodes.reflect_and_score import reflect_and_score_node, route_after_reflection, FALLBACK_AGENT
 from nodes.analyzer_agent import analyzer_agent_node
 
 
 def create_workflow():
+    """
+    supervisor ─┬─► price_agent ──────────┐
+                ├─► product_info_agent ───┤
+                ├─► review_agent ─────────┼─► reflect_and_score ─┬─► analyzer ──► END
+                └─► rating_agent ─────────┘          ▲           │
+                                                     └─ rating_agent (fallback, score < 7)
+    Only the planned agents are dispatched; their outputs merge via GraphState reducers.
+    """
     workflow = StateGraph(GraphState)
 
     workflow.add_node("supervisor", supervisor_agent_node)
+    for agent_name in AGENT_MAP:
+        workflow.add_node(agent_name, make_agent_node(agent_name))
     workflow.add_node("reflect_and_score", reflect_and_score_node)
     workflow.add_node("analyzer", analyzer_agent_node)
 
     workflow.set_entry_point("supervisor")
-    workflow.add_edge("supervisor", "reflect_and_score")
-    workflow.add_edge("reflect_and_score", "analyzer")
+    workflow.add_conditional_edges(
+        "supervisor", dispatch_agents, [*AGENT_MAP, "reflect_and_score", "analyzer"]
+    )
+    for agent_name in AGENT_MAP:
+        workflow.add_edge(agent_name, "reflect_and_score")
+    workflow.add_conditional_edges(
+        "reflect_and_score", route_after_reflection, [FALLBACK_AGENT, "analyzer"]
+    )
     workflow.add_edge("analyzer", END)
 
     return workflow.compile()
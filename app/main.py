@@ -1,6 +1,7 @@
 import os
 import sys
-import logging
+import asyncio
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,35 +12,10 @@ if hasattr(sys.stdout, 'reconfigure'):
 if hasattr(sys.stderr, 'reconfigure'):
     sys.stderr.reconfigure(encoding='utf-8', errors='replace')
 
-from app.core.request_context import request_id_var
+# JSON log lines with request_id, written by a background thread (see app/core/log_pipeline.py)
+from app.core.log_pipeline import setup_logging
 
-
-class RequestIdFilter(logging.Filter):
-    """Injects request_id into every log record for traceability."""
-    def filter(self, record: logging.LogRecord) -> bool:
-        record.request_id = request_id_var.get("-")
-        return True
-
-
-import json as _json
-
-class JsonFormatter(logging.Formatter):
-    """Structured JSON logs — parseable by any log aggregator."""
-    def format(self, record: logging.LogRecord) -> str:
-        record.request_id = request_id_var.get("-")
-        return _json.dumps({
-            "time":       self.formatTime(record),
-            "level":      record.levelname,
-            "request_id": record.request_id,
-            "logger":     record.name,
-            "message":    record.getMessage(),
-        }, ensure_ascii=False)
-
-handler = logging.StreamHandler()
-handler.setFormatter(JsonFormatter())
-handler.addFilter(RequestIdFilter())
-logging.root.setLevel(logging.INFO)
-logging.root.handlers = [handler]
+setup_logging()
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -48,14 +24,28 @@ from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
-from app.api.routes import router, limiter
+from app.api.routes import router, limiter, warm_up, shut_down, refresher
+from app.core.config import REFRESH_AHEAD
 
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:8000").split(",")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Heavy initialization (graph compile, provider SDK import) runs here, not at import time
+    await asyncio.to_thread(warm_up)
+    if REFRESH_AHEAD:
+        refresher.start()
+    yield
+    await refresher.stop()
+    await asyncio.to_thread(shut_down)
+
+
 app = FastAPI(
     title="ProductPilot API",
     description="Multi-agent product recommendation and comparison system",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.state.limiter = limiter
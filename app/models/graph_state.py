@@ -1,13 +1,38 @@
-from typing import TypedDict, List, Dict
+from typing import TypedDict, List, Dict, Annotated
+
+
+def merge_by_product(left: List[Dict], right: List[Dict]) -> List[Dict]:
+    """
+    Reducer for per-product agent outputs.
+    Entries in right replace same-product entries in left; an empty update keeps left.
+    """
+    if not left:
+        return list(right or [])
+    if not right:
+        return list(left)
+    merged = {item.get("product"): item for item in left}
+    for item in right:
+        merged[item.get("product")] = item
+    return list(merged.values())
+
+
+def merge_unique(left: List[str], right: List[str]) -> List[str]:
+    """Reducer for agents_executed: parallel agents append, duplicates dropped, order kept."""
+    merged = list(left or [])
+    for item in right or []:
+        if item not in merged:
+            merged.append(item)
+    return merged
+
 
 class GraphState(TypedDict):
     input: str
     intent: str
     products: List[str]
-    price_data: List[Dict]
-    review_data: List[Dict]
-    product_info: List[Dict]
-    platform_rating_data: List[Dict]
+    price_data: Annotated[List[Dict], merge_by_product]
+    review_data: Annotated[List[Dict], merge_by_product]
+    product_info: Annotated[List[Dict], merge_by_product]
+    platform_rating_data: Annotated[List[Dict], merge_by_product]
     final_recommendation: str
     current_step: str
     missing_data: List[str]
@@ -15,5 +40,55 @@ class GraphState(TypedDict):
     search_hints: Dict[str, str]       # product → reformulated query on retry
     confidence_score: int              # supervisor's 1-10 confidence before analysis
     analysis_context: str              # reflection node output fed to analyzer
+    analysis_reused: bool              # final_recommendation came from the analyzer's memo cache
     agent_plan: List[str]             # query-aware ordered list of agents to run
-    agents_executed: List[str]        # tracks which agents have completed
+    agents_executed: Annotated[List[str], merge_unique]  # written concurrently by agent nodes
+    data_cut: Annotated[List[str], merge_unique]         # stages skipped or abandoned at the deadline
+    pending_fetch: Dict[str, List[str]]  # agent → products not served by the product store
+
+
+class StateUpdate(TypedDict, total=False):
+    """
+    Partial GraphState returned by nodes and agents — only the keys they changed.
+    LangGraph applies it through the reducers above; nothing copies the full state.
+    """
+    intent: str
+    products: List[str]
+    price_data: List[Dict]
+    review_data: List[Dict]
+    product_info: List[Dict]
+    platform_rating_data: List[Dict]
+    final_recommendation: str
+    current_step: str
+    collection_complete: bool
+    confidence_score: int
+    analysis_context: str
+    analysis_reused: bool
+    agent_plan: List[str]
+    agents_executed: List[str]
+    data_cut: List[str]
+    pending_fetch: Dict[str, List[str]]
+
+
+def initial_state(user_input: str) -> GraphState:
+    """Empty graph input for one query."""
+    return GraphState(
+        input=user_input,
+        intent="",
+        products=[],
+        price_data=[],
+        review_data=[],
+        product_info=[],
+        platform_rating_data=[],
+        final_recommendation="",
+        current_step="",
+        missing_data=[],
+        collection_complete=False,
+        search_hints={},
+        confidence_score=0,
+        analysis_context="",
+        analysis_reused=False,
+        agent_plan=[],
+        agents_executed=[],
+        data_cut=[]
+    )
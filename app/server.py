@@ -0,0 +1,205 @@
+"""
+Production entry point: a prefork master with copy-on-write warm state.
+
+The master imports the app and runs the startup warm-up once (compiled graph,
+provider SDK, compiled guardrail patterns, product index and caches as loaded at
+startup). It then moves every object it created into the GC's permanent generation
+(gc.freeze, so collections in the workers do not write to those pages), binds the
+listening socket and forks SERVER_WORKERS uvicorn workers that share it. Workers start with everything already
+loaded and share those pages with the master until they write to them. State that
+must not cross a fork (log writer thread, HTTP connection pool, SQLite connection)
+is recreated in each worker.
+
+The master restarts workers that die, forwards SIGTERM/SIGINT for a graceful
+shutdown, and logs a memory report (per-worker RSS, PSS and shared kB) every
+SERVER_MEMORY_REPORT_SECONDS. GET /api/metrics/memory returns the same report.
+
+Cache snapshots are saved once per process tree: each worker writes its in-memory
+caches to a part file (on shutdown, or on SIGUSR1 when POST /api/admin/cache-snapshot
+asks the master), and the master merges the parts into CACHE_SNAPSHOT_PATH.
+
+Run with: python -m app.server [--workers 4] [--host 0.0.0.0] [--port 8000]
+"""
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+
+import uvicorn
+
+from app.core.config import (
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_MEMORY_REPORT_SECONDS,
+    CACHE_SNAPSHOT_PATH, CACHE_SNAPSHOT_ON_SHUTDOWN,
+)
+from app.core.memory import mark_master, memory_report
+from app.core.log_pipeline import log_pipeline
+from app.core.snapshot import save_worker_part, merge_worker_parts, worker_part_path
+
+logger = logging.getLogger("app.server")
+
+_MIN_WORKER_LIFETIME = 5.0     # a worker dying sooner than this is restarted after a pause
+_SNAPSHOT_PART_WAIT = 10.0     # how long the master waits for workers' snapshot parts
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _serve(app, sock: socket.socket) -> None:
+    # log_config=None keeps the JSON log pipeline; lifespan re-runs warm_up, which is a no-op by now
+    config = uvicorn.Config(app, log_config=None, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _save_part(signum, frame) -> None:
+    # Worker SIGUSR1: the handler runs on the event loop thread, so the save goes to a thread
+    def save():
+        try:
+            save_worker_part()
+        except Exception as e:
+            logger.warning("Cache snapshot part failed: %s", e)
+    threading.Thread(target=save, name="snapshot-part", daemon=True).start()
+
+
+def _written_since(path: str, since: float) -> bool:
+    try:
+        return os.path.getmtime(path) >= since
+    except OSError:
+        return False
+
+
+class PreforkMaster:
+    def __init__(self, app, sock: socket.socket, workers: int):
+        self._app = app
+        self._sock = sock
+        self._workers = workers
+        self._children: dict[int, float] = {}     # pid → start time
+        self._stopping = False
+        self._snapshot_requested = 0.0
+
+    def _spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGUSR1, _save_part)
+            code = 0
+            try:
+                _serve(self._app, self._sock)
+            except BaseException:
+                logger.exception("Worker %d crashed", os.getpid())
+                code = 1
+            finally:
+                log_pipeline.stop()
+                os._exit(code)
+        self._children[pid] = time.monotonic()
+        logger.info("Worker %d started", pid)
+
+    def _stop(self, signum, frame) -> None:
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _request_snapshot(self, signum, frame) -> None:
+        self._snapshot_requested = time.time()
+
+    def _collect_snapshot(self) -> None:
+        """Asks every worker for its snapshot part, waits for them, then merges."""
+        requested, self._snapshot_requested = self._snapshot_requested, 0.0
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGUSR1)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + _SNAPSHOT_PART_WAIT
+        pending = set(self._children)
+        while pending and time.monotonic() < deadline:
+            time.sleep(0.1)
+            pending = {pid for pid in pending
+                       if not _written_since(worker_part_path(CACHE_SNAPSHOT_PATH, pid), requested)}
+        if pending:
+            logger.warning("No snapshot part from workers %s; merging the rest", sorted(pending))
+        self._merge_snapshot()
+
+    def _merge_snapshot(self) -> None:
+        try:
+            merge_worker_parts()
+        except Exception as e:
+            logger.warning("Cache snapshot merge failed: %s", e)
+
+    def _reap(self) -> None:
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._children.clear()
+                return
+            if pid == 0:
+                return
+            started = self._children.pop(pid, None)
+            if started is None or self._stopping:
+                continue
+            logger.warning("Worker %d exited (status %d); restarting", pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < _MIN_WORKER_LIFETIME:
+                time.sleep(1)
+            self._spawn()
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGUSR1, self._request_snapshot)
+        for _ in range(self._workers):
+            self._spawn()
+        next_report = time.monotonic() + min(30.0, SERVER_MEMORY_REPORT_SECONDS)
+        while self._children:
+            self._reap()
+            if not self._stopping and time.monotonic() >= next_report:
+                report = memory_report()
+                logger.info("Memory: %d workers, RSS %d kB total, PSS %d kB total, %d kB saved by sharing",
+                            len(report["workers"]), report["total_rss_kb"], report["total_pss_kb"],
+                            report["shared_savings_kb"])
+                next_report = time.monotonic() + SERVER_MEMORY_REPORT_SECONDS
+            if self._snapshot_requested and not self._stopping:
+                self._collect_snapshot()
+            time.sleep(0.5)
+        logger.info("All workers stopped")
+        if CACHE_SNAPSHOT_ON_SHUTDOWN:
+            # Workers wrote their parts during their own shutdown
+            self._merge_snapshot()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prefork production server for the ProductPilot API.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    args = parser.parse_args()
+    if not hasattr(os, "fork"):
+        sys.exit("Prefork mode needs os.fork; on this platform run uvicorn app.main:app instead.")
+
+    from app.main import app
+    from app.api.routes import warm_up
+    timings = warm_up()
+    logger.info("Master %d warmed up %s; forking %d workers", os.getpid(), timings, args.workers)
+
+    gc.collect()
+    gc.freeze()
+    mark_master()
+    PreforkMaster(app, _bind(args.host, args.port), args.workers).run()
+
+
+if __name__ == "__main__":
+    main()
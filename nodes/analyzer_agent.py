@@ -1,16 +1,94 @@
 import json
+import asyncio
+import hashlib
 import logging
-from app.core.llm_utils import invoke_with_retry, get_llm
+from app.core.llm_utils import ainvoke_with_retry, get_llm
+from app.models.graph_state import StateUpdate
+from app.core.logger import span, note_cache
+from app.core.config import ANALYZER_FULL_CONTEXT_PRODUCTS, ANALYZER_MAX_CONTEXT_CHARS, ANALYSIS_CACHE
+from app.core.product_index import canonical_product_id
+from app.core.response_cache import analysis_cache
+from app.core.semantic_cache import question_class
 
 logger = logging.getLogger(__name__)
 
+_SNIPPET_CHARS = 220
 
-def analyzer_agent_node(state: dict) -> dict:
+
+def _by_product(entries: list) -> dict:
+    return {e.get("product"): e for e in entries or [] if isinstance(e, dict)}
+
+
+def summarize_product_data(products: list, price_data: list, review_data: list,
+                           product_info: list, platform_rating_data: list) -> list:
+    """
+    One compact, still fully grounded record per product, used instead of raw agent
+    output when many products are compared. Keeps the price range and cheapest offer,
+    the top spec snippets, the review pros/cons and the rating summary.
+    """
+    prices, reviews = _by_product(price_data), _by_product(review_data)
+    info, ratings = _by_product(product_info), _by_product(platform_rating_data)
+
+    summaries = []
+    for product in products:
+        summary = {"product": product}
+        if product in prices:
+            entry = prices[product]
+            offers = entry.get("prices", [])
+            summary["price"] = {
+                "range": entry.get("price_range"),
+                "offers": len(offers),
+                "first_offer": {k: offers[0].get(k) for k in ("store", "price")} if offers else None,
+            }
+        if product in info:
+            summary["specs"] = [s.get("snippet", "")[:_SNIPPET_CHARS] for s in info[product].get("info", [])[:2]]
+        if product in reviews:
+            r = reviews[product].get("reviews", {})
+            summary["reviews"] = {
+                "sentiment": r.get("review_sentiment"),
+                "positive": r.get("positive_reviews", [])[:2],
+                "negative": r.get("negative_reviews", [])[:2],
+            }
+        if product in ratings:
+            entry = ratings[product]
+            summary["rating"] = {"average": entry.get("average_rating"),
+                                 "platforms": len(entry.get("ratings", []))}
+        summaries.append(summary)
+    return summaries
+
+
+_DATA_KEYS = ("price_data", "review_data", "product_info", "platform_rating_data")
+
+
+def analysis_key(state: dict) -> str:
+    """
+    Memo key for the analysis: the grounding data with products canonicalized and
+    sorted, plus the question class. Rewordings of one question over the same data share it.
+    """
+    data = {}
+    for key in _DATA_KEYS:
+        entries = [{**e, "product": canonical_product_id(e.get("product") or "")}
+                   for e in state.get(key) or [] if isinstance(e, dict)]
+        data[key] = sorted(entries, key=lambda e: e["product"])
+    normalized = {
+        "question": question_class(state.get("input", ""), state.get("intent", "")),
+        "products": sorted(canonical_product_id(p) for p in state.get("products") or []),
+        "data": data,
+    }
+    digest = hashlib.sha256(json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    return f"analysis:{digest}"
+
+
+async def analyzer_agent_node(state: dict) -> StateUpdate:
     """
     Combines output from all agents and creates a STRICTLY GROUNDED product analysis.
     The LLM MUST rely only on retrieved SerpAPI data.
     """
+    with span("analyzer", products=len(state.get("products") or [])):
+        return await _analyze(state)
 
+
+async def _analyze(state: dict) -> StateUpdate:
     try:
         llm = get_llm(thinking_budget=256)
 
@@ -26,7 +104,6 @@ def analyzer_agent_node(state: dict) -> dict:
 
         if not products:
             return {
-                **state,
                 "final_recommendation":
                     "I couldn't identify specific products from your query. "
                     "Please mention product names clearly.",
@@ -45,9 +122,28 @@ def analyzer_agent_node(state: dict) -> dict:
             "product_info": product_info,
             "platform_ratings": platform_rating_data
         }
+        # Data abandoned at the request deadline — lets the LLM say it is missing
+        # rather than treating the gap as "no data exists"
+        if state.get("data_cut"):
+            structured_context["not_collected_due_to_time_limit"] = state["data_cut"]
 
         context_text = json.dumps(structured_context, indent=2, ensure_ascii=False)
 
+        # Raw concatenation grows with every product — summarize past the limits
+        if len(products) > ANALYZER_FULL_CONTEXT_PRODUCTS or len(context_text) > ANALYZER_MAX_CONTEXT_CHARS:
+            summarized = {
+                "user_query": user_input,
+                "products": products,
+                "product_summaries": summarize_product_data(
+                    products, price_data, review_data, product_info, platform_rating_data),
+            }
+            if "not_collected_due_to_time_limit" in structured_context:
+                summarized["not_collected_due_to_time_limit"] = structured_context["not_collected_due_to_time_limit"]
+            raw_chars = len(context_text)
+            context_text = json.dumps(summarized, separators=(",", ":"), ensure_ascii=False)
+            logger.info("Analyzer context summarized for %d products: %d → %d chars",
+                        len(products), raw_chars, len(context_text))
+
         # -----------------------------
         # STRICT ANTI-HALLUCINATION PROMPT
         # -----------------------------
@@ -95,20 +191,38 @@ OUTPUT STYLE
 
         logger.debug("Context sent to LLM (first 1500 chars): %s", context_text[:1500])
 
+        # -----------------------------
+        # Memoized analysis of the same data and question
+        # (answers over partially collected data are never stored)
+        # -----------------------------
+        memo_key = analysis_key(state) if ANALYSIS_CACHE and not state.get("data_cut") else None
+        if memo_key:
+            cached = await asyncio.to_thread(analysis_cache.get, memo_key)
+            note_cache("analysis", cached is not None)
+            if cached is not None:
+                logger.info("Analysis reused for %d products", len(products))
+                return {
+                    "final_recommendation": cached["text"],
+                    "analysis_reused": True,
+                    "current_step": "Analysis complete (reused)"
+                }
+
         # -----------------------------
         # LLM Call
         # -----------------------------
-        final_recommendation = invoke_with_retry(llm, prompt, context="analyzer")
+        with span("analyzer.llm", prompt_chars=len(prompt)):
+            final_recommendation = await ainvoke_with_retry(llm, prompt, context="analyzer")
 
+        if memo_key and final_recommendation:
+            await asyncio.to_thread(analysis_cache.set, memo_key, {"text": final_recommendation})
         return {
-            **state,
             "final_recommendation": final_recommendation,
+            "analysis_reused": False,
             "current_step": "Analysis complete"
         }
 
     except Exception as e:
         return {
-            **state,
             "final_recommendation":
                 f"I encountered an error while analyzing products: {str(e)}",
             "current_step": f"Analysis failed: {str(e)}"
@@ -1,15 +1,20 @@
 import os
 import re
 import logging
+from typing import Mapping
 
 from app.core.http_client import cached_get
+from app.core.product_index import search_name
+from app.core.fanout import collect_per_product
+from app.core.config import SERP_RESULTS_PER_PRODUCT
+from app.models.graph_state import StateUpdate
 
 logger = logging.getLogger(__name__)
 
 SERP_URL = "https://serpapi.com/search"
 
 
-def fetch_price_results(query: str, max_results: int = 3) -> list:
+def fetch_price_results(query: str, max_results: int = SERP_RESULTS_PER_PRODUCT) -> list:
     SERP_API_KEY = os.getenv("SERP_API_KEY")
     if not SERP_API_KEY:
         logger.error("SERP_API_KEY not set")
@@ -69,27 +74,29 @@ def estimate_price_quality(price_list: list) -> tuple:
     return confidence, {"min_price": min(numeric_prices), "max_price": max(numeric_prices)}
 
 
-def price_agent_node(state: dict) -> dict:
+def _collect_price(product: str, hints: Mapping) -> dict:
+    search_query = hints.get(product) or search_name(product)
+    logger.info("Fetching prices for: %s", search_query)
+    prices = fetch_price_results(search_query)
+    confidence, price_range = estimate_price_quality(prices)
+    return {
+        "product": product,
+        "prices": prices,
+        "price_confidence": confidence,
+        "price_range": price_range,
+    }
+
+
+def price_agent_node(state: Mapping) -> StateUpdate:
     product_names = state.get("products", [])
 
     if not product_names:
         logger.warning("No products provided for price collection")
-        return {**state, "price_data": [], "price_available": False,
-                "current_step": "No products for price collection"}
+        return {"price_data": []}
 
     try:
-        all_prices = []
-        for product in product_names[:3]:
-            search_query = state.get("search_hints", {}).get(product, product)
-            logger.info("Fetching prices for: %s", search_query)
-            prices = fetch_price_results(search_query)
-            confidence, price_range = estimate_price_quality(prices)
-            all_prices.append({
-                "product": product,
-                "prices": prices,
-                "price_confidence": confidence,
-                "price_range": price_range,
-            })
+        hints = state.get("search_hints", {})
+        all_prices = collect_per_product(product_names, lambda p: _collect_price(p, hints), "price_data")
 
         overall_confidence = (
             "high" if any(p["price_confidence"] == "high" for p in all_prices)
@@ -97,11 +104,8 @@ def price_agent_node(state: dict) -> dict:
             else "low"
         )
         logger.info("Price data collected (%s confidence)", overall_confidence)
-        return {**state, "price_data": all_prices, "price_available": True,
-                "price_confidence": overall_confidence,
-                "current_step": f"Price data collected ({overall_confidence})"}
+        return {"price_data": all_prices}
 
     except Exception as e:
         logger.error("Price collection failed: %s", e)
-        return {**state, "price_data": [], "price_available": False,
-                "current_step": f"Price collection failed: {e}"}
+        return {"price_data": []}
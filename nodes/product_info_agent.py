@@ -1,14 +1,19 @@
 import os
 import logging
+from typing import Mapping
 
 from app.core.http_client import cached_get
+from app.core.product_index import search_name
+from app.core.fanout import collect_per_product
+from app.core.config import SERP_RESULTS_PER_PRODUCT
+from app.models.graph_state import StateUpdate
 
 logger = logging.getLogger(__name__)
 
 SERP_URL = "https://serpapi.com/search"
 
 
-def fetch_product_info_snippets(query: str, max_results: int = 3) -> list:
+def fetch_product_info_snippets(query: str, max_results: int = SERP_RESULTS_PER_PRODUCT) -> list:
     SERP_API_KEY = os.getenv("SERP_API_KEY")
     if not SERP_API_KEY:
         logger.error("SERP_API_KEY not set")
@@ -55,22 +60,23 @@ def estimate_info_quality(snippets: list) -> str:
     return "low"
 
 
-def product_info_agent_node(state: dict) -> dict:
+def _collect_info(product: str, hints: Mapping) -> dict:
+    search_query = hints.get(product) or search_name(product)
+    logger.info("Fetching product info for: %s", search_query)
+    snippets = fetch_product_info_snippets(search_query)
+    return {"product": product, "info": snippets, "info_quality": estimate_info_quality(snippets)}
+
+
+def product_info_agent_node(state: Mapping) -> StateUpdate:
     product_names = state.get("products", [])
 
     if not product_names:
         logger.warning("No products provided for info collection")
-        return {**state, "product_info": [], "info_available": False,
-                "info_quality": "low", "current_step": "No products for info collection"}
+        return {"product_info": []}
 
     try:
-        all_info = []
-        for product in product_names[:3]:
-            search_query = state.get("search_hints", {}).get(product, product)
-            logger.info("Fetching product info for: %s", search_query)
-            snippets = fetch_product_info_snippets(search_query)
-            quality = estimate_info_quality(snippets)
-            all_info.append({"product": product, "info": snippets, "info_quality": quality})
+        hints = state.get("search_hints", {})
+        all_info = collect_per_product(product_names, lambda p: _collect_info(p, hints), "product_info")
 
         overall_quality = (
             "high" if any(p["info_quality"] == "high" for p in all_info)
@@ -78,11 +84,8 @@ def product_info_agent_node(state: dict) -> dict:
             else "low"
         )
         logger.info("Product info collected (%s quality)", overall_quality)
-        return {**state, "product_info": all_info, "info_available": True,
-                "info_quality": overall_quality,
-                "current_step": f"Product info collected ({overall_quality})"}
+        return {"product_info": all_info}
 
     except Exception as e:
         logger.error("Product info collection failed: %s", e)
-        return {**state, "product_info": [], "info_available": False,
-                "info_quality": "low", "current_step": f"Product info collection failed: {e}"}
+        return {"product_info": []}
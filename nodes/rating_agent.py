@@ -1,14 +1,19 @@
 import os
 import logging
+from typing import Mapping
 
 from app.core.http_client import cached_get
+from app.core.product_index import search_name
+from app.core.fanout import collect_per_product
+from app.core.config import SERP_RESULTS_PER_PRODUCT
+from app.models.graph_state import StateUpdate
 
 logger = logging.getLogger(__name__)
 
 SERP_URL = "https://serpapi.com/search"
 
 
-def fetch_platform_ratings(query: str, max_results: int = 3) -> list:
+def fetch_platform_ratings(query: str, max_results: int = SERP_RESULTS_PER_PRODUCT) -> list:
     SERP_API_KEY = os.getenv("SERP_API_KEY")
     if not SERP_API_KEY:
         logger.error("SERP_API_KEY not set")
@@ -62,27 +67,31 @@ def estimate_rating_quality(ratings: list) -> tuple:
     return confidence, avg
 
 
-def rating_platform_agent_node(state: dict) -> dict:
+def _collect_rating(product: str, hints: Mapping) -> dict:
+    search_query = hints.get(product) or search_name(product)
+    logger.info("Fetching ratings for: %s", search_query)
+    ratings = fetch_platform_ratings(search_query)
+    confidence, avg_rating = estimate_rating_quality(ratings)
+    return {
+        "product": product,
+        "ratings": ratings,
+        "rating_confidence": confidence,
+        "average_rating": avg_rating,
+    }
+
+
+def rating_platform_agent_node(state: Mapping) -> StateUpdate:
     product_names = state.get("products", [])
 
     if not product_names:
         logger.warning("No products provided for rating collection")
-        return {**state, "platform_rating_data": [], "rating_available": False,
-                "current_step": "No products for rating collection"}
+        return {"platform_rating_data": []}
 
     try:
-        platform_ratings = []
-        for product in product_names[:3]:
-            search_query = state.get("search_hints", {}).get(product, product)
-            logger.info("Fetching ratings for: %s", search_query)
-            ratings = fetch_platform_ratings(search_query)
-            confidence, avg_rating = estimate_rating_quality(ratings)
-            platform_ratings.append({
-                "product": product,
-                "ratings": ratings,
-                "rating_confidence": confidence,
-                "average_rating": avg_rating,
-            })
+        hints = state.get("search_hints", {})
+        platform_ratings = collect_per_product(
+            product_names, lambda p: _collect_rating(p, hints), "platform_rating_data"
+        )
 
         overall_confidence = (
             "high" if any(p["rating_confidence"] == "high" for p in platform_ratings)
@@ -90,11 +99,8 @@ def rating_platform_agent_node(state: dict) -> dict:
             else "low"
         )
         logger.info("Rating data collected (%s confidence)", overall_confidence)
-        return {**state, "platform_rating_data": platform_ratings, "rating_available": True,
-                "rating_confidence": overall_confidence,
-                "current_step": f"Rating data collected ({overall_confidence})"}
+        return {"platform_rating_data": platform_ratings}
 
     except Exception as e:
         logger.error("Rating collection failed: %s", e)
-        return {**state, "platform_rating_data": [], "rating_available": False,
-                "current_step": f"Rating collection failed: {e}"}
+        return {"platform_rating_data": []}
@@ -1,19 +1,23 @@
 import logging
 import json
 import requests
-from typing import Dict, Any
-from app.core.config import SERPAPI_KEY
+from typing import Mapping
+from app.core.config import SERPAPI_KEY, RECOMMENDATION_COUNT
 from app.core.llm_utils import invoke_with_retry, get_llm
+from app.models.graph_state import StateUpdate
+from app.core.product_index import canonical_product_id, search_name
+from app.core.llm_cache import llm_cache, normalized_query
 
 logger = logging.getLogger(__name__)
 
-def recommendation_agent_node(state: Dict[str, Any]) -> Dict[str, Any]:
+def recommendation_agent_node(state: Mapping) -> StateUpdate:
     """
     Enhanced recommendation agent that generates product suggestions based on user requirements
-    and ALWAYS returns at least 2-3 products
+    and ALWAYS returns at least 2-3 products. Returns only products + current_step.
     """
     
     user_input = state.get("input", "")
+    count = max(2, RECOMMENDATION_COUNT)
     
     # Try to get products from SERP API first
     try:
@@ -34,37 +38,45 @@ def recommendation_agent_node(state: Dict[str, Any]) -> Dict[str, Any]:
                 
                 # Extract product names from shopping results
                 if "shopping_results" in data:
-                    for item in data["shopping_results"][:3]:
+                    # Over-fetch: several listings usually collapse into one product below
+                    for item in data["shopping_results"][:count * 3]:
                         products.append(item.get("title", ""))
                 
                 # If not enough products, try organic results
                 if len(products) < 2 and "organic_results" in data:
-                    for item in data["organic_results"][:5]:
+                    for item in data["organic_results"][:max(5, count * 2)]:
                         title = item.get("title", "")
                         if title and title not in products:
                             products.append(title)
-                            if len(products) >= 3:
+                            if len(products) >= count:
                                 break
                 
-                # Clean and filter products
-                products = [p.strip() for p in products if p.strip()][:3]
+                # Listing titles → clean canonical names; several listings of one product collapse
+                products = _dedupe_products(p for p in products if p.strip())[:count]
                 
                 if len(products) >= 2:
                     logger.info("SERP API found %d products: %s", len(products), products)
-                    state["products"] = products
-                    state["current_step"] = f"Recommendations generated: {len(products)} products"
-                    return state
+                    return {"products": products,
+                            "current_step": f"Recommendations generated: {len(products)} products"}
     except Exception as e:
         logger.warning("SERP API error: %s", str(e))
     
+    # Product lists the LLM already suggested for this query wording
+    cache_key = llm_cache.key(normalized_query(user_input), count)
+    cached = llm_cache.get("recommendation", cache_key)
+    if cached is not None:
+        logger.info("Recommendation cache hit: %s", cached)
+        return {"products": cached,
+                "current_step": f"Recommendations generated: {len(cached)} products (cached)"}
+
     llm = get_llm(temperature=0.3)
     
-    prompt = f"""You are a product recommendation expert. Based on the user's query, suggest 2-3 specific product names/models.
+    prompt = f"""You are a product recommendation expert. Based on the user's query, suggest 2-{count} specific product names/models.
 
 CRITICAL RULES:
 1. Return REAL, SPECIFIC product names (not generic categories)
 2. Include brand names and model numbers where applicable
-3. Return AT LEAST 2 products, ideally 3
+3. Return AT LEAST 2 products, ideally {count}
 4. Format as a JSON array of strings
 5. Be realistic about current products available in the market
 
@@ -80,7 +92,7 @@ Examples of BAD responses:
 - ["iPhone"]  ❌ Not specific enough, needs model
 - ["laptop"]  ❌ Not a real product
 
-Now generate 2-3 specific product recommendations for the query above.
+Now generate 2-{count} specific product recommendations for the query above.
 Respond with ONLY a JSON array of product names, nothing else.
 Format: ["Product 1", "Product 2", "Product 3"]"""
 
@@ -92,8 +104,10 @@ Format: ["Product 1", "Product 2", "Product 3"]"""
             products = json.loads(content)
             if isinstance(products, list) and len(products) > 0:
                 # Clean product names
-                products = [str(p).strip() for p in products if p]
+                products = _dedupe_products(str(p).strip() for p in products if p)[:count]
                 logger.info("Recommendation agent generated %d products: %s", len(products), products)
+                if len(products) >= 2:
+                    llm_cache.set("recommendation", cache_key, products)
             else:
                 raise ValueError("Empty or invalid product list")
         except Exception:
@@ -105,11 +119,11 @@ Format: ["Product 1", "Product 2", "Product 3"]"""
             # Look for quoted strings or list items
             quoted_items = re.findall(r'["\']([^"\']+)["\']', content)
             if quoted_items:
-                products = quoted_items[:3]  # Take up to 3 items
+                products = quoted_items[:count]
             else:
                 # Split by common delimiters
                 lines = [line.strip() for line in content.split('\n') if line.strip()]
-                products = [re.sub(r'^[-*•]\s*', '', line) for line in lines if line][:3]
+                products = [re.sub(r'^[-*•]\s*', '', line) for line in lines if line][:count]
             
             if not products:
                 # Ultimate fallback based on query keywords
@@ -120,21 +134,28 @@ Format: ["Product 1", "Product 2", "Product 3"]"""
         if len(products) < 2:
             logger.warning("Only %d product(s) found, adding fallbacks", len(products))
             products.extend(generate_fallback_products(user_input, exclude=products))
-            products = products[:3]  # Limit to 3
-        
-        # Update state
-        state["products"] = products
-        state["current_step"] = f"Recommendations generated: {len(products)} products"
+            products = products[:count]
         
         logger.info("Final products: %s", products)
+        return {"products": products,
+                "current_step": f"Recommendations generated: {len(products)} products"}
         
     except Exception as e:
         logger.error("Error in recommendation agent: %s", str(e))
         # Generate fallback products based on query
-        state["products"] = generate_fallback_products(user_input)
-        state["current_step"] = f"Recommendation error (using fallbacks): {str(e)}"
-    
-    return state
+        return {"products": generate_fallback_products(user_input),
+                "current_step": f"Recommendation error (using fallbacks): {str(e)}"}
+
+
+def _dedupe_products(names) -> list:
+    """Maps raw names to their canonical spelling, keeping the first of each product."""
+    seen, products = set(), []
+    for name in names:
+        canonical = canonical_product_id(name)
+        if canonical and canonical not in seen:
+            seen.add(canonical)
+            products.append(search_name(name))
+    return products
 
 
 def generate_fallback_products(query: str, exclude: list = None) -> list:
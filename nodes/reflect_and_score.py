@@ -1,11 +1,19 @@
+import json
 import logging
-from langchain_core.messages import HumanMessage
-from app.core.llm_utils import invoke_with_retry, get_llm
+from app.core.llm_utils import ainvoke_with_retry, get_llm
+from app.core.request_context import budget_short
+from app.core.logger import span
+from app.models.graph_state import StateUpdate
+from app.core.config import ANALYZER_RESERVE_SECONDS, REFLECT_RESERVE_SECONDS, RETRY_RESERVE_SECONDS
 
 logger = logging.getLogger(__name__)
 
 
-def _run(state: dict) -> tuple[int, str]:
+FALLBACK_AGENT = "rating_agent"
+FALLBACK_THRESHOLD = 7
+
+
+async def _run(state: dict) -> tuple[int, str]:
     """One LLM call: returns (score 1-10, reflection summary)."""
     data_summary = {
         "specs":    "available" if state.get("product_info")         else "missing",
@@ -37,9 +45,8 @@ Score guide:
 5-7  = borderline, some gaps
 1-4  = major gaps, recommendation will be weak"""
 
-    import json
     try:
-        content = invoke_with_retry(get_llm(thinking_budget=512), [HumanMessage(content=prompt)], context="reflect_and_score").strip()
+        content = (await ainvoke_with_retry(get_llm(thinking_budget=512), prompt, context="reflect_and_score")).strip()
         start, end = content.find("{"), content.rfind("}") + 1
         if start >= 0 and end > start:
             parsed = json.loads(content[start:end])
@@ -53,36 +60,55 @@ Score guide:
     return 5, "Reflection unavailable — proceeding with available data."
 
 
-def reflect_and_score_node(state: dict) -> dict:
+async def reflect_and_score_node(state: dict) -> StateUpdate:
     """
-    Replaces two sequential LLM calls (confidence check + reflection) with one.
+    Join point after the agent fan-out. Replaces two sequential LLM calls
+    (confidence check + reflection) with one.
 
     1. One LLM call → confidence score (1-10) + reflection summary
-    2. If score < 7 and rating_agent not yet run → add it as fallback, re-score
+    2. route_after_reflection sends low scores through rating_agent once, which
+       loops back here for a re-score
     3. Passes analysis_context to analyzer
+
+    Near the request deadline the LLM call and the fallback are skipped and
+    recorded in data_cut, leaving the remaining time to the analyzer.
     """
-    from nodes.supervisor_agent import run_agent_with_reflection, AGENT_OUTPUT_KEYS
+    if budget_short(REFLECT_RESERVE_SECONDS + ANALYZER_RESERVE_SECONDS):
+        logger.info("reflect_and_score skipped — deadline is close")
+        return {
+            "collection_complete": True,
+            "confidence_score": 5,
+            "analysis_context": "Reflection skipped to meet the response deadline.",
+            "data_cut": ["reflection"],
+            "current_step": "Reflect+score skipped (deadline)",
+        }
 
-    score, reflection = _run(state)
+    with span("reflect_and_score"):
+        score, reflection = await _run(state)
     logger.info("reflect_and_score: score=%d/10", score)
 
-    # Fallback: add rating_agent if confidence low and it wasn't already run
-    agents_executed = list(state.get("agents_executed", []))
-    if score < 7 and "rating_agent" not in agents_executed:
-        logger.info("Score %d/10 — adding rating_agent as fallback", score)
-        fallback = run_agent_with_reflection(dict(state), "rating_agent")
-        state = {
-            **state,
-            AGENT_OUTPUT_KEYS["rating_agent"]: fallback.get(AGENT_OUTPUT_KEYS["rating_agent"], []),
-        }
-        agents_executed.append("rating_agent")
-        score, reflection = _run(state)
-        logger.info("reflect_and_score after fallback: score=%d/10", score)
-
-    return {
-        **state,
-        "agents_executed": agents_executed,
+    update = {
+        "collection_complete": True,
         "confidence_score": score,
         "analysis_context": reflection,
         "current_step": f"Reflect+score complete — {score}/10",
     }
+    if _needs_fallback(state, score) and budget_short(
+            RETRY_RESERVE_SECONDS + REFLECT_RESERVE_SECONDS + ANALYZER_RESERVE_SECONDS):
+        logger.info("Score %d/10 — skipping %s fallback, deadline is close", score, FALLBACK_AGENT)
+        update["data_cut"] = [FALLBACK_AGENT]
+    return update
+
+
+def _needs_fallback(state: dict, score: int) -> bool:
+    return (score < FALLBACK_THRESHOLD
+            and FALLBACK_AGENT not in state.get("agents_executed", [])
+            and FALLBACK_AGENT not in state.get("data_cut", []))
+
+
+def route_after_reflection(state: dict) -> str:
+    """Fallback: run rating_agent if confidence is low and it wasn't already run (or cut)."""
+    if _needs_fallback(state, state.get("confidence_score", 0)):
+        logger.info("Score %d/10 — adding %s as fallback", state.get("confidence_score", 0), FALLBACK_AGENT)
+        return FALLBACK_AGENT
+    return "analyzer"
@@ -1,8 +1,11 @@
 import os
 import logging
-from langchain_google_genai import ChatGoogleGenerativeAI
+from typing import Mapping
 
 from app.core.http_client import cached_get
+from app.core.product_index import search_name
+from app.core.fanout import collect_per_product
+from app.models.graph_state import StateUpdate
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +16,7 @@ _llm = None
 def get_llm():
     global _llm
     if _llm is None:
+        from langchain_google_genai import ChatGoogleGenerativeAI   # SDK loaded on first use only
         _llm = ChatGoogleGenerativeAI(
             model="gemini-2.5-flash",
             temperature=0.1,
@@ -108,29 +112,30 @@ NEGATIVE:
                 "review_sentiment": "unknown", "review_confidence": "low"}
 
 
-def review_rating_agent_node(state: dict) -> dict:
+def _collect_reviews(product: str, hints: Mapping, llm) -> dict:
+    search_query = hints.get(product) or search_name(product)
+    logger.info("Fetching reviews for: %s", search_query)
+    snippets = fetch_review_snippets(search_query)
+    return {"product": product, "reviews": classify_reviews_with_llm(snippets, llm)}
+
+
+def review_rating_agent_node(state: Mapping) -> StateUpdate:
     product_names = state.get("products", [])
 
     if not product_names:
         logger.warning("No products provided for review collection")
-        return {**state, "review_data": [], "review_available": False,
-                "current_step": "No products for review collection"}
+        return {"review_data": []}
 
     try:
         llm = get_llm()
-        review_data = []
-        for product in product_names[:3]:
-            search_query = state.get("search_hints", {}).get(product, product)
-            logger.info("Fetching reviews for: %s", search_query)
-            snippets = fetch_review_snippets(search_query)
-            classified = classify_reviews_with_llm(snippets, llm)
-            review_data.append({"product": product, "reviews": classified})
+        hints = state.get("search_hints", {})
+        review_data = collect_per_product(
+            product_names, lambda p: _collect_reviews(p, hints, llm), "review_data"
+        )
 
         logger.info("Review data collected for %d products", len(review_data))
-        return {**state, "review_data": review_data, "review_available": True,
-                "current_step": f"Review data collected for {len(review_data)} products"}
+        return {"review_data": review_data}
 
     except Exception as e:
         logger.error("Review collection failed: %s", e)
-        return {**state, "review_data": [], "review_available": False,
-                "current_step": f"Review collection failed: {e}"}
+        return {"review_data": []}
@@ -1,13 +1,26 @@
 import time
 import json
+import asyncio
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import ChainMap, Counter
+from typing import Mapping
+from threading import Lock
 
-from langchain_core.messages import HumanMessage
+from app.models.graph_state import StateUpdate
 from app.core.llm_utils import invoke_with_retry, get_llm
-
-from nodes.product_info_agent import product_info_agent_node
-from nodes.price_agent import price_agent_node
+from app.core.config import (
+    SPECULATIVE_PREFETCH, FAST_PLANNER, ANALYZER_RESERVE_SECONDS, RETRY_RESERVE_SECONDS, MAX_PRODUCTS,
+)
+from app.core.request_context import budget_short, time_remaining
+from app.core.logger import span, annotate_span
+from app.core.prefetch import SpeculativePrefetch
+from app.core.product_store import product_store, has_data
+from app.core.product_index import search_name, canonical_product_id
+from app.core.llm_cache import llm_cache, normalized_query
+from app.core.query_grammar import guess_products, select_agents, fast_plan
+
+from nodes.product_info_agent import product_info_agent_node, fetch_product_info_snippets
+from nodes.price_agent import price_agent_node, fetch_price_results
 from nodes.review_agent import review_rating_agent_node
 from nodes.rating_agent import rating_platform_agent_node
 from nodes.recommendation_agent import recommendation_agent_node
@@ -31,38 +44,98 @@ AGENT_OUTPUT_KEYS = {
 }
 
 
+# Fetches started speculatively while the planner runs: label → (fetcher, consuming agents).
+# The shopping fetch warms the cache for both price_agent and rating_agent (identical SerpAPI params).
+PREFETCH_FETCHERS = {
+    "shopping": (fetch_price_results, {"price_agent", "rating_agent"}),
+    "organic": (fetch_product_info_snippets, {"product_info_agent"}),
+}
+
+
+def _prefetch_labels(agents) -> set[str]:
+    return {label for label, (_, consumers) in PREFETCH_FETCHERS.items() if consumers & set(agents)}
+
+
+def start_speculative_prefetch(query: str) -> SpeculativePrefetch | None:
+    """
+    Guesses products and likely agents locally and starts their fetches.
+    Products the product store can already serve for those agents are skipped.
+    """
+    agents = select_agents(query)
+    labels = _prefetch_labels(agents)
+    guessed = [
+        p for p in guess_products(query)
+        if not all(product_store.has(p, AGENT_OUTPUT_KEYS[a]) for a in agents)
+    ]
+    if not guessed or not labels:
+        return None
+    fetchers = {label: PREFETCH_FETCHERS[label][0] for label in labels}
+    # Fetch with the canonical search spelling — the one agents will use for any variant
+    return SpeculativePrefetch([search_name(p) for p in guessed], fetchers).start()
+
+
 def log_message(step: str, message: str, data=None) -> None:
     logger.info("%s: %s", step, message)
     if data:
         logger.debug("  Data: %s", data)
 
 
-def has_data(data):
-    if not data:
-        return False
-    if isinstance(data, list):
-        for item in data:
-            if isinstance(item, dict):
-                if item.get("info"):
-                    return True
-                if item.get("prices"):
-                    return True
-                if item.get("ratings"):
-                    return True
-                reviews = item.get("reviews")
-                if isinstance(reviews, dict):
-                    if reviews.get("positive_reviews") or reviews.get("negative_reviews"):
-                        return True
-    return False
+# ── PLAN: fast path or single LLM call → intent + products + agents ──
+
+# Planner decision counters: "fast" / "llm" totals plus one entry per reason
+_plan_stats: Counter = Counter()
+_plan_stats_lock = Lock()
+
 
+def _record_plan_decision(path: str, reason: str) -> None:
+    with _plan_stats_lock:
+        _plan_stats[path] += 1
+        _plan_stats[f"{path}:{reason}"] += 1
+        total = _plan_stats["fast"] + _plan_stats["llm"]
+        fallback_rate = _plan_stats["llm"] / total
+    annotate_span(path=path, reason=reason)
+    log_message("PLAN_DECISION", f"path={path} reason={reason} fallback_rate={fallback_rate:.2f} total={total}")
+
+
+def planner_stats() -> dict:
+    """Snapshot of planner decisions, used by /health to tune fast-path coverage."""
+    with _plan_stats_lock:
+        stats = dict(_plan_stats)
+    total = stats.get("fast", 0) + stats.get("llm", 0)
+    return {
+        "total": total,
+        "fast": stats.get("fast", 0),
+        "llm": stats.get("llm", 0),
+        "fallback_rate": round(stats.get("llm", 0) / total, 3) if total else 0.0,
+        "reasons": {k: v for k, v in stats.items() if ":" in k},
+    }
 
-# ── PLAN: single LLM call → intent + products + agents ──
 
 def create_execution_plan(state: dict) -> dict:
     """
-    Single LLM call replacing query_parser + old planner.
     Returns intent, extracted products, and minimum agent list together.
+    Simple comparisons and recommendations are resolved by the deterministic
+    grammar in app.core.query_grammar; everything else costs one LLM call.
     """
+    if FAST_PLANNER:
+        plan, reason = fast_plan(state.get("input", ""))
+        if plan is not None:
+            _record_plan_decision("fast", reason)
+            log_message("PLAN", f"intent={plan['intent']} products={plan['products']} agents={plan['agents']} (fast path)")
+            return plan
+        _record_plan_decision("llm", reason)
+
+    return _create_execution_plan_llm(state)
+
+
+def _create_execution_plan_llm(state: dict) -> dict:
+    """Single LLM call replacing query_parser + old planner. Parsed plans are cached by query wording."""
+    cache_key = llm_cache.key(normalized_query(state.get("input", "")))
+    cached = llm_cache.get("plan", cache_key)
+    if cached is not None:
+        log_message("PLAN", f"intent={cached['intent']} products={cached['products']} agents={cached['agents']} (cached)")
+        return cached
+
     prompt = f"""You are a product research supervisor. Analyze this query and return a single JSON object.
 
 User query: "{state.get("input")}"
@@ -98,7 +171,7 @@ Examples:
 {{"intent":"recommendation","products":[],"agents":["product_info_agent","price_agent","review_agent","rating_agent"]}}"""
 
     try:
-        content = invoke_with_retry(get_llm(), [HumanMessage(content=prompt)], context="supervisor").strip()
+        content = invoke_with_retry(get_llm(), prompt, context="supervisor").strip()
         start, end = content.find("{"), content.rfind("}") + 1
         if start >= 0 and end > start:
             parsed = json.loads(content[start:end])
@@ -108,7 +181,9 @@ Examples:
             if not agents:
                 agents = list(AGENT_MAP.keys())
             log_message("PLAN", f"intent={intent} products={products} agents={agents}")
-            return {"intent": intent, "products": products, "agents": agents}
+            plan = {"intent": intent, "products": products, "agents": agents}
+            llm_cache.set("plan", cache_key, plan)
+            return plan
     except Exception as e:
         log_message("PLAN_ERROR", str(e))
 
@@ -117,7 +192,7 @@ Examples:
 
 # ── OBSERVE: rule-based reflection using agent confidence signals ──
 
-def reflect_on_quality(state: dict, agent_name: str) -> str:
+def reflect_on_quality(state: Mapping, agent_name: str) -> str:
     """No LLM call — reads confidence signals already computed by each agent."""
     if agent_name == "product_info_agent":
         for item in state.get("product_info", []):
@@ -145,9 +220,17 @@ def reflect_on_quality(state: dict, agent_name: str) -> str:
 
 # ── REFORMULATE: LLM generates better queries on poor results ──
 
-def reformulate_queries(state: dict, agent_name: str) -> dict:
-    """Single LLM call triggered only when reflect_on_quality returns 'poor'."""
+def reformulate_queries(state: Mapping, agent_name: str) -> dict:
+    """
+    Single LLM call triggered only when reflect_on_quality returns 'poor'.
+    Queries are cached per agent and canonical product, whatever the spelling asked for.
+    """
     products = state.get("products", [])
+    canonical = {p: canonical_product_id(p) for p in products}
+    cache_key = llm_cache.key(agent_name, sorted(canonical.values()))
+    cached = llm_cache.get("reformulation", cache_key)
+    if cached is not None and all(c in cached for c in canonical.values()):
+        return {p: cached[c] for p, c in canonical.items()}
 
     purpose = {
         "product_info_agent": "product specifications and features",
@@ -164,10 +247,14 @@ Respond ONLY with a JSON object mapping each product to an improved query.
 Example: {{"iPhone 15": "Apple iPhone 15 128GB price India 2024"}}"""
 
     try:
-        content = invoke_with_retry(get_llm(), [HumanMessage(content=prompt)], context="reformulate").strip()
+        content = invoke_with_retry(get_llm(), prompt, context="reformulate").strip()
         start, end = content.find("{"), content.rfind("}") + 1
         if start >= 0 and end > start:
-            return json.loads(content[start:end])
+            hints = json.loads(content[start:end])
+            by_id = {canonical_product_id(str(p)): str(q) for p, q in hints.items() if q}
+            if products and all(c in by_id for c in canonical.values()):
+                llm_cache.set("reformulation", cache_key, {c: by_id[c] for c in canonical.values()})
+            return hints
     except Exception as e:
         log_message("REFORMULATE_ERROR", str(e))
 
@@ -193,7 +280,7 @@ Review confidence: {[i.get("reviews", {}).get("review_confidence") for i in stat
 Respond ONLY with a single integer 1-10."""
 
     try:
-        digits = "".join(filter(str.isdigit, invoke_with_retry(get_llm(), [HumanMessage(content=prompt)], context="confidence").strip()))
+        digits = "".join(filter(str.isdigit, invoke_with_retry(get_llm(), prompt, context="confidence").strip()))
         score = int(digits[:2]) if digits else 5
         return min(max(score, 1), 10)
     except Exception:
@@ -202,117 +289,204 @@ Respond ONLY with a single integer 1-10."""
 
 # ── RUN AGENT WITH REFLECT + RETRY ──
 
-def run_agent_with_reflection(state: dict, agent_name: str) -> dict:
+def run_agent_with_reflection(state: Mapping, agent_name: str) -> StateUpdate:
     """
     ACT → OBSERVE → REFORMULATE + RETRY if quality is poor.
-    One retry max per agent. Safe to call from multiple threads —
-    each call receives its own state copy.
+    One retry max per agent, skipped when the request deadline is close.
+    Returns only the agent's delta. The state is never copied or mutated — reflection
+    and the retry read through ChainMap views layered over it, so concurrent calls are safe.
     """
     agent_func = AGENT_MAP[agent_name]
 
     log_message("AGENT_START", f"Running {agent_name}")
     result = agent_func(state)
-    state = {**state, **result}
     time.sleep(0.3)
 
-    quality = reflect_on_quality(state, agent_name)
+    quality = reflect_on_quality(ChainMap(result, state), agent_name)
     log_message("REFLECT", f"{agent_name} quality: {quality}")
 
-    if quality == "poor":
+    if quality == "poor" and budget_short(RETRY_RESERVE_SECONDS + ANALYZER_RESERVE_SECONDS):
+        log_message("REFORMULATE", f"Poor results for {agent_name} — skipping retry, deadline is close")
+    elif quality == "poor":
         log_message("REFORMULATE", f"Poor results — generating better queries for {agent_name}")
-        hints = reformulate_queries(state, agent_name)
-        log_message("REFORMULATE", f"New queries: {hints}")
+        with span(f"retry.{agent_name}"):
+            hints = reformulate_queries(state, agent_name)
+            log_message("REFORMULATE", f"New queries: {hints}")
 
-        state["search_hints"] = hints
-        result = agent_func(state)
-        state = {**state, **result}
-        state["search_hints"] = {}
-        time.sleep(0.3)
+            result = agent_func(ChainMap({"search_hints": hints}, state))
+            time.sleep(0.3)
 
-        log_message("REFLECT", f"{agent_name} quality after retry: {reflect_on_quality(state, agent_name)}")
+        log_message("REFLECT", f"{agent_name} quality after retry: {reflect_on_quality(ChainMap(result, state), agent_name)}")
 
-    return state
+    return result
 
 
-# ── SUPERVISOR NODE ──
+# ── AGENT NODES: one graph node per data agent ──
 
-def supervisor_agent_node(state: dict) -> dict:
+def make_agent_node(agent_name: str):
     """
-    Agentic supervisor — now the single entry point replacing query_parser.
-
-    Phase 1 — PLAN (one LLM call):
-        Detects intent, extracts products, and selects minimum agents.
-        For recommendation queries, calls recommendation_agent to generate products first.
+    Builds the async graph node for one data agent.
+    The blocking ACT → OBSERVE → RETRY cycle runs in a worker thread; the node
+    returns only the agent's output key, merged by the GraphState reducers.
+    The agent gets the request's remaining budget minus the analyzer's reserve; if it
+    overruns, its data is reported in data_cut and the graph moves on without it.
+    """
+    output_key = AGENT_OUTPUT_KEYS[agent_name]
+
+    async def agent_node(state: dict) -> StateUpdate:
+        remaining = time_remaining()
+        budget = None if remaining is None else remaining - ANALYZER_RESERVE_SECONDS
+        if budget is not None and budget <= 0:
+            log_message("AGENT_CUT", f"{agent_name} skipped — no time left before the deadline")
+            return {"data_cut": [agent_name]}
+        def timed_run() -> StateUpdate:
+            with span(f"agent.{agent_name}", products=len(state.get("products", []))):
+                return run_agent_with_reflection(state, agent_name)
+
+        try:
+            result = await asyncio.wait_for(asyncio.to_thread(timed_run), timeout=budget)
+            log_message("AGENT_DONE", f"{agent_name} finished")
+            entries = result.get(output_key, [])
+            product_store.put(output_key, [entry for entry in entries if has_data([entry])])
+            return {output_key: entries, "agents_executed": [agent_name]}
+        except asyncio.TimeoutError:
+            # The worker thread cannot be interrupted; it finishes in the background and
+            # only warms the caches. Products it completed in time are already in the store.
+            found, _ = product_store.lookup(state.get("products", []), output_key)
+            log_message("AGENT_CUT", f"{agent_name} did not finish within {budget:.1f}s — "
+                                     f"continuing with {len(found)} completed products")
+            return {output_key: found, "data_cut": [agent_name]}
+        except Exception as e:
+            log_message("AGENT_ERROR", f"{agent_name} failed: {e}")
+            return {"agents_executed": [agent_name]}
+
+    agent_node.__name__ = f"{agent_name}_node"
+    return agent_node
+
+
+def dispatch_agents(state: dict):
+    """
+    Conditional fan-out after planning: one Send per agent with products still missing
+    from the product store. Each Send carries only what the agent reads.
+    With no products there is nothing to collect, so go straight to the analyzer.
+    """
+    from langgraph.types import Send   # only called inside the compiled graph, where LangGraph is loaded
+    if not state.get("products"):
+        return "analyzer"
+    pending = state.get("pending_fetch", {})
+    sends = [
+        Send(agent_name, {"input": state.get("input", ""), "products": pending[agent_name], "search_hints": {}})
+        for agent_name in state.get("agent_plan", [])
+        if pending.get(agent_name)
+    ]
+    return sends or "reflect_and_score"
+
+
+def assemble_from_store(products: list[str], agent_plan: list[str], done=()) -> StateUpdate:
+    """
+    Fills agent output keys from the product store before any agent is scheduled.
+    Agents whose every product is stored count as executed; the rest are left in
+    pending_fetch with only the products they still need to fetch.
+    Agents in done were already supplied by the caller and are left alone.
+    """
+    update: StateUpdate = {"pending_fetch": {}, "agents_executed": []}
+    for agent_name in agent_plan:
+        if agent_name in done:
+            continue
+        output_key = AGENT_OUTPUT_KEYS[agent_name]
+        found, missing = product_store.lookup(products, output_key)
+        if found:
+            update[output_key] = found
+        if missing:
+            update["pending_fetch"][agent_name] = missing
+        else:
+            update["agents_executed"].append(agent_name)
+    log_message("PRODUCT_STORE", f"served={update['agents_executed']} pending={update['pending_fetch']}")
+    return update
 
-    Phase 2 — EXECUTE (parallel):
-        All planned agents run simultaneously via ThreadPoolExecutor.
-        Each agent still has its own ACT → OBSERVE → REFLECT cycle.
-        Wall-clock time = slowest single agent, not sum of all agents.
 
-    Phase 3 — FINISH (one LLM call):
-        Confidence check. Adds rating_agent if score < 7 and it wasn't in the plan.
+def draft_plan(state: Mapping, prefetch: bool | None = None) -> StateUpdate:
     """
-    try:
-        # ── PHASE 1: PLAN ──
-        log_message("SUPERVISOR", "Parsing query and building plan", {"query": state.get("input")})
+    Blocking planner step: intent, named products and agent plan, with speculative
+    prefetch running during the planner call. Recommendation products are not generated yet.
+    """
+    log_message("SUPERVISOR", "Parsing query and building plan", {"query": state.get("input")})
+    if prefetch is None:
+        prefetch = SPECULATIVE_PREFETCH
+    speculative = start_speculative_prefetch(state.get("input", "")) if prefetch else None
+
+    with span("planner"):
         plan = create_execution_plan(state)
+    if speculative is not None:
+        speculative.reconcile(plan["products"], _prefetch_labels(plan["agents"]))
+    return {"intent": plan["intent"], "products": plan["products"], "agent_plan": plan["agents"]}
+
+
+def complete_plan(state: Mapping, plan: Mapping) -> StateUpdate:
+    """Generates products for recommendation queries and caps the product count."""
+    products = list(plan["products"])
+    # For recommendation queries, generate product list first
+    if plan["intent"] == "recommendation" or not products:
+        log_message("SUPERVISOR", "Recommendation query — generating product list")
+        with span("recommendation"):
+            products = recommendation_agent_node(state).get("products", [])
+
+    if len(products) > MAX_PRODUCTS:
+        log_message("SUPERVISOR", f"{len(products)} products requested — keeping the first {MAX_PRODUCTS}")
+        products = products[:MAX_PRODUCTS]
+    return {"intent": plan["intent"], "products": products, "agent_plan": plan["agent_plan"]}
 
-        intent    = plan["intent"]
-        products  = plan["products"]
-        agent_plan = plan["agents"]
 
-        state = {**state, "intent": intent}
+def plan_query(state: Mapping, prefetch: bool | None = None) -> StateUpdate:
+    """Full planning (draft + products). Used by the supervisor node and the batch runner."""
+    return complete_plan(state, draft_plan(state, prefetch))
 
-        # For recommendation queries, generate product list first
-        if intent == "recommendation" or not products:
-            log_message("SUPERVISOR", "Recommendation query — generating product list")
-            state = recommendation_agent_node(state)
-            products = state.get("products", [])
+
+# ── SUPERVISOR NODE ──
+
+async def supervisor_agent_node(state: dict) -> StateUpdate:
+    """
+    Agentic supervisor — the graph's entry point. Plans only; the graph runs the agents.
+
+    PLAN (fast path or one LLM call):
+        Detects intent, extracts products, and selects minimum agents.
+        For recommendation queries, calls recommendation_agent to generate products first.
+        Products guessed locally from "X vs Y" phrasing are prefetched while the LLM call runs.
+        A state that already carries an agent_plan (batch runs, routes that planned for
+        their cache key) skips the planner; products are generated only if missing.
+
+    Data already in the product store is assembled into state first. Agents still
+    missing products are then fanned out by dispatch_agents as parallel graph nodes,
+    each with its own ACT → OBSERVE → REFLECT cycle, and joined at reflect_and_score.
+    """
+    try:
+        if state.get("agent_plan"):
+            plan = {"intent": state.get("intent", ""), "products": state.get("products") or [],
+                    "agent_plan": state["agent_plan"]}
+            log_message("SUPERVISOR", "Using pre-supplied plan")
+            if not plan["products"]:
+                plan = await asyncio.to_thread(complete_plan, state, plan)
         else:
-            state = {**state, "products": products}
+            plan = await asyncio.to_thread(plan_query, state)
 
+        intent, products, agent_plan = plan["intent"], plan["products"], plan["agent_plan"]
         if not products:
-            return {**state, "collection_complete": True, "current_step": "No products found"}
+            return {"intent": intent, "products": [], "agent_plan": [],
+                    "collection_complete": True, "current_step": "No products found"}
 
         log_message("SUPERVISOR_PLAN", f"intent={intent} products={products} agents={agent_plan}")
-
-        # ── PHASE 2: PARALLEL EXECUTE ──
-        log_message("SUPERVISOR", f"Running {len(agent_plan)} agents in parallel")
-
-        agent_results: dict[str, dict] = {}
-        with ThreadPoolExecutor(max_workers=len(agent_plan)) as executor:
-            future_to_agent = {
-                executor.submit(run_agent_with_reflection, dict(state), agent_name): agent_name
-                for agent_name in agent_plan
-            }
-            for future in as_completed(future_to_agent):
-                agent_name = future_to_agent[future]
-                try:
-                    agent_results[agent_name] = future.result()
-                    log_message("AGENT_DONE", f"{agent_name} finished")
-                except Exception as e:
-                    log_message("AGENT_ERROR", f"{agent_name} failed: {e}")
-                    agent_results[agent_name] = state
-
-        # Merge: each agent writes to its own output key — no conflicts
-        merged = dict(state)
-        for agent_name in agent_plan:
-            if agent_name in agent_results:
-                key = AGENT_OUTPUT_KEYS[agent_name]
-                merged[key] = agent_results[agent_name].get(key, [])
-
-        agents_executed = list(agent_results.keys())
-        merged["agent_plan"] = agent_plan
-        merged["agents_executed"] = agents_executed
-
+        with span("product_store"):
+            stored = assemble_from_store(products, agent_plan, done=state.get("agents_executed") or ())
         return {
-            **merged,
-            "collection_complete": True,
-            "current_step": f"Collection complete. Agents: {agents_executed}",
+            **stored,
+            "intent": intent,
+            "products": products,
+            "agent_plan": agent_plan,
+            "current_step": f"Plan ready. Running {len(stored['pending_fetch'])} agents in parallel",
         }
 
     except Exception as e:
         log_message("SUPERVISOR_ERROR", str(e))
-        import traceback
-        traceback.print_exc()
-        return {**state, "collection_complete": True, "current_step": f"Supervisor error: {str(e)}"}
+        logger.exception("Supervisor failed")
+        return {"products": [], "agent_plan": [],
+                "collection_complete": True, "current_step": f"Supervisor error: {str(e)}"}
@@ -0,0 +1,115 @@
+"""
+Benchmark: end-to-end workflow latency and analyzer context size vs number of products.
+
+SerpAPI and LLM calls are replaced with fixed simulated latencies, so the numbers
+show how the pipeline itself scales with N (and with PRODUCT_CONCURRENCY), not
+network variance. No API keys needed.
+
+Run with: python -m scripts.bench_products [--fetch-ms 300] [--llm-ms 800]
+"""
+import sys
+import time
+import asyncio
+import threading
+import argparse
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core import fanout  # noqa: E402
+from app.core.workflow import create_workflow  # noqa: E402
+from app.core.product_store import product_store  # noqa: E402
+
+ALL_AGENTS = ["product_info_agent", "price_agent", "review_agent", "rating_agent"]
+
+
+def _initial_state(query: str) -> dict:
+    return {
+        "input": query, "intent": "", "products": [], "price_data": [], "review_data": [],
+        "product_info": [], "platform_rating_data": [], "final_recommendation": "",
+        "current_step": "", "missing_data": [], "collection_complete": False,
+        "search_hints": {}, "confidence_score": 0, "analysis_context": "",
+        "agent_plan": [], "agents_executed": [], "data_cut": [],
+    }
+
+
+def run_once(n: int, concurrency: int, fetch_s: float, llm_s: float) -> tuple[float, int]:
+    products = [f"Laptop Model {i}" for i in range(1, n + 1)]
+    plan = {"intent": "comparison", "products": products, "agents": ALL_AGENTS}
+    prompt_chars = []
+
+    def pause(seconds):
+        threading.Event().wait(seconds)
+
+    def fake_fetch(query, max_results=3):
+        pause(fetch_s)
+        return [{"title": query, "snippet": f"{query} display battery camera processor " * 4,
+                 "price": "₹54,990", "source": "Store", "rating": 4.4, "reviews": 1200}] * max_results
+
+    def fake_reviews(query):
+        pause(fetch_s)
+        return [f"{query} review snippet " * 6] * 5
+
+    def fake_classify(snippets, llm):
+        pause(llm_s / 4)
+        return {"positive_reviews": ["Great battery", "Sharp display"], "negative_reviews": ["Heavy"],
+                "review_sentiment": "positive", "review_confidence": "medium"}
+
+    async def fake_reflect(state):
+        await asyncio.sleep(llm_s)
+        return 9, "enough data"
+
+    async def fake_analyzer(llm, prompt, context="LLM"):
+        prompt_chars.append(len(prompt))
+        await asyncio.sleep(llm_s)
+        return "analysis"
+
+    product_store.clear()
+    with patch.object(fanout, "PRODUCT_CONCURRENCY", concurrency), \
+         patch("nodes.supervisor_agent.create_execution_plan", return_value=plan), \
+         patch("nodes.supervisor_agent.SPECULATIVE_PREFETCH", False), \
+         patch("nodes.price_agent.fetch_price_results", side_effect=fake_fetch), \
+         patch("nodes.rating_agent.fetch_platform_ratings", side_effect=fake_fetch), \
+         patch("nodes.product_info_agent.fetch_product_info_snippets", side_effect=fake_fetch), \
+         patch("nodes.review_agent.fetch_review_snippets", side_effect=fake_reviews), \
+         patch("nodes.review_agent.classify_reviews_with_llm", side_effect=fake_classify), \
+         patch("nodes.review_agent.get_llm"), \
+         patch("nodes.reflect_and_score._run", side_effect=fake_reflect), \
+         patch("nodes.analyzer_agent.get_llm"), \
+         patch("nodes.analyzer_agent.ANALYSIS_CACHE", False), \
+         patch("nodes.analyzer_agent.ainvoke_with_retry", side_effect=fake_analyzer):
+        # Analysis memo off: every run times the analyzer, and fake output never reaches the shared cache
+        t0 = time.perf_counter()
+        asyncio.run(create_workflow().ainvoke(_initial_state(f"compare these {n} laptops")))
+        elapsed = time.perf_counter() - t0
+    return elapsed, prompt_chars[0] if prompt_chars else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,2,3,4,8,12,16")
+    parser.add_argument("--concurrency", default="1,4,8")
+    parser.add_argument("--fetch-ms", type=int, default=300)
+    parser.add_argument("--llm-ms", type=int, default=800)
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.sizes.split(",")]
+    limits = [int(x) for x in args.concurrency.split(",")]
+    fetch_s, llm_s = args.fetch_ms / 1000, args.llm_ms / 1000
+
+    print(f"simulated fetch={args.fetch_ms}ms llm={args.llm_ms}ms, all 4 agents, "
+          f"deadline disabled (timings are end-to-end seconds)")
+    header = f"{'N':>3} | " + " | ".join(f"conc={c:<3}" for c in limits) + " | analyzer prompt chars"
+    print(header)
+    print("-" * len(header))
+    for n in sizes:
+        timings, chars = [], 0
+        for limit in limits:
+            elapsed, chars = run_once(n, limit, fetch_s, llm_s)
+            timings.append(f"{elapsed:7.2f}s ")
+        print(f"{n:>3} | " + " | ".join(timings) + f" | {chars}")
+
+
+if __name__ == "__main__":
+    main()
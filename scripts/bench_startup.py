@@ -0,0 +1,87 @@
+"""
+Benchmark: import and startup time of the API, per LLM provider.
+
+Each run is a fresh interpreter (so nothing is already imported or cached) that
+times `import app.main` and then the startup hook (`warm_up`: graph compile and
+provider SDK import). Reports the median and spread over --runs, which heavy
+packages the import alone already loaded, and the slowest top-level packages
+from `python -X importtime`. No API keys or network needed.
+
+Run with: python -m scripts.bench_startup [--runs 5] [--providers gemini qwen]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Packages that should only load in the startup hook (or never, for the other provider)
+HEAVY = ["langgraph", "langchain_core", "langchain_google_genai", "langchain_ollama"]
+
+_PROBE = f"""
+import sys, time, json
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+loaded_by_import = [m for m in {HEAVY!r} if m in sys.modules]
+from app.api.routes import warm_up
+warm_up()
+t2 = time.perf_counter()
+print(json.dumps({{"import_ms": (t1 - t0) * 1000, "warm_up_ms": (t2 - t1) * 1000,
+                  "loaded_by_import": loaded_by_import, "modules": len(sys.modules)}}))
+"""
+
+
+def _env(provider: str) -> dict:
+    return {**os.environ, "LLM_PROVIDER": provider, "LOG_LEVEL": "WARNING"}
+
+
+def run_once(provider: str) -> dict:
+    out = subprocess.run([sys.executable, "-c", _PROBE], cwd=ROOT, env=_env(provider),
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(provider: str, top: int = 8) -> list[tuple[str, float]]:
+    """Top-level packages by cumulative import time (ms) for `import app.main`."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=ROOT,
+                         env=_env(provider), capture_output=True, text=True, check=True)
+    totals = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if "." not in name:
+            totals[name] = max(totals.get(name, 0), int(cumulative) / 1000)
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--providers", nargs="+", default=["gemini", "qwen"])
+    args = parser.parse_args()
+
+    run_once(args.providers[0])     # compile .pyc files so every measured run starts equal
+    print(f"{'provider':>9} | {'import ms':>17} | {'warm_up ms':>17} | {'total ms':>9} | modules | loaded by import")
+    print("-" * 100)
+    for provider in args.providers:
+        runs = [run_once(provider) for _ in range(args.runs)]
+        imports = [r["import_ms"] for r in runs]
+        warm = [r["warm_up_ms"] for r in runs]
+        totals = [r["import_ms"] + r["warm_up_ms"] for r in runs]
+        print(f"{provider:>9} | {statistics.median(imports):8.0f} ± {statistics.pstdev(imports):6.0f} | "
+              f"{statistics.median(warm):8.0f} ± {statistics.pstdev(warm):6.0f} | {statistics.median(totals):9.0f} | "
+              f"{runs[-1]['modules']:7d} | {', '.join(runs[-1]['loaded_by_import']) or '-'}")
+
+    print(f"\nSlowest top-level imports for `import app.main` ({args.providers[0]}):")
+    for name, ms in slowest_imports(args.providers[0]):
+        print(f"  {name:<28} {ms:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Offline batch runner: queries from a JSONL file → results in an output JSONL.
+
+Input lines are {"id": ..., "query": "..."} (id defaults to the line number) or bare
+JSON strings. Every finished query is appended to the output and flushed immediately,
+so the output file is the checkpoint: rerunning the same command skips ids already
+written and only spends SerpAPI/LLM calls on the rest. Queries that fail (quota
+exhausted, provider outage) are not written and are retried on the next run. The
+fetchers swallow their errors and return nothing, so a query whose planned agents
+all came back without data counts as failed too. After
+--max-failures consecutive failures the run stops early. Exit code 2 means some
+queries are left for a rerun.
+
+Queries are processed in chunks through the batch runner, so products shared between
+queries in a chunk are fetched once.
+
+Run with: python -m scripts.run_batch queries.jsonl results.jsonl [--concurrency 4]
+"""
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+load_dotenv()
+
+from app.core.batch import BatchRun  # noqa: E402
+from app.core.config import BATCH_CONCURRENCY  # noqa: E402
+from app.core.guardrails import validate_query  # noqa: E402
+from app.core.product_store import has_data  # noqa: E402
+from app.core.workflow import create_workflow  # noqa: E402
+from nodes.supervisor_agent import AGENT_OUTPUT_KEYS  # noqa: E402
+
+logger = logging.getLogger("run_batch")
+
+
+def load_queries(path: str) -> list[dict]:
+    """Reads input records as {"id", "query"}; blank lines are skipped."""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"query": item}
+            records.append({"id": str(item.get("id", line_no)), "query": str(item.get("query", "")).strip()})
+    return records
+
+
+def completed_ids(path: str) -> set[str]:
+    """Ids already in the output. A torn last line from a crash is ignored (and rerun)."""
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError, TypeError):
+                continue
+    return done
+
+
+def _failure(result) -> str | None:
+    """Why a query should be retried on resume, or None if its result can be checkpointed."""
+    if isinstance(result, Exception):
+        return str(result) or type(result).__name__
+    step = str(result.get("current_step", ""))
+    if step.startswith("Analysis failed"):
+        return step
+    planned = [AGENT_OUTPUT_KEYS[a] for a in result.get("agent_plan") or [] if a in AGENT_OUTPUT_KEYS]
+    if planned and not any(has_data(result.get(key)) for key in planned):
+        # Fetchers return [] on quota errors and HTTP failures instead of raising
+        return f"no data from {', '.join(planned)}"
+    return None
+
+
+def _record(item: dict, result: dict) -> dict:
+    return {
+        "id": item["id"],
+        "query": item["query"],
+        "success": True,
+        "recommendation": result.get("final_recommendation", ""),
+        "agents_executed": result.get("agents_executed", []),
+        "confidence_score": result.get("confidence_score", 0),
+        "products": result.get("products", []),
+    }
+
+
+class _Output:
+    """Append-only JSONL writer; each line is flushed and fsynced before it counts as done."""
+
+    def __init__(self, path: str):
+        # A torn last line would swallow the next record — start on a fresh line
+        needs_newline = os.path.exists(path) and os.path.getsize(path) > 0 and not _ends_with_newline(path)
+        self._file = open(path, "a", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")
+
+    def write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+async def run(input_path: str, output_path: str, concurrency: int = BATCH_CONCURRENCY,
+              chunk_size: int = 50, max_failures: int = 5, workflow=None) -> dict:
+    """Runs every query not yet in the output. Returns a summary of this run."""
+    items = load_queries(input_path)
+    done = completed_ids(output_path)
+    todo = [item for item in items if item["id"] not in done]
+    summary = {"total": len(items), "skipped": len(items) - len(todo),
+               "succeeded": 0, "rejected": 0, "failed": 0, "stopped_early": False}
+    logger.info("%d queries, %d already done, %d to run", len(items), summary["skipped"], len(todo))
+
+    workflow = workflow or create_workflow()
+    output = _Output(output_path)
+    streak = 0
+    try:
+        for start in range(0, len(todo), chunk_size):
+            chunk = []
+            for item in todo[start:start + chunk_size]:
+                error = validate_query(item["query"])
+                if error:
+                    # Rejections are permanent — record them so they are not retried
+                    output.write({"id": item["id"], "query": item["query"], "success": False, "error": error})
+                    summary["rejected"] += 1
+                else:
+                    chunk.append(item)
+
+            batch = BatchRun(workflow, [item["query"] for item in chunk], concurrency)
+            async for index, result in batch.run():
+                item = chunk[index]
+                error = _failure(result)
+                if error:
+                    summary["failed"] += 1
+                    streak += 1
+                    logger.warning("Query %s failed (will retry on resume): %s", item["id"], error)
+                    if streak >= max_failures:
+                        summary["stopped_early"] = True
+                        logger.error("%d consecutive failures — stopping; rerun to resume", streak)
+                        return summary
+                    continue
+                streak = 0
+                output.write(_record(item, result))
+                summary["succeeded"] += 1
+            logger.info("Progress: %d/%d done", summary["skipped"] + summary["succeeded"] + summary["rejected"],
+                        summary["total"])
+    finally:
+        output.close()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of queries")
+    parser.add_argument("output", help="JSONL file for results (also the resume checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--chunk-size", type=int, default=50)
+    parser.add_argument("--max-failures", type=int, default=5,
+                        help="stop after this many consecutive failed queries")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    summary = asyncio.run(run(args.input, args.output, args.concurrency, args.chunk_size, args.max_failures))
+    print(json.dumps(summary))
+    sys.exit(2 if summary["stopped_early"] or summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
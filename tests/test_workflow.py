@@ -124,39 +124,77 @@ def test_info_quality_low_no_keywords():
 def test_price_agent_no_products():
     from nodes.price_agent import price_agent_node
     result = price_agent_node({"products": [], "search_hints": {}})
-    assert result["price_data"] == []
-    assert result["price_available"] is False
+    assert result == {"price_data": []}
 
 def test_product_info_agent_no_products():
     from nodes.product_info_agent import product_info_agent_node
     result = product_info_agent_node({"products": [], "search_hints": {}})
-    assert result["product_info"] == []
-    assert result["info_available"] is False
+    assert result == {"product_info": []}
 
 def test_review_agent_no_products():
     from nodes.review_agent import review_rating_agent_node
     result = review_rating_agent_node({"products": [], "search_hints": {}})
-    assert result["review_data"] == []
-    assert result["review_available"] is False
+    assert result == {"review_data": []}
 
 def test_rating_agent_no_products():
     from nodes.rating_agent import rating_platform_agent_node
     result = rating_platform_agent_node({"products": [], "search_hints": {}})
-    assert result["platform_rating_data"] == []
-    assert result["rating_available"] is False
+    assert result == {"platform_rating_data": []}
 
 
 # ── supervisor with no products ───────────────────────────────────────────────
 
 def test_supervisor_no_products():
-    from nodes.supervisor_agent import supervisor_agent_node
+    import asyncio
+    from nodes.supervisor_agent import supervisor_agent_node, dispatch_agents
     state = {
         "products": [], "agent_plan": [], "agents_executed": [],
         "product_info": [], "price_data": [], "review_data": [],
         "platform_rating_data": [], "search_hints": {}
     }
-    result = supervisor_agent_node(state)
+    plan = {"intent": "recommendation", "products": [], "agents": ["price_agent"]}
+    with patch("nodes.supervisor_agent.create_execution_plan", return_value=plan), \
+         patch("nodes.supervisor_agent.recommendation_agent_node", return_value={"products": []}):
+        result = asyncio.run(supervisor_agent_node(state))
     assert result["collection_complete"] is True
+    assert dispatch_agents({**state, **result}) == "analyzer"
+
+
+# ── agents return deltas ──────────────────────────────────────────────────────
+
+def test_price_agent_returns_only_its_output_key():
+    from nodes.price_agent import price_agent_node
+    with patch("nodes.price_agent.fetch_price_results", return_value=[{"price": "₹79,900"}]):
+        result = price_agent_node({"input": "q", "products": ["iPhone 15"], "search_hints": {}})
+    assert list(result) == ["price_data"]
+    assert result["price_data"][0]["price_confidence"] == "low"
+
+def test_reflection_retry_does_not_mutate_state():
+    from nodes import supervisor_agent
+    seen_hints = []
+
+    def agent(state):
+        seen_hints.append(state.get("search_hints"))
+        return {"price_data": [{"product": "iPhone 15", "price_confidence": "low"}]}
+
+    state = {"products": ["iPhone 15"], "search_hints": {}}
+    with patch.dict("nodes.supervisor_agent.AGENT_MAP", {"price_agent": agent}), \
+         patch("nodes.supervisor_agent.reformulate_queries", return_value={"iPhone 15": "iPhone 15 128GB"}), \
+         patch("nodes.supervisor_agent.time.sleep"):
+        result = supervisor_agent.run_agent_with_reflection(state, "price_agent")
+    assert seen_hints == [{}, {"iPhone 15": "iPhone 15 128GB"}]
+    assert state == {"products": ["iPhone 15"], "search_hints": {}}
+    assert list(result) == ["price_data"]
+
+def test_recommendation_agent_returns_delta():
+    from nodes.recommendation_agent import recommendation_agent_node
+    state = {"input": "best phone"}
+    with patch("nodes.recommendation_agent.SERPAPI_KEY", ""), \
+         patch("nodes.recommendation_agent.get_llm"), \
+         patch("nodes.recommendation_agent.invoke_with_retry", return_value='["Pixel 8", "iPhone 15"]'):
+        result = recommendation_agent_node(state)
+    assert result["products"] == ["Pixel 8", "iPhone 15"]
+    assert state == {"input": "best phone"}
 
 
 # ── search_hints are passed to agents ────────────────────────────────────────
@@ -190,3 +228,1303 @@ def test_agent_falls_back_to_product_name_when_no_hints():
         state = {"products": ["OnePlus 12"], "search_hints": {}}
         price_agent_node(state)
         mock_fetch.assert_called_once_with("OnePlus 12")
+
+
+# ── query grammar ─────────────────────────────────────────────────────────────
+
+from app.core.query_grammar import extract_comparison_products
+
+def test_extract_vs_strips_aspect_words():
+    assert extract_comparison_products("iPhone 15 vs Samsung S24 price") == ["iPhone 15", "Samsung S24"]
+
+def test_extract_or_strips_framing_words():
+    query = "which is more affordable iPhone 14 Pro Max or iPhone 15"
+    assert extract_comparison_products(query) == ["iPhone 14 Pro Max", "iPhone 15"]
+
+def test_extract_compare_and():
+    assert extract_comparison_products("compare iphone 15 and s24") == ["iphone 15", "s24"]
+
+def test_extract_not_confident_for_recommendation():
+    assert extract_comparison_products("best phone under 30000") == []
+
+def test_extract_not_confident_for_generic_names():
+    assert extract_comparison_products("iphone vs pixel") == []
+
+
+# ── speculative prefetch ──────────────────────────────────────────────────────
+
+from app.core.prefetch import SpeculativePrefetch
+
+def test_prefetch_reconcile_discards_unplanned_products():
+    import threading
+    release = threading.Event()
+    fetched = []
+
+    def slow_fetch(product):
+        release.wait(timeout=5)
+        fetched.append(product)
+
+    # Occupy every prefetch worker so queued fetches are still cancellable
+    blockers = SpeculativePrefetch([f"Blocker {i}" for i in range(6)], {"shopping": slow_fetch}).start()
+    prefetch = SpeculativePrefetch(["iPhone 15", "Samsung S24"], {"shopping": slow_fetch}).start()
+    stats = prefetch.reconcile(["iphone 15", "Google Pixel 8"])
+    release.set()
+
+    assert stats["kept"] == ["iphone 15"]
+    assert stats["discarded"] == ["samsung s24"]
+    assert stats["cancelled"] == 1
+    blockers.reconcile([f"Blocker {i}" for i in range(6)])
+
+def test_cached_get_coalesces_concurrent_requests():
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from app.core import http_client
+
+    started = threading.Event()
+    calls = []
+
+    def fake_get(url, params, timeout):
+        calls.append(params["q"])
+        started.set()
+        threading.Event().wait(0.2)
+        response = MagicMock()
+        response.json.return_value = {"shopping_results": []}
+        return response
+
+    with patch.object(http_client.get_session(), "get", side_effect=fake_get):
+        params = {"q": "coalesce-test-unique"}
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            first = pool.submit(http_client.cached_get, "https://example.test", params)
+            started.wait(timeout=2)
+            second = pool.submit(http_client.cached_get, "https://example.test", params)
+            assert first.result() == second.result() == {"shopping_results": []}
+
+    assert calls == ["coalesce-test-unique"]
+
+
+# ── fast-path planner ─────────────────────────────────────────────────────────
+
+from app.core.query_grammar import fast_plan, select_agents
+
+def test_select_agents_price_and_specs():
+    assert select_agents("compare specs and price of OnePlus 12 vs Pixel 8") == ["price_agent", "product_info_agent"]
+
+def test_select_agents_broad_query_runs_all():
+    assert select_agents("compare Samsung Galaxy S24 vs iPhone 15") == [
+        "price_agent", "product_info_agent", "review_agent", "rating_agent"]
+
+def test_fast_plan_comparison():
+    plan, reason = fast_plan("iPhone 15 vs Samsung S24 price")
+    assert reason == "comparison_grammar"
+    assert plan == {"intent": "comparison", "products": ["iPhone 15", "Samsung S24"], "agents": ["price_agent"]}
+
+def test_fast_plan_recommendation_with_budget():
+    plan, reason = fast_plan("best phone under 30000")
+    assert reason == "recommendation_cue"
+    assert plan["intent"] == "recommendation"
+    assert plan["products"] == []
+
+def test_fast_plan_falls_back_on_model_mention():
+    plan, reason = fast_plan("best camera on iPhone 15 Pro")
+    assert plan is None
+    assert reason == "possible_product_mention"
+
+@pytest.mark.parametrize("query", [
+    "is macbook air good for students",
+    "top features of the macbook air",
+    "best pixel for photography",
+])
+def test_fast_plan_defers_recommendations_naming_a_product_line(query):
+    plan, reason = fast_plan(query)
+    assert plan is None and reason == "possible_product_mention"
+
+@pytest.mark.parametrize("query, products", [
+    ("OnePlus 12 vs Pixel 8 under 40000", ["OnePlus 12", "Pixel 8"]),
+    ("Dell XPS 13 vs MacBook Air M2 for coding", ["Dell XPS 13", "MacBook Air M2"]),
+    ("Pixel 8 vs iPhone 15 in India 2024", ["Pixel 8", "iPhone 15"]),
+    ("MacBook Air M2 vs Dell XPS 13 which is lighter", ["MacBook Air M2", "Dell XPS 13"]),
+    ("S24 vs iPhone 15 camera comparison for gaming", ["S24", "iPhone 15"]),
+    ("compare pixel 8 and iphone 15 for students", ["pixel 8", "iphone 15"]),
+])
+def test_fast_plan_cuts_trailing_clauses_from_product_names(query, products):
+    plan, _ = fast_plan(query)
+    assert plan["products"] == products
+
+@pytest.mark.parametrize("query, products", [
+    ("iphone 15, pixel 8 or s24 - which has better camera", ["iphone 15", "pixel 8", "s24"]),
+    ("pixel 8, iphone 15 or galaxy s24", ["pixel 8", "iphone 15", "galaxy s24"]),
+    ("iphone 15, pixel 8 vs s24", ["iphone 15", "pixel 8", "s24"]),
+    ("pixel 8 vs iphone 15, which is better", ["pixel 8", "iphone 15"]),
+])
+def test_fast_plan_splits_comma_lists(query, products):
+    plan, reason = fast_plan(query)
+    assert reason == "comparison_grammar" and plan["products"] == products
+
+def test_fast_plan_defers_names_with_leftover_framing_words():
+    plan, reason = fast_plan("Galaxy S24 best deal today vs iPhone 15")
+    assert plan is None and reason == "unspecific_products"
+
+def test_execution_plan_skips_llm_on_fast_path():
+    from nodes import supervisor_agent
+    with patch("nodes.supervisor_agent.invoke_with_retry") as mock_llm:
+        plan = supervisor_agent.create_execution_plan({"input": "Pixel 8 vs OnePlus 12 reviews"})
+    mock_llm.assert_not_called()
+    assert plan["products"] == ["Pixel 8", "OnePlus 12"]
+    assert plan["agents"] == ["review_agent"]
+
+def test_execution_plan_falls_back_to_llm():
+    from nodes import supervisor_agent
+    before = supervisor_agent.planner_stats()["llm"]
+    llm_reply = '{"intent":"comparison","products":["iPhone 15"],"agents":["review_agent"]}'
+    with patch("nodes.supervisor_agent.invoke_with_retry", return_value=llm_reply) as mock_llm, \
+         patch("nodes.supervisor_agent.get_llm"):
+        plan = supervisor_agent.create_execution_plan({"input": "is the iPhone 15 worth it"})
+    mock_llm.assert_called_once()
+    assert plan["products"] == ["iPhone 15"]
+    assert supervisor_agent.planner_stats()["llm"] == before + 1
+
+
+# ── graph fan-out ─────────────────────────────────────────────────────────────
+
+def _initial_state(query: str) -> dict:
+    return {
+        "input": query, "intent": "", "products": [], "price_data": [], "review_data": [],
+        "product_info": [], "platform_rating_data": [], "final_recommendation": "",
+        "current_step": "", "missing_data": [], "collection_complete": False,
+        "search_hints": {}, "confidence_score": 0, "analysis_context": "",
+        "agent_plan": [], "agents_executed": [],
+    }
+
+def _fake_agents():
+    return {
+        "price_agent": lambda s: {"price_data": [
+            {"product": p, "prices": [{"price": "₹1"}], "price_confidence": "high"} for p in s["products"]]},
+        "product_info_agent": lambda s: {"product_info": [
+            {"product": p, "info": [{"snippet": "x"}], "info_quality": "high"} for p in s["products"]]},
+        "review_agent": lambda s: {"review_data": []},
+        "rating_agent": lambda s: {"platform_rating_data": [
+            {"product": p, "ratings": [{"rating": 4.5}], "rating_confidence": "high"} for p in s["products"]]},
+    }
+
+def _run_graph(query: str, plan: dict, scores: list[int], agents: dict = None,
+               deadline: float = None, clear_store: bool = True) -> dict:
+    import asyncio
+    from app.core.workflow import create_workflow
+    from app.core.request_context import deadline_var, set_deadline
+    score_iter = iter(scores)
+
+    async def fake_score(state):
+        return next(score_iter), "ok"
+
+    async def fake_llm(llm, prompt, context="LLM"):
+        return "final answer"
+
+    from app.core.product_store import product_store
+    if clear_store:
+        product_store.clear()
+    token = deadline_var.set(None)
+    if deadline is not None:
+        set_deadline(deadline)
+    with patch.dict("nodes.supervisor_agent.AGENT_MAP", agents or _fake_agents()), \
+         patch("nodes.supervisor_agent.create_execution_plan", return_value=plan), \
+         patch("nodes.supervisor_agent.SPECULATIVE_PREFETCH", False), \
+         patch("nodes.supervisor_agent.time.sleep"), \
+         patch("nodes.reflect_and_score._run", side_effect=fake_score), \
+         patch("nodes.analyzer_agent.get_llm"), \
+         patch("nodes.analyzer_agent.ainvoke_with_retry", side_effect=fake_llm):
+        try:
+            return asyncio.run(create_workflow().ainvoke(_initial_state(query)))
+        finally:
+            deadline_var.reset(token)
+
+def test_graph_fans_out_only_planned_agents():
+    plan = {"intent": "comparison", "products": ["iPhone 15", "Pixel 8"],
+            "agents": ["price_agent", "product_info_agent"]}
+    result = _run_graph("iPhone 15 vs Pixel 8 price and specs", plan, scores=[9])
+    assert sorted(result["agents_executed"]) == ["price_agent", "product_info_agent"]
+    assert [p["product"] for p in result["price_data"]] == ["iPhone 15", "Pixel 8"]
+    assert len(result["product_info"]) == 2
+    assert result["platform_rating_data"] == []
+    assert result["final_recommendation"] == "final answer"
+
+def test_graph_low_score_runs_rating_fallback_once():
+    plan = {"intent": "comparison", "products": ["iPhone 15", "Pixel 8"], "agents": ["price_agent"]}
+    result = _run_graph("iPhone 15 vs Pixel 8 price", plan, scores=[4, 8])
+    assert result["agents_executed"] == ["price_agent", "rating_agent"]
+    assert len(result["platform_rating_data"]) == 2
+    assert result["confidence_score"] == 8
+
+
+# ── request deadline ──────────────────────────────────────────────────────────
+
+from app.core.request_context import budget_short, time_remaining, deadline_var, set_deadline
+
+def test_no_deadline_is_never_short():
+    token = deadline_var.set(None)
+    try:
+        assert time_remaining() is None
+        assert budget_short(1000) is False
+    finally:
+        deadline_var.reset(token)
+
+def test_budget_short_near_deadline():
+    token = deadline_var.set(None)
+    try:
+        set_deadline(5)
+        assert budget_short(10) is True
+        assert budget_short(1) is False
+    finally:
+        deadline_var.reset(token)
+
+def test_deadline_cuts_slow_agent_and_still_analyzes():
+    import threading
+    agents = _fake_agents()
+    agents["review_agent"] = lambda s: (threading.Event().wait(1.0), {"review_data": []})[1]
+    plan = {"intent": "comparison", "products": ["iPhone 15", "Pixel 8"],
+            "agents": ["price_agent", "review_agent"]}
+    with patch("nodes.supervisor_agent.ANALYZER_RESERVE_SECONDS", 0.2), \
+         patch("nodes.reflect_and_score.ANALYZER_RESERVE_SECONDS", 0), \
+         patch("nodes.reflect_and_score.REFLECT_RESERVE_SECONDS", 0), \
+         patch("nodes.reflect_and_score.RETRY_RESERVE_SECONDS", 100):
+        result = _run_graph("iPhone 15 vs Pixel 8", plan, scores=[4], agents=agents, deadline=0.6)
+    assert result["agents_executed"] == ["price_agent"]
+    # review_agent overran; rating fallback skipped because no budget remained for it
+    assert result["data_cut"] == ["review_agent", "rating_agent"]
+    assert len(result["price_data"]) == 2
+    assert result["final_recommendation"] == "final answer"
+
+def test_deadline_skips_reformulation_retry():
+    from nodes import supervisor_agent
+    calls = []
+    poor_agent = lambda s: (calls.append(s.get("search_hints")), {"price_data": []})[1]
+    token = deadline_var.set(None)
+    try:
+        set_deadline(1)
+        with patch.dict("nodes.supervisor_agent.AGENT_MAP", {"price_agent": poor_agent}), \
+             patch("nodes.supervisor_agent.reformulate_queries") as mock_reformulate, \
+             patch("nodes.supervisor_agent.time.sleep"):
+            supervisor_agent.run_agent_with_reflection({"products": ["iPhone 15"]}, "price_agent")
+    finally:
+        deadline_var.reset(token)
+    mock_reformulate.assert_not_called()
+    assert len(calls) == 1
+
+def test_invalid_deadline_payload_rejected():
+    from fastapi import HTTPException
+    from app.api.routes import _deadline_seconds
+    with pytest.raises(HTTPException):
+        _deadline_seconds({"deadline_seconds": -1})
+    assert _deadline_seconds({"deadline_seconds": 10_000}) == pytest.approx(120)
+
+
+# ── product knowledge store ───────────────────────────────────────────────────
+
+from app.core.product_store import ProductStore
+
+def test_product_store_separate_ttls_per_data_type():
+    store = ProductStore({"price_data": 0, "product_info": 3600})
+    store.put("price_data", [{"product": "iPhone 15", "prices": [1]}])
+    store.put("product_info", [{"product": "iPhone 15", "info": [1]}])
+    assert store.get("iPhone 15", "price_data") is None
+    assert store.get("iphone  15", "product_info") == {"product": "iPhone 15", "info": [1]}
+
+def test_product_store_lookup_splits_found_and_missing():
+    store = ProductStore({"price_data": 3600})
+    store.put("price_data", [{"product": "Samsung S24", "prices": [1]}])
+    found, missing = store.lookup(["samsung s24", "Pixel 8"], "price_data")
+    assert found == [{"product": "samsung s24", "prices": [1]}]
+    assert missing == ["Pixel 8"]
+
+def test_product_store_evicts_least_recently_used():
+    store = ProductStore({"price_data": 3600}, maxsize=2)
+    store.put("price_data", [{"product": "A 1"}, {"product": "B 2"}])
+    store.get("A 1", "price_data")
+    store.put("price_data", [{"product": "C 3"}])
+    assert store.get("B 2", "price_data") is None
+    assert store.get("A 1", "price_data") is not None
+
+def test_graph_fetches_only_products_missing_from_store():
+    fetched = []
+    agents = _fake_agents()
+    price = agents["price_agent"]
+    agents["price_agent"] = lambda s: (fetched.append(list(s["products"])), price(s))[1]
+
+    first = {"intent": "comparison", "products": ["iPhone 15", "Samsung S24"], "agents": ["price_agent"]}
+    _run_graph("iPhone 15 vs Samsung S24 price", first, scores=[9], agents=agents)
+    second = {"intent": "comparison", "products": ["Samsung S24", "Pixel 8"], "agents": ["price_agent"]}
+    result = _run_graph("Samsung S24 vs Pixel 8 price", second, scores=[9], agents=agents, clear_store=False)
+
+    assert fetched == [["iPhone 15", "Samsung S24"], ["Pixel 8"]]
+    assert sorted(p["product"] for p in result["price_data"]) == ["Pixel 8", "Samsung S24"]
+
+
+# ── product canonicalization ──────────────────────────────────────────────────
+
+from app.core.product_index import ProductIndex, signature
+
+def test_signature_strips_listing_decorations():
+    assert signature("Galaxy S24 5G (Onyx Black, 256GB)") == "samsung s24"
+    assert signature("Apple iPhone 15 (128 GB) - Black") == "iphone 15"
+    assert signature("iphone15") == "iphone 15"
+
+def test_index_resolves_spelling_variants_to_one_id():
+    index = ProductIndex()
+    ids = {index.resolve(n) for n in ["Samsung Galaxy S24", "Galaxy S24 5G (Onyx Black, 256GB)", "samsung s24"]}
+    assert ids == {"samsung s24"}
+    assert index.search_name("samsung s24") == "Samsung Galaxy S24"
+
+def test_index_keeps_variants_apart():
+    index = ProductIndex()
+    assert index.resolve("Samsung Galaxy S24") != index.resolve("Samsung Galaxy S24 Ultra")
+    assert index.resolve("OnePlus 12") != index.resolve("OnePlus 12R")
+
+def test_index_fuzzy_match_learns_alias():
+    index = ProductIndex()
+    index.resolve("Samsung Galaxy S24")
+    assert index.resolve("samsng s24") == "samsung s24"
+    assert index.stats()["fuzzy"] == 1
+    index.resolve("samsng s24")
+    assert index.stats()["fuzzy"] == 1
+
+def test_product_store_shares_entries_across_spellings():
+    store = ProductStore({"price_data": 3600})
+    store.put("price_data", [{"product": "Samsung Galaxy S24", "prices": [1]}])
+    found, missing = store.lookup(["samsung s24"], "price_data")
+    assert missing == []
+    assert found[0]["product"] == "samsung s24"
+
+
+# ── N-product collection ──────────────────────────────────────────────────────
+
+from app.core.fanout import collect_per_product
+
+def test_collect_per_product_keeps_order_and_bounds_concurrency():
+    import threading
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def fetch_one(product):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        threading.Event().wait(0.02)
+        with lock:
+            active[0] -= 1
+        return {"product": product}
+
+    products = [f"Laptop {i}" for i in range(8)]
+    result = collect_per_product(products, fetch_one, limit=3)
+    assert [r["product"] for r in result] == products
+    assert peak[0] <= 3
+
+def test_collect_per_product_skips_failed_products():
+    def fetch_one(product):
+        if product == "Bad 1":
+            raise RuntimeError("boom")
+        return {"product": product}
+    assert collect_per_product(["Good 1", "Bad 1", "Good 2"], fetch_one) == [
+        {"product": "Good 1"}, {"product": "Good 2"}]
+
+def test_price_agent_handles_more_than_three_products():
+    from nodes.price_agent import price_agent_node
+    products = [f"Laptop {i}" for i in range(1, 7)]
+    with patch("nodes.price_agent.fetch_price_results", return_value=[]):
+        result = price_agent_node({"products": products, "search_hints": {}})
+    assert [p["product"] for p in result["price_data"]] == products
+
+def test_analyzer_summarizes_many_products():
+    import asyncio
+    from nodes.analyzer_agent import analyzer_agent_node
+    products = [f"Laptop {i}" for i in range(1, 6)]
+    state = {
+        "input": "compare these laptops", "products": products,
+        "price_data": [{"product": p, "prices": [{"store": "S", "price": "₹1"}] * 3,
+                        "price_range": {"min_price": 1, "max_price": 1}} for p in products],
+        "review_data": [], "product_info": [], "platform_rating_data": [],
+    }
+    prompts = []
+
+    async def fake_llm(llm, prompt, context="LLM"):
+        prompts.append(prompt)
+        return "ok"
+
+    with patch("nodes.analyzer_agent.get_llm"), \
+         patch("nodes.analyzer_agent.ainvoke_with_retry", side_effect=fake_llm):
+        asyncio.run(analyzer_agent_node(state))
+    assert '"product_summaries"' in prompts[0]
+    assert '"price_data"' not in prompts[0]
+
+
+# ── batch runs ────────────────────────────────────────────────────────────────
+
+def _run_batch(queries: list[str], plans: dict, agents: dict) -> tuple[list, dict]:
+    import asyncio
+    from app.core.batch import BatchRun
+    from app.core.workflow import create_workflow
+    from app.core.product_store import product_store
+
+    async def fake_score(state):
+        return 9, "ok"
+
+    async def fake_llm(llm, prompt, context="LLM"):
+        return "final answer"
+
+    async def collect(batch):
+        return [item async for item in batch.run()]
+
+    product_store.clear()
+    batch = BatchRun(create_workflow(), queries, concurrency=3)
+    with patch.dict("nodes.supervisor_agent.AGENT_MAP", agents), \
+         patch("nodes.supervisor_agent.create_execution_plan", side_effect=lambda s: plans[s["input"]]), \
+         patch("nodes.supervisor_agent.time.sleep"), \
+         patch("nodes.reflect_and_score._run", side_effect=fake_score), \
+         patch("nodes.analyzer_agent.get_llm"), \
+         patch("nodes.analyzer_agent.ainvoke_with_retry", side_effect=fake_llm):
+        return asyncio.run(collect(batch)), batch.stats
+
+def test_batch_fetches_shared_products_once():
+    fetched = []
+    agents = _fake_agents()
+    price = agents["price_agent"]
+    agents["price_agent"] = lambda s: (fetched.extend(s["products"]), price(s))[1]
+    plans = {
+        "iPhone 15 vs Samsung S24 price": {"intent": "comparison", "agents": ["price_agent"],
+                                           "products": ["iPhone 15", "Samsung S24"]},
+        "samsung s24 vs Pixel 8 price": {"intent": "comparison", "agents": ["price_agent"],
+                                         "products": ["samsung s24", "Pixel 8"]},
+    }
+    results, stats = _run_batch(list(plans), plans, agents)
+
+    assert len(fetched) == 3
+    assert stats["requested_fetches"] == 4 and stats["unique_fetches"] == 3
+    assert sorted(index for index, _ in results) == [0, 1]
+    second = dict(results)[1]
+    assert second["final_recommendation"] == "final answer"
+    assert sorted(p["product"] for p in second["price_data"]) == ["Pixel 8", "samsung s24"]
+    assert second["agents_executed"] == ["price_agent"]
+
+def test_batch_reports_failed_plan_and_runs_the_rest():
+    plans = {"ok query": {"intent": "comparison", "agents": ["price_agent"], "products": ["Pixel 8"]}}
+    results, stats = _run_batch(["broken query", "ok query"], plans, _fake_agents())
+    by_index = dict(results)
+    assert isinstance(by_index[0], Exception)
+    assert by_index[1]["final_recommendation"] == "final answer"
+    assert stats["failed"] == 1
+
+def test_offline_batch_resumes_without_rerunning_done_queries(tmp_path):
+    import asyncio
+    import json
+    from scripts import run_batch
+
+    source, output = tmp_path / "queries.jsonl", tmp_path / "results.jsonl"
+    source.write_text("\n".join(json.dumps({"id": i, "query": f"Phone {i} price"}) for i in range(3)))
+    plan = {"intent": "comparison", "agents": ["price_agent"], "products": ["Phone X1"]}
+    ran = []
+
+    class FakeWorkflow:
+        def __init__(self, failing=()):
+            self.failing = failing
+
+        async def ainvoke(self, state):
+            ran.append(state["input"])
+            if state["input"] in self.failing:
+                return {"current_step": "Analysis failed: quota exceeded"}
+            return {**state, "final_recommendation": "ok", "current_step": "Analysis complete"}
+
+    with patch.dict("nodes.supervisor_agent.AGENT_MAP", _fake_agents()), \
+         patch("nodes.supervisor_agent.create_execution_plan", return_value=plan), \
+         patch("nodes.supervisor_agent.time.sleep"):
+        first = asyncio.run(run_batch.run(str(source), str(output), workflow=FakeWorkflow({"Phone 1 price"})))
+        second = asyncio.run(run_batch.run(str(source), str(output), workflow=FakeWorkflow()))
+
+    assert first["succeeded"] == 2 and first["failed"] == 1
+    assert second["skipped"] == 2 and second["succeeded"] == 1
+    assert ran.count("Phone 1 price") == 2 and len(ran) == 4
+    assert sorted(json.loads(l)["id"] for l in output.read_text().splitlines()) == ["0", "1", "2"]
+
+def test_offline_batch_retries_queries_whose_fetchers_failed(tmp_path):
+    import asyncio
+    import json
+    from scripts import run_batch
+    from app.core.product_store import product_store
+
+    source, output = tmp_path / "queries.jsonl", tmp_path / "results.jsonl"
+    source.write_text("\n".join(json.dumps({"id": i, "query": f"Phone {i} price"}) for i in range(3)))
+
+    class Workflow:
+        async def ainvoke(self, state):
+            return {**state, "final_recommendation": "ok", "current_step": "Analysis complete"}
+
+    def run(fetch):
+        product_store.clear()
+        plans = lambda s: {"intent": "comparison", "agents": ["price_agent"], "products": [s["input"][:7]]}
+        with patch.dict("os.environ", {"SERP_API_KEY": "test"}), \
+             patch("nodes.price_agent.cached_get", side_effect=fetch), \
+             patch("nodes.supervisor_agent.create_execution_plan", side_effect=plans), \
+             patch("nodes.supervisor_agent.reformulate_queries", return_value={}), \
+             patch("nodes.supervisor_agent.time.sleep"):
+            return asyncio.run(run_batch.run(str(source), str(output), chunk_size=1, max_failures=2,
+                                             workflow=Workflow()))
+
+    def quota_error(url, params):
+        raise RuntimeError("429 quota exceeded")
+
+    first = run(quota_error)
+    assert first["failed"] == 2 and first["succeeded"] == 0 and first["stopped_early"]
+    assert output.read_text() == ""          # nothing checkpointed, so nothing is skipped on resume
+
+    second = run(lambda url, params: {"shopping_results": [{"source": "S", "title": "t", "price": "₹1"}]})
+    assert second["skipped"] == 0 and second["succeeded"] == 3
+
+
+# ── shared route cache ────────────────────────────────────────────────────────
+
+from app.core.response_cache import SQLiteResponseCache
+
+def test_route_cache_shared_between_processes_via_file(tmp_path):
+    path = str(tmp_path / "cache.db")
+    worker_a = SQLiteResponseCache(path, ttl_seconds=3600, max_entries=10, max_bytes=10_000)
+    worker_b = SQLiteResponseCache(path, ttl_seconds=3600, max_entries=10, max_bytes=10_000)
+    worker_a.set("k", {"recommendation": "buy it"})
+    assert worker_b.get("k") == {"recommendation": "buy it"}
+    assert worker_b.get("missing") is None
+    worker_b.flush()        # read bookkeeping is batched per worker
+    assert worker_a.stats()["hits"] == 1 and worker_a.stats()["misses"] == 1
+
+def test_route_cache_reads_do_not_wait_for_a_writer(tmp_path):
+    import sqlite3
+    path = str(tmp_path / "c.db")
+    cache = SQLiteResponseCache(path, ttl_seconds=3600, max_entries=10, max_bytes=10_000)
+    cache.set("k", {"recommendation": "buy it"})
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")      # another worker mid-write
+    try:
+        assert cache.get("k") == {"recommendation": "buy it"}
+    finally:
+        writer.execute("ROLLBACK")
+    assert cache.stats()["hits"] == 1
+
+def test_plan_hit_links_the_query_without_rewriting_the_answer(tmp_path):
+    import json
+    import time
+    import asyncio
+    from app.api import routes
+    from app.core.semantic_cache import NearDuplicateIndex
+    cache = SQLiteResponseCache(str(tmp_path / "c.db"), ttl_seconds=3600, max_entries=10, max_bytes=10_000)
+    created = time.time() - 1000
+    cache.load_entries([["plan:x", json.dumps({"recommendation": "Pixel 8"}), created]])
+    index = NearDuplicateIndex()
+    with patch.object(routes, "response_cache", cache), patch.object(routes, "near_duplicates", index), \
+         patch.object(routes, "draft_plan", return_value={}), patch.object(routes, "plan_key", return_value="plan:x"), \
+         patch.object(routes, "REFRESH_AHEAD", False):
+        response = asyncio.run(routes._answer("r1", "Pixel 8 price"))
+        assert routes._cached_entry("Pixel 8 price") == ("plan:x", {"recommendation": "Pixel 8"})
+    assert response == {"recommendation": "Pixel 8", "cached": True}
+    assert {key: at for key, _, at in cache.export_entries()}["plan:x"] == created      # still ages out on time
+    assert index.match("price Pixel 8")[0] == "plan:x"
+
+def test_route_cache_evicts_least_recently_used(tmp_path):
+    cache = SQLiteResponseCache(str(tmp_path / "c.db"), ttl_seconds=3600, max_entries=2, max_bytes=10_000)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+    assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1
+
+def test_route_cache_bounds_bytes_and_expires(tmp_path):
+    cache = SQLiteResponseCache(str(tmp_path / "c.db"), ttl_seconds=3600, max_entries=100, max_bytes=50)
+    cache.set("a", "x" * 30)
+    cache.set("b", "y" * 30)
+    assert cache.get("a") is None and cache.stats()["bytes"] <= 50
+
+    expired = SQLiteResponseCache(str(tmp_path / "e.db"), ttl_seconds=0, max_entries=100, max_bytes=1000)
+    expired.set("a", 1)
+    assert expired.get("a") is None
+    assert expired.stats()["expirations"] == 1 and expired.stats()["entries"] == 0
+
+
+# ── semantic cache keys ───────────────────────────────────────────────────────
+
+from app.core.semantic_cache import NearDuplicateIndex, plan_key
+
+def test_plan_key_ignores_product_order_and_spelling():
+    a = plan_key({"intent": "comparison", "products": ["iPhone 15", "Samsung Galaxy S24"],
+                  "agent_plan": ["price_agent", "review_agent"]}, "iPhone 15 vs S24")
+    b = plan_key({"intent": "comparison", "products": ["samsung s24", "iphone 15"],
+                  "agent_plan": ["review_agent", "price_agent"]}, "compare s24 and iphone 15")
+    c = plan_key({"intent": "comparison", "products": ["iPhone 15", "Samsung S24"],
+                  "agent_plan": ["price_agent"]}, "iPhone 15 vs S24 price")
+    assert a == b and a != c
+
+def test_plan_key_for_recommendations_uses_query_terms():
+    plan = {"intent": "recommendation", "products": [], "agent_plan": ["price_agent"]}
+    assert plan_key(plan, "best phones under 30000") == plan_key(plan, "phones under 30000 best")
+    assert plan_key(plan, "best phones under 30000") != plan_key(plan, "best laptops under 30000")
+
+def test_near_duplicate_index_matches_rephrasings_only():
+    index = NearDuplicateIndex(threshold=0.9)
+    index.add("iPhone 15 vs Samsung S24", "k1")
+    assert index.match("compare samsung s24 and iphone15")[0] == "k1"
+    assert index.match("iPhone 14 vs Samsung S24")[0] is None
+    assert index.match("iPhone 15 vs Samsung S24 reviews")[0] is None
+    assert NearDuplicateIndex(threshold=0.7).match("anything")[0] is None
+
+@pytest.mark.parametrize("cached, query", [
+    ("oneplus 12 review", "oneplus 12r review"),
+    ("samsung galaxy s24 review", "samsung galaxy s24 fe review"),
+    ("pixel 8 vs iphone 15", "pixel 8 pro vs iphone 15"),
+])
+def test_near_duplicate_index_never_matches_another_variant(cached, query):
+    index = NearDuplicateIndex(threshold=0.9)
+    index.add(cached, "k1")
+    assert index.match(query)[0] is None
+    assert index.match(cached)[0] == "k1"
+
+
+# ── in-flight coalescing ──────────────────────────────────────────────────────
+
+from app.core.coalesce import RequestCoalescer
+
+def test_identical_queries_in_one_worker_share_one_run(tmp_path):
+    import asyncio
+    cache = SQLiteResponseCache(str(tmp_path / "c.db"), 3600, 100, 100_000)
+    coalescer = RequestCoalescer(cache, poll_seconds=0.01)
+    runs = []
+
+    async def compute():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return {"recommendation": "shared"}
+
+    async def main():
+        return await asyncio.gather(*(coalescer.run("k", compute, lambda: cache.get("k", False)) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(runs) == 1
+    assert [r for r, _ in results] == [{"recommendation": "shared"}] * 5
+    assert sorted(how for _, how in results) == ["leader"] + ["local"] * 4
+    assert coalescer.stats()["local_joins"] == 4
+
+def test_second_worker_waits_for_first_workers_answer(tmp_path):
+    import asyncio
+    path = str(tmp_path / "c.db")
+    cache_a, cache_b = (SQLiteResponseCache(path, 3600, 100, 100_000) for _ in range(2))
+    worker_a, worker_b = RequestCoalescer(cache_a, poll_seconds=0.01), RequestCoalescer(cache_b, poll_seconds=0.01)
+    runs = []
+
+    async def compute_a():
+        runs.append("a")
+        await asyncio.sleep(0.1)
+        cache_a.set("k", {"recommendation": "from a"})
+        return {"recommendation": "from a"}
+
+    async def compute_b():
+        runs.append("b")
+        return {"recommendation": "from b"}
+
+    async def main():
+        first = asyncio.ensure_future(worker_a.run("k", compute_a, lambda: cache_a.get("k", False)))
+        await asyncio.sleep(0.02)
+        second = await worker_b.run("k", compute_b, lambda: cache_b.get("k", False))
+        return await first, second
+
+    first, second = asyncio.run(main())
+    assert runs == ["a"]
+    assert second == ({"recommendation": "from a"}, "remote")
+
+def test_follower_computes_when_leader_releases_without_answer(tmp_path):
+    import asyncio
+    cache = SQLiteResponseCache(str(tmp_path / "c.db"), 3600, 100, 100_000)
+    cache.acquire_lease("k", "other-worker", seconds=0.05)
+    coalescer = RequestCoalescer(cache, poll_seconds=0.01)
+
+    async def compute():
+        return {"recommendation": "own"}
+
+    result = asyncio.run(coalescer.run("k", compute, lambda: cache.get("k", False)))
+    assert result == ({"recommendation": "own"}, "leader")
+    assert not cache.lease_held("k")
+
+
+# ── async jobs ────────────────────────────────────────────────────────────────
+
+from app.core.jobs import JobManager, QueueFull
+
+def test_job_runs_in_background_and_reports_stages(tmp_path):
+    import asyncio
+
+    async def run_job(job):
+        job.on_stage("supervisor", {"pending_fetch": {"price_agent": ["Pixel 8"]}})
+        assert job.to_dict()["progress"] == 0.25
+        job.on_stage("price_agent", {})
+        return {"recommendation": "done"}
+
+    async def main():
+        manager = JobManager(run_job, workers=1, queue_size=5, path=str(tmp_path / "jobs.db"))
+        job = await manager.submit("Pixel 8 price", 30)
+        assert job.status == "queued"
+        while manager.get(job.id).status in ("queued", "running"):
+            await asyncio.sleep(0.01)
+        return manager.get(job.id).to_dict()
+
+    status = asyncio.run(main())
+    assert status["status"] == "done" and status["progress"] == 1.0
+    assert [s["stage"] for s in status["stages"]] == ["supervisor", "price_agent"]
+    assert status["result"] == {"recommendation": "done"}
+
+def test_job_queue_is_bounded_and_failures_recorded(tmp_path):
+    import asyncio
+
+    async def run_job(job):
+        raise RuntimeError("quota exceeded")
+
+    async def main():
+        manager = JobManager(run_job, workers=1, queue_size=1, path=str(tmp_path / "jobs.db"))
+        first = await manager.submit("a", 30)
+        with pytest.raises(QueueFull):
+            await manager.submit("b", 30)
+            await manager.submit("c", 30)
+        while manager.get(first.id).status in ("queued", "running"):
+            await asyncio.sleep(0.01)
+        return manager.get(first.id)
+
+    job = asyncio.run(main())
+    assert job.status == "failed" and "quota" in job.error
+
+def test_finished_jobs_expire_after_retention(tmp_path):
+    import asyncio
+    manager = JobManager(None, retention_seconds=0, max_retained=10, path=str(tmp_path / "a.db"))
+    job = asyncio.run(manager.add_finished("cached query", {"recommendation": "x"}))
+    assert manager.get(job.id) is None
+    manager = JobManager(None, retention_seconds=3600, max_retained=1, path=str(tmp_path / "b.db"))
+    old = asyncio.run(manager.add_finished("a", {}))
+    new = asyncio.run(manager.add_finished("b", {}))
+    assert manager.get(old.id) is None and manager.get(new.id) is not None
+
+def test_job_is_readable_from_another_worker(tmp_path):
+    import asyncio
+    path = str(tmp_path / "jobs.db")
+    other_worker = JobManager(None, path=path)
+    seen = []
+
+    async def run_job(job):
+        job.on_stage("supervisor", {"pending_fetch": {"price_agent": ["Pixel 8"]}})
+        for _ in range(100):        # stage progress reaches the store without being awaited
+            polled = other_worker.get(job.id)
+            if polled.stages:
+                break
+            await asyncio.sleep(0.01)
+        seen.append(polled.to_dict())
+        return {"recommendation": "done"}
+
+    async def main():
+        manager = JobManager(run_job, workers=1, queue_size=5, path=path)
+        job = await manager.submit("Pixel 8 price", 30)
+        assert other_worker.get(job.id).status in ("queued", "running")
+        while other_worker.get(job.id).status in ("queued", "running"):
+            await asyncio.sleep(0.01)
+        return other_worker.get(job.id).to_dict()
+
+    status = asyncio.run(main())
+    assert seen[0]["status"] == "running" and seen[0]["progress"] == 0.25
+    assert status["status"] == "done" and status["result"] == {"recommendation": "done"}
+    assert [s["stage"] for s in status["stages"]] == ["supervisor"]
+    assert other_worker.stats()["done"] == 1
+    assert other_worker.get("missing") is None
+
+
+# ── admission control ─────────────────────────────────────────────────────────
+
+from app.core.admission import AdmissionController, Overloaded
+
+def test_admission_sheds_when_wait_exceeds_limit():
+    import asyncio
+    controller = AdmissionController(max_inflight=1, max_queue_wait=5, max_queued=4)
+    controller._service_seconds = 10
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.slot():
+                await release.wait()
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as shed:
+            async with controller.slot():
+                pass
+        release.set()
+        await holder
+        return shed.value
+
+    shed = asyncio.run(main())
+    assert shed.retry_after == 10
+    stats = controller.stats()
+    assert stats["admitted"] == 1 and stats["shed"] == 1 and stats["shed_rate_1m"] == 0.5
+
+def test_admission_queues_short_waits_and_background_work():
+    import asyncio
+    controller = AdmissionController(max_inflight=1, max_queue_wait=5, max_queued=4)
+    controller._service_seconds = 1
+    order = []
+
+    async def run(name, can_shed=True):
+        async with controller.slot(can_shed):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(run("a"), run("b"), run("job", can_shed=False))
+
+    asyncio.run(main())
+    assert order == ["a", "b", "job"]
+    assert controller.stats()["shed"] == 0
+
+
+# ── stage timeline ────────────────────────────────────────────────────────────
+
+from app.core.logger import DebugLogger, debug_logger_var, span, note_cache, StageHistograms, stage_histograms
+
+def test_span_records_parent_and_cache_counts():
+    collector = DebugLogger()
+    token = debug_logger_var.set(collector)
+    try:
+        with span("outer"):
+            with span("inner", product="iPhone 15"):
+                note_cache("http", True)
+                note_cache("http", False)
+                note_cache("http", True)
+    finally:
+        debug_logger_var.reset(token)
+    outer, inner = collector.timeline()
+    assert outer["name"] == "outer" and "parent" not in outer
+    assert inner["parent"] == "outer" and inner["depth"] == 1 and inner["product"] == "iPhone 15"
+    assert inner["http_hits"] == 2 and inner["http_misses"] == 1
+    assert inner["duration_ms"] <= outer["duration_ms"]
+
+def test_stage_histogram_quantiles():
+    histograms = StageHistograms()
+    for ms in [10] * 90 + [700] * 10:
+        histograms.observe("analyzer", ms)
+    stats = histograms.snapshot()["analyzer"]
+    assert stats["count"] == 100
+    assert stats["p50_le_ms"] == 50 and stats["p95_le_ms"] == 1000
+    assert stats["buckets"]["le_50"] == 90
+
+def test_graph_run_produces_stage_timeline():
+    plan = {"intent": "comparison", "products": ["iPhone 15", "Pixel 8"], "agents": ["price_agent"]}
+    collector = DebugLogger()
+    token = debug_logger_var.set(collector)
+    try:
+        _run_graph("iPhone 15 vs Pixel 8 price", plan, scores=[9])
+    finally:
+        debug_logger_var.reset(token)
+    names = [s["name"] for s in collector.timeline()]
+    assert {"planner", "agent.price_agent", "reflect_and_score", "analyzer", "analyzer.llm"} <= set(names)
+    agent = next(s for s in collector.timeline() if s["name"] == "agent.price_agent")
+    assert agent["products"] == 2 and agent["depth"] == 0
+    assert "agent.price_agent" in stage_histograms.snapshot()
+
+
+# ── sampled profiling ─────────────────────────────────────────────────────────
+
+from app.core.profiling import maybe_profile, summarize_profiles
+
+def test_profile_skipped_unless_sampled_or_requested(tmp_path):
+    with patch("app.core.profiling.PROFILE_SAMPLE_RATE", 0):
+        with maybe_profile("r1", directory=str(tmp_path)) as profile:
+            assert profile is None
+    assert list(tmp_path.iterdir()) == []
+
+def test_profiled_graph_run_writes_profile_and_summary(tmp_path):
+    plan = {"intent": "comparison", "products": ["iPhone 15", "Pixel 8"], "agents": ["price_agent"]}
+    with maybe_profile("r2", requested=True, directory=str(tmp_path)) as profile:
+        assert profile is not None
+        _run_graph("iPhone 15 vs Pixel 8 price", plan, scores=[9])
+    names = sorted(p.name for p in tmp_path.iterdir())
+    assert [n.split("-r2")[1] for n in names] == [".alloc.snapshot", ".cpu.pstats", ".json"]
+
+    summary = summarize_profiles(str(tmp_path))
+    assert summary["profiles"] == 1 and summary["cpu_total_ms"] > 0
+    assert summary["cpu_top_self"] and summary["cpu_by_package"]
+    assert {"JsonFormatter.format", "json.dumps", "langgraph state copying"} <= set(summary["suspects"])
+    assert summary["recent"][0]["request_id"] == "r2"
+
+
+# ── logging pipeline ──────────────────────────────────────────────────────────
+
+import io
+import json
+import logging
+from app.core.log_pipeline import LogPipeline, JsonArg, parse_sample_rates
+from app.core.request_context import request_id_var
+
+def _pipeline_logger(pipeline: LogPipeline, name: str) -> logging.Logger:
+    log = logging.getLogger(name)
+    log.handlers, log.propagate = [pipeline.handler], False
+    log.setLevel(logging.DEBUG)
+    return log
+
+def test_log_pipeline_writes_json_lines_with_request_id():
+    stream = io.StringIO()
+    pipeline = LogPipeline(stream=stream).start()
+    log = _pipeline_logger(pipeline, "test.pipeline")
+    data = {"product": "iPhone 15"}
+    token = request_id_var.set("req-1")
+    try:
+        log.info("Fetched %s", data)
+        log.info("%s", JsonArg({"audit": True, "latency_ms": 12}))
+    finally:
+        request_id_var.reset(token)
+    data["product"] = "changed after logging"
+    pipeline.stop()
+    first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert first["request_id"] == "req-1" and first["message"] == "Fetched {'product': 'iPhone 15'}"
+    assert json.loads(second["message"]) == {"audit": True, "latency_ms": 12}
+    assert pipeline.stats()["written"] == 2
+
+def test_log_pipeline_samples_debug_and_drops_when_full():
+    stream = io.StringIO()
+    pipeline = LogPipeline(stream=stream, queue_size=2, sample_rates=parse_sample_rates("test.noisy=0"))
+    log = _pipeline_logger(pipeline, "test.noisy")
+    log.debug("  Data: %s", "big dump")
+    for i in range(3):
+        log.info("line %d", i)
+    pipeline.start()
+    pipeline.stop()
+    stats = pipeline.stats()
+    assert stats["sampled_out"] == 1 and stats["dropped_queue_full"] == 1
+    assert [json.loads(line)["message"] for line in stream.getvalue().splitlines()] == ["line 0", "line 1"]
+
+
+# ── startup ───────────────────────────────────────────────────────────────────
+
+def test_importing_app_defers_langgraph_and_provider_sdks():
+    import subprocess, sys
+    from pathlib import Path
+    probe = ("import sys, app.main; "
+             "print(','.join(m for m in ('langgraph', 'langchain_core', 'langchain_google_genai', 'langchain_ollama') "
+             "if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", probe], cwd=Path(__file__).resolve().parent.parent,
+                         capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == ""
+
+
+# ── prefork memory report ─────────────────────────────────────────────────────
+
+from app.core.memory import parse_smaps_rollup
+
+def test_parse_smaps_rollup_splits_shared_and_private():
+    text = ("55ac7b11e000-7ffeaf84d000 ---p 00000000 00:00 0   [rollup]\n"
+            "Rss:  90952 kB\nPss:  31812 kB\nShared_Clean:  70000 kB\nShared_Dirty:  9056 kB\n"
+            "Private_Clean:  1000 kB\nPrivate_Dirty:  10896 kB\n")
+    assert parse_smaps_rollup(text) == {"rss_kb": 90952, "pss_kb": 31812, "shared_kb": 79056, "private_kb": 11896}
+
+def test_log_pipeline_restarts_writer_after_fork():
+    stream = io.StringIO()
+    pipeline = LogPipeline(stream=stream).start()
+    log = _pipeline_logger(pipeline, "test.fork")
+    pipeline.reset_after_fork()     # what a forked worker runs: fresh queue, new writer thread
+    log.info("from the worker")
+    pipeline.stop()
+    assert [json.loads(line)["message"] for line in stream.getvalue().splitlines()] == ["from the worker"]
+
+
+# ── cache snapshot ────────────────────────────────────────────────────────────
+
+def _snapshot_caches(tmp_path, name: str) -> dict:
+    from app.core.http_client import TTLCache
+    from app.core.product_index import product_index
+    from app.core.response_cache import SQLiteResponseCache
+    from app.core.semantic_cache import NearDuplicateIndex
+    return {
+        "product_index": product_index,
+        "http": TTLCache(ttl_seconds=1800, maxsize=100),
+        "product_store": ProductStore({"price_data": 3600}, maxsize=10),
+        "route": SQLiteResponseCache(str(tmp_path / f"{name}.sqlite3"), 3600, 100, 1 << 20),
+        "near_duplicates": NearDuplicateIndex(),
+    }
+
+def test_cache_snapshot_round_trip_keeps_remaining_ttl(tmp_path):
+    import time
+    from app.core import snapshot
+    old = _snapshot_caches(tmp_path, "old")
+    old["http"].set("fresh", {"organic_results": [1]})
+    old["http"].set("stale", {"organic_results": [2]})
+    old["http"]._timestamps["stale"] -= 2000
+    old["product_store"].put("price_data", [{"product": "Pixel 8", "prices": [{"price": "₹1"}]}])
+    stored_at = time.time() - 3000
+    old["product_store"]._entries[next(iter(old["product_store"]._entries))] = (
+        stored_at, {"product": "Pixel 8", "prices": [{"price": "₹1"}]})
+    old["route"].set("plan:abc", {"recommendation": "Pixel 8"})
+    old["near_duplicates"].add("Pixel 8 vs iPhone 15 price", "plan:abc")
+
+    path = str(tmp_path / "snapshot.json.gz")
+    with patch.dict(snapshot.SECTIONS, old):
+        summary = snapshot.save_snapshot(path)
+    assert summary["sections"]["http"] == 1 and summary["sections"]["route"] == 1
+
+    new = _snapshot_caches(tmp_path, "new")
+    with patch.dict(snapshot.SECTIONS, new):
+        loaded = snapshot.load_snapshot(path)
+    assert loaded["http"] == 1 and loaded["product_store"] == 1 and loaded["route"] == 1
+    assert new["http"].get("fresh") == {"organic_results": [1]} and new["http"].get("stale") is None
+    assert new["product_store"].export_entries()[0][1] == stored_at      # only ~600 s of TTL left
+    assert new["route"].get("plan:abc") == {"recommendation": "Pixel 8"}
+    assert new["near_duplicates"].match("iPhone 15 vs Pixel 8 price")[0] == "plan:abc"
+
+def test_cache_snapshot_merges_prefork_worker_parts(tmp_path):
+    from app.core import snapshot
+    path = str(tmp_path / "snapshot.json.gz")
+    shared = _snapshot_caches(tmp_path, "shared")["route"]
+    shared.set("plan:abc", {"recommendation": "Pixel 8"})
+    for pid, query in ((101, "pixel 8 price"), (102, "iphone 15 price")):
+        worker = {**_snapshot_caches(tmp_path, f"w{pid}"), "route": shared}
+        worker["http"].set(query, {"organic_results": [pid]})
+        with patch.dict(snapshot.SECTIONS, worker):
+            summary = snapshot.save_snapshot(snapshot.worker_part_path(path, pid), snapshot.LOCAL_SECTIONS)
+        assert "route" not in summary["sections"]      # shared SQLite sections are saved once, by the master
+
+    master = {**_snapshot_caches(tmp_path, "master"), "route": shared}
+    with patch.dict(snapshot.SECTIONS, master):
+        summary = snapshot.merge_worker_parts(path)
+    assert summary["worker_parts"] == 2 and summary["sections"]["http"] == 2 and summary["sections"]["route"] == 1
+    assert not list(tmp_path.glob("snapshot.json.gz.worker-*"))
+
+    new = _snapshot_caches(tmp_path, "new")
+    with patch.dict(snapshot.SECTIONS, new):
+        snapshot.load_snapshot(path)
+    assert new["http"].get("pixel 8 price") == {"organic_results": [101]}
+    assert new["http"].get("iphone 15 price") == {"organic_results": [102]}
+    assert new["route"].get("plan:abc") == {"recommendation": "Pixel 8"}
+
+def test_prefork_worker_shutdown_saves_only_its_part(tmp_path):
+    import os
+    from app.api import routes
+    from app.core import memory
+    with patch.object(memory, "_master_pid", os.getpid() + 1), \
+         patch.object(routes, "save_worker_part") as part, patch.object(routes, "save_snapshot") as full:
+        routes.shut_down()
+    assert part.called and not full.called
+
+def test_cache_snapshot_missing_or_corrupt_file_is_ignored(tmp_path):
+    from app.core.snapshot import load_snapshot
+    assert load_snapshot(str(tmp_path / "missing.json.gz")) == {}
+    (tmp_path / "bad.json.gz").write_bytes(b"not gzip")
+    assert load_snapshot(str(tmp_path / "bad.json.gz")) == {}
+
+
+# ── refresh-ahead ─────────────────────────────────────────────────────────────
+
+def _aged_cache(tmp_path, ages: dict[str, float]):
+    import time
+    cache = SQLiteResponseCache(str(tmp_path / "c.db"), ttl_seconds=100, max_entries=100, max_bytes=100_000)
+    for key, age in ages.items():
+        cache.set(key, {"recommendation": f"old {key}"})
+        cache._connect().execute("UPDATE entries SET created = ? WHERE key = ?", (time.time() - age, key))
+    return cache
+
+def test_refresh_candidates_are_popular_entries_close_to_expiry(tmp_path):
+    cache = _aged_cache(tmp_path, {"hot": 80, "warm": 80, "cold": 80, "young": 10})
+    for key, hits in {"hot": 5, "warm": 3, "cold": 1, "young": 9}.items():
+        for _ in range(hits):
+            cache.record_hit(key, f"query {key}", half_life=3600)
+    candidates = cache.refresh_candidates(lead_seconds=30, min_score=2, half_life=3600, limit=10)
+    assert [(key, query) for key, query, _, _ in candidates] == [("hot", "query hot"), ("warm", "query warm")]
+    assert 4.9 < candidates[0][2] <= 5
+
+    cache.record_refresh("hot", cost=7)
+    assert [c[0] for c in cache.refresh_candidates(30, 2, 3600, 10)] == ["warm"]
+
+def test_refresh_cycle_swaps_in_new_answer_and_meters_spend(tmp_path):
+    import asyncio
+    from app.core.admission import AdmissionController
+    from app.core.refresh import RefreshAhead
+    from app.core.request_context import record_spend
+    cache = _aged_cache(tmp_path, {"hot": 80})
+    for _ in range(3):
+        cache.record_hit("hot", "hot query", half_life=3600)
+
+    async def refresh(query):
+        record_spend("serpapi", 4)
+        record_spend("llm", 2)
+        cache.set("hot", {"recommendation": f"new {query}"})
+
+    refresher = RefreshAhead(cache, refresh, gate=AdmissionController(4, 10, 4), lead_seconds=30,
+                             min_score=2, budget_per_hour=100)
+    assert asyncio.run(refresher.run_cycle()) == {"refreshed": 1}
+    assert cache.get("hot") == {"recommendation": "new hot query"}
+    assert cache.spent_since(3600) == 6
+    assert cache.refresh_candidates(30, 2, 3600, 10) == []      # fresh again
+
+def test_refresh_cycle_stops_at_spend_budget(tmp_path):
+    import asyncio
+    from app.core.admission import AdmissionController
+    from app.core.refresh import RefreshAhead
+    cache = _aged_cache(tmp_path, {"a": 80, "b": 80})
+    for key in ("a", "b"):
+        for _ in range(3):
+            cache.record_hit(key, key, half_life=3600)
+    cache.record_spend(95)
+    refreshed = []
+
+    async def refresh(query):
+        refreshed.append(query)
+
+    refresher = RefreshAhead(cache, refresh, gate=AdmissionController(4, 10, 4), lead_seconds=30,
+                             min_score=2, budget_per_hour=100, default_cost=10)
+    assert asyncio.run(refresher.run_cycle()) == {"skipped_budget": 2}
+    assert refreshed == []
+
+
+# ── per-data-type answer freshness ────────────────────────────────────────────
+
+def _answer_result():
+    return {
+        "products": ["iPhone 15", "Galaxy S24"],
+        "agent_plan": ["price_agent", "product_info_agent", "review_agent"],
+        "agents_executed": ["price_agent", "product_info_agent", "review_agent"],
+        "price_data": [{"product": "iPhone 15", "prices": [{"price": "₹79,900"}]}],
+        "product_info": [{"product": "iPhone 15", "info": [{"snippet": "A16"}]}],
+        "review_data": [{"product": "iPhone 15", "reviews": {"positive_reviews": ["camera"]}}],
+    }
+
+def test_cached_answer_is_fresh_until_its_shortest_lived_data(monkeypatch):
+    import time
+    from app.core import answer_sources
+    from app.core.answer_sources import with_sources, is_fresh, public
+    monkeypatch.setattr(answer_sources, "product_store", ProductStore({}, maxsize=10))
+    day_old = time.time() - 86400
+    entry = with_sources({"recommendation": "iPhone"}, _answer_result(), seeded={"review_data": day_old})
+    ttls = answer_sources.PRODUCT_STORE_TTLS
+    assert entry["sources"]["data"]["review_data"]["fetched_at"] == day_old
+    assert abs(entry["fresh_until"] - (time.time() + ttls["price_data"])) < 5
+    assert is_fresh(entry) and not is_fresh(entry, margin=ttls["price_data"])
+    assert public(entry) == {"recommendation": "iPhone"}
+
+def test_stale_prices_rerun_only_price_agent(monkeypatch):
+    import time
+    from app.core import answer_sources
+    from app.core.answer_sources import with_sources, seed_state
+    from nodes import supervisor_agent
+    monkeypatch.setattr(answer_sources, "product_store", ProductStore({}, maxsize=10))
+    monkeypatch.setattr(supervisor_agent, "product_store", ProductStore({}, maxsize=10))
+    entry = with_sources({"recommendation": "iPhone"}, _answer_result())
+    two_hours = 2 * 3600
+    for data in entry["sources"]["data"].values():
+        data["fetched_at"] -= two_hours
+
+    plan = {"intent": "comparison", "products": ["iphone 15", "s24"],
+            "agent_plan": ["price_agent", "product_info_agent", "review_agent"]}
+    state, seeded = seed_state("iphone 15 vs s24", plan, entry)
+    assert sorted(seeded) == ["product_info", "review_data"]
+    assert state["products"] == ["iPhone 15", "Galaxy S24"]
+    assert state["agents_executed"] == ["product_info_agent", "review_agent"]
+    assert state["review_data"] == _answer_result()["review_data"] and state["price_data"] == []
+
+    stored = supervisor_agent.assemble_from_store(state["products"], plan["agent_plan"],
+                                                  done=state["agents_executed"])
+    assert stored["pending_fetch"] == {"price_agent": ["iPhone 15", "Galaxy S24"]}
+
+    # Refresh-ahead only reuses data that stays fresh for its lead time (specs: 7 days)
+    _, seeded = seed_state("iphone 15 vs s24", plan, entry, margin=6 * 86400)
+    assert list(seeded) == ["product_info"]
+
+
+# ── analyzer memoization ──────────────────────────────────────────────────────
+
+@pytest.fixture(autouse=True)
+def _private_llm_caches(tmp_path_factory, monkeypatch):
+    """Every test gets empty analysis and LLM result caches instead of the shared files in the temp dir."""
+    from app.core.llm_cache import LLMResultCache
+    directory = tmp_path_factory.mktemp("llm_caches")
+    cache = SQLiteResponseCache(str(directory / "analysis.sqlite3"), 3600, 100, 1 << 20)
+    monkeypatch.setattr("nodes.analyzer_agent.analysis_cache", cache)
+    results = LLMResultCache(str(directory), {"plan": 3600, "reformulation": 3600, "recommendation": 3600},
+                             100, 1 << 20, enabled=True)
+    monkeypatch.setattr("nodes.supervisor_agent.llm_cache", results)
+    monkeypatch.setattr("nodes.recommendation_agent.llm_cache", results)
+    return results
+
+def _analyze_calls(states: list[dict]) -> tuple[list, int]:
+    import asyncio
+    from nodes.analyzer_agent import analyzer_agent_node
+    calls = []
+
+    async def fake_llm(llm, prompt, context="LLM"):
+        calls.append(prompt)
+        return f"analysis {len(calls)}"
+
+    with patch("nodes.analyzer_agent.get_llm"), \
+         patch("nodes.analyzer_agent.ainvoke_with_retry", side_effect=fake_llm):
+        results = [asyncio.run(analyzer_agent_node(state)) for state in states]
+    return results, len(calls)
+
+def _analysis_state(query: str, products: list[str], **extra) -> dict:
+    return {"input": query, "intent": "comparison", "products": products,
+            "price_data": [{"product": p, "prices": [{"store": "S", "price": "₹1"}]} for p in products],
+            "review_data": [], "product_info": [], "platform_rating_data": [], **extra}
+
+def test_analysis_reused_for_reworded_question_over_same_data():
+    results, calls = _analyze_calls([
+        _analysis_state("iPhone 15 vs Galaxy S24 price", ["iPhone 15", "Galaxy S24"]),
+        _analysis_state("compare the price of galaxy s24 and iphone 15", ["galaxy s24", "iphone 15"]),
+    ])
+    assert calls == 1
+    assert [r["analysis_reused"] for r in results] == [False, True]
+    assert results[1]["final_recommendation"] == "analysis 1"
+
+def test_analysis_not_reused_for_other_aspect_data_or_partial_context():
+    results, calls = _analyze_calls([
+        _analysis_state("iPhone 15 vs Galaxy S24 price", ["iPhone 15", "Galaxy S24"]),
+        _analysis_state("iPhone 15 vs Galaxy S24 camera", ["iPhone 15", "Galaxy S24"]),
+        _analysis_state("iPhone 15 vs Galaxy S24 price", ["iPhone 15", "Galaxy S24 Ultra"]),
+        _analysis_state("iPhone 15 vs Galaxy S24 price", ["iPhone 15", "Galaxy S24"], data_cut=["review_agent"]),
+    ])
+    assert calls == 4
+    assert not any(r["analysis_reused"] for r in results)
+
+
+# ── LLM result caches ─────────────────────────────────────────────────────────
+
+def test_llm_plan_cached_by_query_wording(_private_llm_caches):
+    from nodes.supervisor_agent import _create_execution_plan_llm
+    reply = '{"intent": "recommendation", "products": [], "agents": ["price_agent"]}'
+    with patch("nodes.supervisor_agent.invoke_with_retry", return_value=reply) as mock_llm, \
+         patch("nodes.supervisor_agent.get_llm"):
+        first = _create_execution_plan_llm({"input": "Best phone under 30000?"})
+        second = _create_execution_plan_llm({"input": "best  phone under 30000"})
+        _create_execution_plan_llm({"input": "best phone under 20000"})
+    assert first == second == {"intent": "recommendation", "products": [], "agents": ["price_agent"]}
+    assert mock_llm.call_count == 2
+    assert _private_llm_caches.stats()["plan"]["hits"] == 1
+
+def test_failed_llm_plan_is_not_cached():
+    from nodes.supervisor_agent import _create_execution_plan_llm
+    with patch("nodes.supervisor_agent.invoke_with_retry", return_value="no json here") as mock_llm, \
+         patch("nodes.supervisor_agent.get_llm"):
+        _create_execution_plan_llm({"input": "something odd"})
+        _create_execution_plan_llm({"input": "something odd"})
+    assert mock_llm.call_count == 2
+
+def test_reformulations_cached_per_canonical_product():
+    from nodes.supervisor_agent import reformulate_queries
+    reply = '{"iPhone 15": "Apple iPhone 15 128GB price India"}'
+    with patch("nodes.supervisor_agent.invoke_with_retry", return_value=reply) as mock_llm, \
+         patch("nodes.supervisor_agent.get_llm"):
+        reformulate_queries({"products": ["iPhone 15"]}, "price_agent")
+        hints = reformulate_queries({"products": ["iphone 15"]}, "price_agent")
+        reformulate_queries({"products": ["iPhone 15"]}, "review_agent")
+    assert hints == {"iphone 15": "Apple iPhone 15 128GB price India"}
+    assert mock_llm.call_count == 2
+
+def test_recommendation_llm_products_cached():
+    from nodes.recommendation_agent import recommendation_agent_node
+    with patch("nodes.recommendation_agent.SERPAPI_KEY", None), \
+         patch("nodes.recommendation_agent.get_llm"), \
+         patch("nodes.recommendation_agent.invoke_with_retry", return_value='["Pixel 8", "iPhone 15"]') as mock_llm:
+        first = recommendation_agent_node({"input": "best camera phone"})
+        second = recommendation_agent_node({"input": "Best camera phone!"})
+    assert first["products"] == second["products"] and len(first["products"]) == 2
+    assert mock_llm.call_count == 1